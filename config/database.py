@@ -1,20 +1,112 @@
-
-from pymongo import MongoClient
-from contextlib import contextmanager
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Index
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import IndexModel, ASCENDING
+from contextlib import asynccontextmanager
+from sqlalchemy import create_engine, event, inspect, select, delete, func, Column, Integer, String, Text, DateTime, Index
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import declarative_base, sessionmaker
 from datetime import datetime
+from config.settings import settings
 
-# MongoDB Connection
-MONGO_URI = "mongodb://localhost:27017"
-mongo_client = MongoClient(MONGO_URI)
-mongo_db = mongo_client["contact_management_lokesh"]
+# MongoDB Connection (Motor keeps calls non-blocking on the event loop)
+mongo_client = AsyncIOMotorClient(settings.MONGO_URI)
+mongo_db = mongo_client[settings.MONGO_DB_NAME]
 contacts_collection = mongo_db["contacts"]
 
-# SQLite Connection using SQLAlchemy
-SQLITE_DB_URL = "sqlite:///sqlite_contacts.db"
-engine = create_engine(SQLITE_DB_URL, connect_args={"check_same_thread": False})
+# Index registry for the contacts collection, applied at application startup
+CONTACT_INDEXES = [
+    IndexModel([("user_id", ASCENDING)], name="uniq_user_id", unique=True),
+    IndexModel([("email", ASCENDING)], name="uniq_email", unique=True),
+    IndexModel([("phone", ASCENDING)], name="idx_phone"),
+    # Normalized search fields maintained by the contact handlers (see contact search)
+    IndexModel([("search.name", ASCENDING)], name="idx_search_name"),
+    IndexModel([("search.email", ASCENDING)], name="idx_search_email"),
+    IndexModel([("search.phone", ASCENDING)], name="idx_search_phone"),
+    IndexModel([("search.name_grams", ASCENDING)], name="idx_search_name_grams"),
+    IndexModel([("search.email_grams", ASCENDING)], name="idx_search_email_grams"),
+]
+
+def normalize_email(email: str):
+    """Stored form of a contact email; lowercase so the case-sensitive uniq_email index also rejects case-only twins"""
+    return str(email).strip().lower()
+
+
+# Projection used whenever contacts are returned to clients (hides internal fields)
+CONTACT_PROJECTION = {"_id": 0, "search": 0}
+
+
+def public_contact(contact: dict):
+    """Copy of a stored contact document without the fields hidden by CONTACT_PROJECTION"""
+    return {key: value for key, value in contact.items() if key not in CONTACT_PROJECTION}
+
+
+# Contact fields clients may select with fields=
+CONTACT_FIELDS = {"user_id", "name", "email", "phone", "version"}
+
+
+def contact_projection(fields=None):
+    """Mongo projection for a sparse fieldset; user_id is always kept since it identifies the contact.
+
+    None means every public field; an empty list means user_id alone.
+    """
+    if fields is None:
+        return CONTACT_PROJECTION
+    projection = {"_id": 0, "user_id": 1}
+    projection.update({field: 1 for field in fields})
+    return projection
+
+
+# SQL Connection using SQLAlchemy (URL and pool sizing come from settings)
+def apply_sqlite_pragmas(dbapi_connection, connection_record=None):
+    """Per-connection SQLite tuning: WAL lets readers proceed while a writer commits"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA cache_size=-{settings.SQLITE_CACHE_SIZE_KB}")
+    cursor.close()
+
+
+def _engine_options(url: str):
+    if url.startswith("sqlite"):
+        options = {"connect_args": {"check_same_thread": False}}
+        if ":memory:" not in url:
+            options["pool_size"] = settings.DB_POOL_SIZE
+            options["max_overflow"] = settings.DB_MAX_OVERFLOW
+        return options
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+
+def build_engine(url: str = settings.DATABASE_URL):
+    sync_engine = create_engine(url, echo=settings.DB_ECHO, **_engine_options(url))
+    if sync_engine.dialect.name == "sqlite":
+        event.listen(sync_engine, "connect", apply_sqlite_pragmas)
+    return sync_engine
+
+
+def build_async_engine(url: str = settings.ASYNC_DATABASE_URL):
+    options = _engine_options(url)
+    if url.startswith("sqlite"):
+        options.pop("connect_args")
+    new_engine = create_async_engine(url, echo=settings.DB_ECHO, **options)
+    if new_engine.dialect.name == "sqlite":
+        event.listen(new_engine.sync_engine, "connect", apply_sqlite_pragmas)
+    return new_engine
+
+
+# Sync engine is only used for schema management (create_all, maintenance scripts)
+engine = build_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Async engine serves every request handler
+async_engine = build_async_engine()
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 # Define tables using SQLAlchemy ORM
@@ -26,6 +118,24 @@ class ActivityLogTable(Base):
     description = Column(Text)
     timestamp = Column(DateTime, default=datetime.utcnow)
 
+    # Serve "newest first" range scans per user and per type; id breaks timestamp ties for keyset paging
+    __table_args__ = (
+        Index("idx_activity_user_ts", "user_id", "timestamp", "id"),
+        Index("idx_activity_type_ts", "activity_type", "timestamp", "id"),
+    )
+
+
+class ActivityRollupTable(Base):
+    """Hourly activity counts, maintained alongside every activity_logs insert"""
+    __tablename__ = "activity_rollups"
+    bucket = Column(DateTime, primary_key=True)  # start of the hour
+    activity_type = Column(String(50), primary_key=True)
+    user_id = Column(String(50), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+    # Stats across all users scan by time range first
+    __table_args__ = (Index("idx_rollup_bucket_type", "bucket", "activity_type"),)
+
 
 class ContactRelationshipTable(Base):
     __tablename__ = "contact_relationships"
@@ -35,18 +145,160 @@ class ContactRelationshipTable(Base):
     relationship_type = Column(String(50))
     created_at = Column(DateTime, default=datetime.utcnow)
 
-    __table_args__ = (Index("idx_owner_email", "owner_email"),)
+    # One link per (owner, contact); also serves owner_email lookups as its leading column.
+    # idx_linked_user_id serves reverse lookups and the cascade when a contact is deleted;
+    # idx_owner_created serves linked-contact pages ordered by link time.
+    __table_args__ = (
+        Index("uniq_owner_linked", "owner_email", "linked_user_id", unique=True),
+        Index("idx_linked_user_id", "linked_user_id"),
+        Index("idx_owner_created", "owner_email", "created_at", "id"),
+    )
 
 
-# Context manager for SQLite sessions
-@contextmanager
-def get_db_session():
-    session = SessionLocal()
-    try:
+class RelationshipCountTable(Base):
+    """Links per owner, adjusted in the same transaction as every link and unlink"""
+    __tablename__ = "relationship_counts"
+    owner_email = Column(String(255), primary_key=True)
+    linked_count = Column(Integer, nullable=False, default=0)
+
+
+# Async context manager for SQLAlchemy sessions
+@asynccontextmanager
+async def get_db_session():
+    async with AsyncSessionLocal() as session:
         yield session
-    finally:
-        session.close()
 
 
-# Initialize SQLite tables if they don't exist
+def upsert_insert(db, table):
+    """INSERT construct that supports ON CONFLICT for the session's dialect (SQLite or PostgreSQL)"""
+    if db.bind.dialect.name == "postgresql":
+        return postgresql_insert(table)
+    return sqlite_insert(table)
+
+
+# normalize_email as a MongoDB expression; the preflight and the rewrite must agree on it
+NORMALIZED_EMAIL_EXPR = {"$toLower": {"$trim": {"input": "$email"}}}
+
+
+async def find_duplicate_emails():
+    """Emails (compared after normalization) held by more than one contact, with the user_ids sharing each"""
+    pipeline = [
+        {"$group": {"_id": NORMALIZED_EMAIL_EXPR, "user_ids": {"$push": "$user_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+        {"$sort": {"_id": 1}},
+    ]
+    groups = await contacts_collection.aggregate(pipeline).to_list(length=None)
+    return [{"email": group["_id"], "user_ids": group["user_ids"]} for group in groups]
+
+
+async def normalize_contact_emails():
+    """Migration: rewrite stored emails with normalize_email's rule; returns the number of contacts changed"""
+    result = await contacts_collection.update_many(
+        {"$expr": {"$ne": ["$email", NORMALIZED_EMAIL_EXPR]}},
+        [{"$set": {"email": NORMALIZED_EMAIL_EXPR}}]
+    )
+    return result.modified_count
+
+
+async def ensure_contact_indexes():
+    """Create the declared contact indexes; MongoDB skips any that already exist.
+
+    Before uniq_email is first built, contacts sharing an email (ignoring case) are looked for: building the
+    index over them would fail and stop startup. If any exist they are reported and uniq_email is left out
+    until they are merged or deleted (python -m config.database lists them); otherwise stored emails are
+    normalized and the full registry is created.
+    """
+    if "uniq_email" in await contacts_collection.index_information():
+        return await contacts_collection.create_indexes(CONTACT_INDEXES)
+
+    duplicates = await find_duplicate_emails()
+    if duplicates:
+        print(
+            f"uniq_email not created: {len(duplicates)} emails are shared by more than one contact; "
+            "run python -m config.database to list them"
+        )
+        return await contacts_collection.create_indexes(
+            [index for index in CONTACT_INDEXES if index.document["name"] != "uniq_email"]
+        )
+
+    await normalize_contact_emails()
+    return await contacts_collection.create_indexes(CONTACT_INDEXES)
+
+
+def ensure_sql_indexes(bind=engine):
+    """Create declared indexes that are missing on tables created before they were declared"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+
+def dedupe_relationships(bind=engine):
+    """Migration: keep only the newest row per (owner_email, linked_user_id) so uniq_owner_linked can be built.
+
+    Skipped once the unique index exists; returns the number of duplicate rows removed.
+    """
+    table = ContactRelationshipTable.__table__
+    if "uniq_owner_linked" in {index["name"] for index in inspect(bind).get_indexes(table.name)}:
+        return 0
+
+    newest = select(func.max(table.c.id)).group_by(table.c.owner_email, table.c.linked_user_id)
+    with bind.begin() as conn:
+        return conn.execute(delete(table).where(table.c.id.not_in(newest))).rowcount
+
+
+def normalize_relationship_emails(bind=engine):
+    """Migration: store owner_email with normalize_email's rule so links match the (lowercased) contact emails.
+
+    Links that only differed by the case of owner_email collapse into the newest one, and relationship_counts
+    is rebuilt from the links. Returns the number of links rewritten or removed.
+    """
+    links = ContactRelationshipTable.__table__
+    counts = RelationshipCountTable.__table__
+    normalized = func.lower(func.trim(links.c.owner_email))
+    with bind.begin() as conn:
+        if not conn.execute(select(links.c.id).where(links.c.owner_email != normalized).limit(1)).first():
+            return 0
+
+        newest = select(func.max(links.c.id)).group_by(normalized, links.c.linked_user_id)
+        changed = conn.execute(delete(links).where(links.c.id.not_in(newest))).rowcount
+        changed += conn.execute(
+            links.update().where(links.c.owner_email != normalized).values(owner_email=normalized)
+        ).rowcount
+
+        conn.execute(delete(counts))
+        conn.execute(counts.insert().from_select(
+            ["owner_email", "linked_count"],
+            select(links.c.owner_email, func.count()).group_by(links.c.owner_email)
+        ))
+        return changed
+
+
+def seed_relationship_counts(bind=engine):
+    """Migration: fill relationship_counts from existing links the first time the table is empty"""
+    counts = RelationshipCountTable.__table__
+    links = ContactRelationshipTable.__table__
+    with bind.begin() as conn:
+        if conn.execute(select(func.count()).select_from(counts)).scalar():
+            return 0
+        return conn.execute(counts.insert().from_select(
+            ["owner_email", "linked_count"],
+            select(links.c.owner_email, func.count()).group_by(links.c.owner_email)
+        )).rowcount
+
+
+# Initialize SQL tables if they don't exist
 Base.metadata.create_all(bind=engine)
+dedupe_relationships()
+normalize_relationship_emails()
+ensure_sql_indexes()
+seed_relationship_counts()
+
+
+if __name__ == "__main__":
+    # python -m config.database  -> list contacts that share an email and block the uniq_email index
+    import asyncio
+
+    duplicates = asyncio.run(find_duplicate_emails())
+    for group in duplicates:
+        print(f"{group['email']}: {', '.join(group['user_ids'])}")
+    print(f"{len(duplicates)} duplicate emails" if duplicates else "No duplicate emails")
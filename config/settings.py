@@ -0,0 +1,48 @@
+import os
+from dotenv import load_dotenv
+
+# Values come from the environment, optionally seeded from a .env file in the working directory
+load_dotenv()
+
+
+def _int(name: str, default: int):
+    return int(os.getenv(name, default))
+
+
+def _bool(name: str, default: bool = False):
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "on")
+
+
+def async_url_for(url: str):
+    """Derive the async driver URL (aiosqlite / asyncpg) from a sync SQLAlchemy URL"""
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    for prefix in ("postgresql+psycopg2:", "postgresql:", "postgres:"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg:" + url[len(prefix):]
+    return url
+
+
+class Settings:
+    # MongoDB
+    MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+    MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "contact_management_lokesh")
+
+    # Relational store for activity logs and relationships (SQLite by default, PostgreSQL supported)
+    DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///sqlite_contacts.db")
+    ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or async_url_for(DATABASE_URL)
+    DB_POOL_SIZE = _int("DB_POOL_SIZE", 5)
+    DB_MAX_OVERFLOW = _int("DB_MAX_OVERFLOW", 10)
+    DB_POOL_RECYCLE = _int("DB_POOL_RECYCLE", 1800)
+    DB_ECHO = _bool("DB_ECHO")
+
+    # SQLite connection pragmas
+    SQLITE_BUSY_TIMEOUT_MS = _int("SQLITE_BUSY_TIMEOUT_MS", 5000)
+    SQLITE_CACHE_SIZE_KB = _int("SQLITE_CACHE_SIZE_KB", 65536)
+
+    # Activity retention: months kept in activity_logs before moving to compressed monthly archives
+    ACTIVITY_RETENTION_MONTHS = _int("ACTIVITY_RETENTION_MONTHS", 3)
+    ACTIVITY_ARCHIVE_DIR = os.getenv("ACTIVITY_ARCHIVE_DIR", "activity_archive")
+
+
+settings = Settings()
@@ -0,0 +1,217 @@
+"""Monthly archive partitions for activity logs.
+
+activity_logs only keeps the most recent ACTIVITY_RETENTION_MONTHS months. Older months are moved
+into one gzip-compressed NDJSON file per month (activity_logs_YYYY_MM.ndjson.gz), written newest
+first so on-demand reads can stop as soon as they have a page.
+"""
+from config.database import get_db_session, ActivityLogTable
+from config.settings import settings
+from core.models.postgres_models import naive_utc
+from datetime import datetime
+from pathlib import Path
+from sqlalchemy import select, delete, func
+from itertools import islice
+from typing import List, Optional
+import asyncio
+import gzip
+import heapq
+import json
+import os
+
+ARCHIVE_PREFIX = "activity_logs_"
+ARCHIVE_SUFFIX = ".ndjson.gz"
+ARCHIVE_BATCH_SIZE = 5000
+
+ARCHIVE_COLUMNS = ("id", "user_id", "activity_type", "description", "timestamp")
+
+
+def month_start(timestamp: datetime):
+    return timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month: datetime, count: int):
+    index = month.year * 12 + month.month - 1 + count
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def archive_path(month: datetime, archive_dir: Optional[str] = None):
+    return Path(archive_dir or settings.ACTIVITY_ARCHIVE_DIR) / f"{ARCHIVE_PREFIX}{month:%Y_%m}{ARCHIVE_SUFFIX}"
+
+
+def archived_months(archive_dir: Optional[str] = None):
+    """Months that have an archive partition, newest first"""
+    directory = Path(archive_dir or settings.ACTIVITY_ARCHIVE_DIR)
+    if not directory.is_dir():
+        return []
+
+    months = []
+    for path in directory.glob(f"{ARCHIVE_PREFIX}*{ARCHIVE_SUFFIX}"):
+        label = path.name[len(ARCHIVE_PREFIX):-len(ARCHIVE_SUFFIX)]
+        try:
+            months.append(datetime.strptime(label, "%Y_%m"))
+        except ValueError:
+            continue
+    return sorted(months, reverse=True)
+
+
+def partitions_for_range(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    archive_dir: Optional[str] = None
+):
+    """Archived months that can hold rows between start and end (partition pruning), newest first"""
+    return [
+        month for month in archived_months(archive_dir)
+        if (end is None or month <= end) and (start is None or add_months(month, 1) > start)
+    ]
+
+
+def _sort_key(row: dict):
+    return row["timestamp"], row["id"]
+
+
+def _encode_row(row: dict):
+    return json.dumps({**row, "timestamp": row["timestamp"].isoformat()}) + "\n"
+
+
+def _read_rows(path: Path):
+    with gzip.open(path, "rt", encoding="utf-8") as archive:
+        for line in archive:
+            row = json.loads(line)
+            row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+            yield row
+
+
+def read_partition(month: datetime, archive_dir: Optional[str] = None):
+    """Yield the rows of one archived month, newest first"""
+    return _read_rows(archive_path(month, archive_dir))
+
+
+def iter_archived_rows(archive_dir: Optional[str] = None):
+    for month in archived_months(archive_dir):
+        yield from read_partition(month, archive_dir)
+
+
+def _matches(row: dict, user_id, activity_type, start_date, end_date, cursor):
+    if user_id and row["user_id"] != user_id:
+        return False
+    if activity_type and row["activity_type"] != activity_type:
+        return False
+    if start_date and row["timestamp"] < start_date:
+        return False
+    if end_date and row["timestamp"] > end_date:
+        return False
+    if cursor and _sort_key(row) >= cursor:
+        return False
+    return True
+
+
+def iter_archived_activities(
+    user_id: Optional[str] = None,
+    activity_type: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    cursor: Optional[tuple] = None,
+    columns: Optional[List[str]] = None,
+    archive_dir: Optional[str] = None
+):
+    """Yield matching archived rows newest first, reading only partitions inside the range"""
+    # Archived timestamps are naive UTC; aware bounds could not even be compared with them
+    start_date, end_date = naive_utc(start_date), naive_utc(end_date)
+    if cursor:
+        cursor = (naive_utc(cursor[0]), cursor[1])
+
+    upper = end_date
+    if cursor and (upper is None or cursor[0] < upper):
+        upper = cursor[0]
+
+    for month in partitions_for_range(start_date, upper, archive_dir):
+        for row in read_partition(month, archive_dir):
+            if _matches(row, user_id, activity_type, start_date, end_date, cursor):
+                yield {name: row[name] for name in columns} if columns else row
+
+
+def scan_archived_activities(limit: int = 100, **criteria):
+    """At most limit matching archived rows, newest first"""
+    return list(islice(iter_archived_activities(**criteria), limit))
+
+
+async def load_archived_activities(**criteria):
+    """scan_archived_activities off the event loop"""
+    return await asyncio.to_thread(scan_archived_activities, **criteria)
+
+
+def _merge_partition(path: Path, fresh_path: Path):
+    """Fold freshly archived rows into an existing partition, newest first, dropping repeats"""
+    merged_path = path.with_name(path.name + ".merge")
+    with gzip.open(merged_path, "wt", encoding="utf-8") as out:
+        last = None
+        for row in heapq.merge(_read_rows(path), _read_rows(fresh_path), key=_sort_key, reverse=True):
+            if _sort_key(row) != last:
+                out.write(_encode_row(row))
+                last = _sort_key(row)
+    os.replace(merged_path, path)
+    fresh_path.unlink()
+
+
+async def archive_month(month: datetime, archive_dir: Optional[str] = None, batch_size: int = ARCHIVE_BATCH_SIZE):
+    """Move one month of activity_logs into its archive partition and return the number of rows moved"""
+    path = archive_path(month, archive_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fresh_path = path.with_name(path.name + ".tmp")
+    in_month = (ActivityLogTable.timestamp >= month, ActivityLogTable.timestamp < add_months(month, 1))
+
+    moved = 0
+    max_id = None
+    async with get_db_session() as db:
+        columns = [getattr(ActivityLogTable, name) for name in ARCHIVE_COLUMNS]
+        stmt = select(*columns).where(*in_month).order_by(ActivityLogTable.timestamp.desc(), ActivityLogTable.id.desc())
+        result = await db.stream(stmt.execution_options(yield_per=batch_size))
+        with gzip.open(fresh_path, "wt", encoding="utf-8") as out:
+            async for row in result.mappings():
+                out.write(_encode_row(dict(row)))
+                moved += 1
+                max_id = row["id"] if max_id is None else max(max_id, row["id"])
+
+        if not moved:
+            fresh_path.unlink()
+            return 0
+
+        if path.exists():
+            _merge_partition(path, fresh_path)
+        else:
+            os.replace(fresh_path, path)
+
+        # Only rows that made it into the file are removed; anything written meanwhile has a higher id
+        await db.execute(delete(ActivityLogTable).where(*in_month, ActivityLogTable.id <= max_id))
+        await db.commit()
+
+    return moved
+
+
+async def archive_activity_logs(
+    retention_months: int = settings.ACTIVITY_RETENTION_MONTHS,
+    now: Optional[datetime] = None,
+    archive_dir: Optional[str] = None
+):
+    """Retention job: archive every month older than the retention window, oldest first"""
+    cutoff = add_months(month_start(now or datetime.now()), -retention_months)
+    async with get_db_session() as db:
+        oldest = (await db.execute(
+            select(func.min(ActivityLogTable.timestamp)).where(ActivityLogTable.timestamp < cutoff)
+        )).scalar()
+
+    moved = {}
+    month = month_start(oldest) if oldest else cutoff
+    while month < cutoff:
+        count = await archive_month(month, archive_dir)
+        if count:
+            moved[f"{month:%Y-%m}"] = count
+        month = add_months(month, 1)
+    return moved
+
+
+if __name__ == "__main__":
+    # python -m core.handlers.activity_archive  -> move months past the retention window into the archive
+    for label, count in asyncio.run(archive_activity_logs()).items():
+        print(f"{label}: {count} activities archived")
@@ -1,79 +1,391 @@
-from core.models.postgres_models import ActivityLog, ActivityQuery
-from config.database import get_db_session, contacts_collection, ActivityLogTable
-from datetime import datetime
+from core.models.postgres_models import ActivityLog, ActivityQuery, ActivityBatchQuery, naive_utc
+from config.database import get_db_session, upsert_insert, ActivityLogTable, ActivityRollupTable
+from core.handlers.contact_cache import get_cached_contact
+from core.handlers.activity_archive import load_archived_activities, iter_archived_activities, iter_archived_rows
+from collections import Counter
+from datetime import datetime, timedelta
+from itertools import islice
+import asyncio
+import csv
+import io
+import json
 from fastapi import HTTPException
+from sqlalchemy import select, insert, delete, func, or_, and_
+from typing import List, Optional
+from utilities.batch_writer import BatchWriter
+from utilities.cursor import encode_cursor, decode_cursor
 
+ACTIVITY_BATCH_SIZE = 500
+ACTIVITY_FLUSH_SECONDS = 0.5
+ACTIVITY_QUEUE_SIZE = 10000
+ROLLUP_BACKFILL_BATCH_SIZE = 5000
+EXPORT_BATCH_SIZE = 1000
 
-def log_activity(activity: ActivityLog):
-    """Log a user activity to SQLite database using SQLAlchemy"""
-    with get_db_session() as db:
-        new_log = ActivityLogTable(
-            user_id=activity.user_id,
-            activity_type=activity.activity_type,
-            description=activity.description,
-            timestamp=activity.timestamp or datetime.now()
+# Activity columns clients may select with fields=
+ACTIVITY_FIELDS = ("id", "user_id", "activity_type", "description", "timestamp")
+
+
+def _activity_row(activity: ActivityLog, now: datetime):
+    return {
+        "user_id": activity.user_id,
+        "activity_type": activity.activity_type,
+        "description": activity.description,
+        "timestamp": activity.timestamp or now
+    }
+
+
+def rollup_bucket(timestamp: datetime):
+    """Start of the hour an activity is counted under"""
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def _rollup_counts(rows: List[dict]):
+    return Counter((rollup_bucket(row["timestamp"]), row["activity_type"], row["user_id"]) for row in rows)
+
+
+async def _apply_rollups(db, counts: Counter):
+    """Add counts to activity_rollups, creating missing (bucket, activity_type, user_id) rows"""
+    if not counts:
+        return
+    stmt = upsert_insert(db, ActivityRollupTable)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ActivityRollupTable.bucket, ActivityRollupTable.activity_type, ActivityRollupTable.user_id],
+        set_={"count": ActivityRollupTable.count + stmt.excluded.count}
+    )
+    await db.execute(stmt, [
+        {"bucket": bucket, "activity_type": activity_type, "user_id": user_id, "count": count}
+        for (bucket, activity_type, user_id), count in counts.items()
+    ])
+
+
+async def _insert_activity_rows(db, rows: List[dict]):
+    await db.execute(insert(ActivityLogTable), rows)
+    await _apply_rollups(db, _rollup_counts(rows))
+
+
+async def write_activity_rows(rows: List[dict]):
+    """Insert activity rows with a single bulk INSERT and bump their hourly rollups in the same commit"""
+    async with get_db_session() as db:
+        await _insert_activity_rows(db, rows)
+        await db.commit()
+
+
+async def insert_activities(db, activities: List[ActivityLog]):
+    """Add activities to the caller's session so they commit atomically with its other writes"""
+    if not activities:
+        return 0
+
+    now = datetime.now()
+    await _insert_activity_rows(db, [_activity_row(activity, now) for activity in activities])
+    return len(activities)
+
+
+# Group-commits activity rows in the background once started by the application lifespan;
+# until then (tests, scripts) every call writes synchronously
+activity_writer = BatchWriter(
+    write_activity_rows,
+    batch_size=ACTIVITY_BATCH_SIZE,
+    flush_interval=ACTIVITY_FLUSH_SECONDS,
+    max_queue_size=ACTIVITY_QUEUE_SIZE
+)
+
+
+async def log_activity(activity: ActivityLog):
+    """Queue a user activity for the activity log; the timestamp is taken now, not at flush time"""
+    await activity_writer.submit(_activity_row(activity, datetime.now()))
+
+
+async def log_activities(activities: List[ActivityLog]):
+    """Queue many activities for the activity log"""
+    if not activities:
+        return 0
+
+    now = datetime.now()
+    await activity_writer.submit_many([_activity_row(activity, now) for activity in activities])
+    return len(activities)
+
+
+def encode_activity_cursor(timestamp: datetime, activity_id: int):
+    return encode_cursor({"ts": timestamp.isoformat(), "id": activity_id})
+
+
+def decode_activity_cursor(cursor: str):
+    data = decode_cursor(cursor)
+    try:
+        return naive_utc(datetime.fromisoformat(data["ts"])), int(data["id"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _activity_filters(query: ActivityQuery, cursor: Optional[tuple] = None):
+    """WHERE clauses for an activity search, including the keyset predicate for a cursor"""
+    filters = []
+    if query.user_id:
+        filters.append(ActivityLogTable.user_id == query.user_id)
+
+    if query.activity_type:
+        filters.append(ActivityLogTable.activity_type == query.activity_type)
+
+    if query.start_date:
+        filters.append(ActivityLogTable.timestamp >= query.start_date)
+
+    if query.end_date:
+        filters.append(ActivityLogTable.timestamp <= query.end_date)
+
+    if cursor:
+        cursor_ts, cursor_id = cursor
+        filters.append(or_(
+            ActivityLogTable.timestamp < cursor_ts,
+            and_(ActivityLogTable.timestamp == cursor_ts, ActivityLogTable.id < cursor_id)
+        ))
+    return filters
+
+
+def _archive_criteria(query: ActivityQuery, cursor: Optional[tuple], names: List[str]):
+    return {
+        "user_id": query.user_id,
+        "activity_type": query.activity_type,
+        "start_date": query.start_date,
+        "end_date": query.end_date,
+        "cursor": cursor,
+        "columns": names
+    }
+
+
+def _selected_names(fields: Optional[List[str]]):
+    return list(dict.fromkeys(["id", "timestamp"] + fields)) if fields else list(ACTIVITY_FIELDS)
+
+
+async def get_user_activities(query: ActivityQuery, fields: Optional[List[str]] = None):
+    """Get one page of activities, newest first, selecting only the requested columns.
+
+    Pages are keyset-paginated on (timestamp, id) so each request is a bounded range scan
+    over idx_activity_user_ts / idx_activity_type_ts. id and timestamp are always returned
+    because they make up the cursor. With include_archived, archived monthly partitions
+    overlapping the date range are read too and merged in order.
+    """
+    names = _selected_names(fields)
+    columns = [getattr(ActivityLogTable, name) for name in names]
+    cursor = decode_activity_cursor(query.cursor) if query.cursor else None
+    async with get_db_session() as db:
+        stmt = select(*columns).where(*_activity_filters(query, cursor))
+        stmt = stmt.order_by(ActivityLogTable.timestamp.desc(), ActivityLogTable.id.desc()).limit(query.limit + 1)
+        rows = [dict(row) for row in (await db.execute(stmt)).mappings().all()]
+
+    if query.include_archived:
+        rows += await load_archived_activities(limit=query.limit + 1, **_archive_criteria(query, cursor, names))
+        rows.sort(key=lambda row: (row["timestamp"], row["id"]), reverse=True)
+
+    activities = rows[:query.limit]
+    next_cursor = None
+    if len(rows) > query.limit:
+        last = activities[-1]
+        next_cursor = encode_activity_cursor(last["timestamp"], last["id"])
+
+    return {"activities": activities, "next_cursor": next_cursor}
+
+
+async def get_activities_for_users(batch: ActivityBatchQuery, fields: Optional[List[str]] = None):
+    """Newest activities for many users at once, grouped by user, from a single statement.
+
+    ROW_NUMBER() over each user's (timestamp, id) ordering picks the top batch.limit rows per user;
+    every requested user appears in the result, in request order, even with no activity.
+    """
+    user_ids = list(dict.fromkeys(batch.user_ids))
+    names = _selected_names(fields)
+    if "user_id" not in names:
+        names.append("user_id")
+
+    query = ActivityQuery(activity_type=batch.activity_type, start_date=batch.start_date, end_date=batch.end_date)
+    rank = func.row_number().over(
+        partition_by=ActivityLogTable.user_id,
+        order_by=(ActivityLogTable.timestamp.desc(), ActivityLogTable.id.desc())
+    ).label("rank")
+    ranked = select(*[getattr(ActivityLogTable, name) for name in names], rank).where(
+        ActivityLogTable.user_id.in_(user_ids), *_activity_filters(query)
+    ).subquery()
+    stmt = select(*[ranked.c[name] for name in names]).where(ranked.c.rank <= batch.limit).order_by(
+        ranked.c.user_id, ranked.c.rank
+    )
+
+    async with get_db_session() as db:
+        rows = (await db.execute(stmt)).mappings().all()
+
+    grouped = {user_id: [] for user_id in user_ids}
+    for row in rows:
+        activity = dict(row)
+        grouped[activity["user_id"]].append(activity)
+        if fields and "user_id" not in fields:
+            del activity["user_id"]
+    return {"results": grouped}
+
+
+def _format_batch(rows, names: List[str], export_format: str):
+    if export_format == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue()
+    return "".join(json.dumps(dict(zip(names, row)), default=str) + "\n" for row in rows)
+
+
+async def stream_activities(
+    query: ActivityQuery,
+    fields: Optional[List[str]] = None,
+    export_format: str = "ndjson",
+    batch_size: int = EXPORT_BATCH_SIZE,
+    cursor: Optional[tuple] = None
+):
+    """Yield every matching activity as NDJSON or CSV text, newest first, one chunk per batch.
+
+    Rows are read as plain tuples through a server-side cursor (yield_per), so memory use
+    does not depend on the size of the result. limit is ignored; cursor is the starting point
+    already decoded with decode_activity_cursor, so a bad cursor fails before the response starts.
+    """
+    names = _selected_names(fields)
+    columns = [getattr(ActivityLogTable, name) for name in names]
+
+    if export_format == "csv":
+        yield _format_batch([names], names, "csv")
+
+    async with get_db_session() as db:
+        stmt = select(*columns).where(*_activity_filters(query, cursor)).order_by(
+            ActivityLogTable.timestamp.desc(), ActivityLogTable.id.desc()
         )
-        db.add(new_log)
-        db.commit()
-        db.refresh(new_log)
-        return new_log.id
+        result = await db.stream(stmt.execution_options(yield_per=batch_size))
+        try:
+            async for rows in result.partitions(batch_size):
+                yield _format_batch([tuple(row) for row in rows], names, export_format)
+        finally:
+            await result.close()
+
+    if query.include_archived:
+        archived = iter_archived_activities(**_archive_criteria(query, cursor, names))
+        while True:
+            rows = await asyncio.to_thread(lambda: list(islice(archived, batch_size)))
+            if not rows:
+                break
+            yield _format_batch([tuple(row[name] for name in names) for row in rows], names, export_format)
+
 
+def _count_archived_rollups():
+    return Counter(
+        (rollup_bucket(row["timestamp"]), row["activity_type"], row["user_id"]) for row in iter_archived_rows()
+    )
 
-def get_user_activities(query: ActivityQuery):
-    """Get user activities from SQLite based on query parameters"""
-    with get_db_session() as db:
-        activity_query = db.query(ActivityLogTable)
 
-        if query.user_id:
-            activity_query = activity_query.filter(ActivityLogTable.user_id == query.user_id)
+async def rebuild_activity_rollups(batch_size: int = ROLLUP_BACKFILL_BATCH_SIZE):
+    """Recompute activity_rollups from activity_logs and the archive; run while the application is stopped.
 
-        if query.activity_type:
-            activity_query = activity_query.filter(ActivityLogTable.activity_type == query.activity_type)
+    Raw rows are streamed in batches so memory is bounded by the number of rollup rows, not log rows.
+    """
+    async with get_db_session() as db:
+        await db.execute(delete(ActivityRollupTable))
 
-        if query.start_date:
-            activity_query = activity_query.filter(ActivityLogTable.timestamp >= query.start_date)
+        counts = Counter()
+        stmt = select(ActivityLogTable.user_id, ActivityLogTable.activity_type, ActivityLogTable.timestamp)
+        result = await db.stream(stmt.execution_options(yield_per=batch_size))
+        async for row in result:
+            if row.timestamp is not None:
+                counts[(rollup_bucket(row.timestamp), row.activity_type, row.user_id)] += 1
+        counts.update(await asyncio.to_thread(_count_archived_rollups))
 
-        if query.end_date:
-            activity_query = activity_query.filter(ActivityLogTable.timestamp <= query.end_date)
+        await _apply_rollups(db, counts)
+        await db.commit()
 
-        activity_query = activity_query.order_by(ActivityLogTable.timestamp.desc())
-        results = activity_query.all()
+    return len(counts)
 
-        return [
-            {
-                "id": a.id,
-                "user_id": a.user_id,
-                "activity_type": a.activity_type,
-                "description": a.description,
-                "timestamp": a.timestamp
-            }
-            for a in results
+
+async def get_activity_stats(
+    interval: str = "hour",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    activity_type: Optional[str] = None,
+    user_id: Optional[str] = None
+):
+    """Activity counts per time bucket and type, read from the hourly rollups.
+
+    start and end are applied at the interval's granularity and are inclusive: with interval=day,
+    start=2024-01-01&end=2024-01-01 covers that whole day. Daily buckets are folded from the hourly ones.
+    """
+    if interval == "day":
+        start = start.replace(hour=0, minute=0, second=0, microsecond=0) if start else None
+        end = end.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1) if end else None
+    else:
+        end = rollup_bucket(end) + timedelta(hours=1) if end else None
+
+    stmt = select(
+        ActivityRollupTable.bucket,
+        ActivityRollupTable.activity_type,
+        func.sum(ActivityRollupTable.count).label("count")
+    )
+
+    if start:
+        stmt = stmt.where(ActivityRollupTable.bucket >= rollup_bucket(start))
+
+    if end:
+        stmt = stmt.where(ActivityRollupTable.bucket < end)
+
+    if activity_type:
+        stmt = stmt.where(ActivityRollupTable.activity_type == activity_type)
+
+    if user_id:
+        stmt = stmt.where(ActivityRollupTable.user_id == user_id)
+
+    stmt = stmt.group_by(ActivityRollupTable.bucket, ActivityRollupTable.activity_type).order_by(
+        ActivityRollupTable.bucket, ActivityRollupTable.activity_type
+    )
+    async with get_db_session() as db:
+        rows = (await db.execute(stmt)).all()
+
+    totals = {}
+    for row in rows:
+        bucket = row.bucket.replace(hour=0) if interval == "day" else row.bucket
+        key = (bucket, row.activity_type)
+        totals[key] = totals.get(key, 0) + row.count
+
+    return {
+        "interval": interval,
+        "buckets": [
+            {"bucket": bucket, "activity_type": activity_type, "count": count}
+            for (bucket, activity_type), count in sorted(totals.items())
         ]
+    }
 
 
-def get_contact_with_activities(user_id: str):
-    """Get contact details from MongoDB and activity history from SQLite"""
-    contact = contacts_collection.find_one({"user_id": user_id}, {"_id": 0})
-    if not contact:
-        raise HTTPException(status_code=404, detail="Contact not found")
+async def get_contact_with_activities(
+    user_id: str,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    include_relationships: bool = False
+):
+    """Get contact details from MongoDB with one page of activity history from SQL.
 
-    with get_db_session() as db:
-        activities = db.query(ActivityLogTable).filter(
-            ActivityLogTable.user_id == user_id
-        ).order_by(ActivityLogTable.timestamp.desc()).all()
-
-    activity_list = [
-        {
-            "id": a.id,
-            "user_id": a.user_id,
-            "activity_type": a.activity_type,
-            "description": a.description,
-            "timestamp": a.timestamp
-        }
-        for a in activities
+    The contact, activity and (optionally) relationship lookups are independent, so they are
+    issued concurrently, each on its own session; latency follows the slowest of them.
+    """
+    lookups = [
+        get_cached_contact(user_id),
+        get_user_activities(ActivityQuery(user_id=user_id, limit=limit, cursor=cursor))
     ]
+    if include_relationships:
+        # Imported here because relationship_handlers imports this module
+        from core.handlers.relationship_handlers import get_contact_owners
+        lookups.append(get_contact_owners(user_id))
 
-    return {
+    contact, page, *relationships = await asyncio.gather(*lookups)
+    if not contact:
+        raise HTTPException(status_code=404, detail="Contact not found")
+
+    result = {
         "contact": contact,
-        "activities": activity_list
+        "activities": page["activities"],
+        "next_cursor": page["next_cursor"]
     }
+    if include_relationships:
+        result["relationships"] = relationships[0]
+    return result
+
+
+if __name__ == "__main__":
+    # python -m core.handlers.activity_handlers  -> rebuild hourly rollups from existing activity logs
+    print(f"Rebuilt {asyncio.run(rebuild_activity_rollups())} activity rollup rows")
@@ -0,0 +1,108 @@
+from config.database import contacts_collection, CONTACT_PROJECTION, contact_projection, public_contact
+from utilities.ttl_cache import LRUTTLCache
+from contextlib import contextmanager
+from typing import List, Optional
+
+CONTACT_CACHE_MAX_SIZE = 10000
+CONTACT_CACHE_TTL_SECONDS = 300
+
+# Contacts keyed by user_id, stored without MongoDB's _id and internal search fields
+contact_cache = LRUTTLCache(maxsize=CONTACT_CACHE_MAX_SIZE, ttl=CONTACT_CACHE_TTL_SECONDS)
+
+
+class _WriteTracker:
+    """Tells read-throughs whether a contact was written while they were waiting on MongoDB.
+
+    Writes are only remembered while at least one read-through is in flight, so the map stays small.
+    """
+
+    def __init__(self):
+        self.clock = 0
+        self.reads_in_flight = 0
+        self.last_write = {}
+
+    def record(self, user_id: str):
+        self.clock += 1
+        if self.reads_in_flight:
+            self.last_write[user_id] = self.clock
+
+    @contextmanager
+    def read(self):
+        """Yield the clock a read-through started at"""
+        self.reads_in_flight += 1
+        try:
+            yield self.clock
+        finally:
+            self.reads_in_flight -= 1
+            if not self.reads_in_flight:
+                self.last_write.clear()
+
+    def written_since(self, user_id: str, started: int):
+        return self.last_write.get(user_id, 0) > started
+
+
+contact_writes = _WriteTracker()
+
+
+def cache_contact(contact: dict):
+    """Store (or refresh) a contact document in the cache after a write"""
+    contact_writes.record(contact["user_id"])
+    contact_cache.set(contact["user_id"], public_contact(contact))
+
+
+def invalidate_contact(user_id: str):
+    contact_writes.record(user_id)
+    contact_cache.invalidate(user_id)
+
+
+def _fill(contact: dict, started: int):
+    """Cache a document read from MongoDB unless the contact was updated or deleted since the read began"""
+    if not contact_writes.written_since(contact["user_id"], started):
+        contact_cache.set(contact["user_id"], public_contact(contact))
+
+
+async def get_cached_contact(user_id: str) -> Optional[dict]:
+    """Read-through lookup of one contact; misses are not cached"""
+    contact = contact_cache.get(user_id)
+    if contact is None:
+        with contact_writes.read() as started:
+            contact = await contacts_collection.find_one({"user_id": user_id}, CONTACT_PROJECTION)
+            if contact is None:
+                return None
+            _fill(contact, started)
+    # Hand out copies so callers can annotate results without touching the cache
+    return dict(contact)
+
+
+def _select(contact: dict, fields: Optional[List[str]]):
+    if fields is None:
+        return dict(contact)
+    return {key: value for key, value in contact.items() if key == "user_id" or key in fields}
+
+
+async def get_cached_contacts(user_ids: List[str], fields: Optional[List[str]] = None) -> dict:
+    """Read-through lookup of many contacts, fetching only the cache misses with one $in query.
+
+    With a sparse fieldset the misses are fetched with a narrow projection and are not cached,
+    since the cache only holds complete documents. fields=None selects every field; [] only user_id.
+    """
+    found = {}
+    missing = []
+    for user_id in dict.fromkeys(user_ids):
+        contact = contact_cache.get(user_id)
+        if contact is None:
+            missing.append(user_id)
+        else:
+            found[user_id] = _select(contact, fields)
+
+    if missing:
+        with contact_writes.read() as started:
+            fetched = await contacts_collection.find(
+                {"user_id": {"$in": missing}}, contact_projection(fields)
+            ).to_list(length=None)
+            for contact in fetched:
+                if fields is None:
+                    _fill(contact, started)
+                found[contact["user_id"]] = dict(contact)
+
+    return found
@@ -1,21 +1,72 @@
 from core.models.contact_model import Contact
 from core.models.postgres_models import ActivityLog
-from core.handlers.activity_handlers import log_activity
-from config.database import contacts_collection
+from core.handlers.activity_handlers import log_activity, log_activities
+from core.handlers.contact_cache import cache_contact, invalidate_contact
+from core.handlers.event_handlers import publish_change
+from core.handlers.relationship_handlers import remove_contact_relationships, invalidate_linked_views_for_contact
+from config.database import contacts_collection, CONTACT_PROJECTION, contact_projection, public_contact, normalize_email
 from uuid import uuid4
 from fastapi import HTTPException, Depends
 from datetime import datetime
+from typing import Optional, List, Any
+from pydantic import ValidationError
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+import asyncio
+import json
+import re
 
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+BULK_INSERT_CHUNK_SIZE = 1000
+DUPLICATE_KEY_ERROR = 11000
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+SEARCH_GRAM_SIZE = 3
 
-def add_contact(contact: Contact):
+# Fields managed by the server that clients may not overwrite
+PROTECTED_FIELDS = {"_id", "user_id", "version", "search"}
+
+
+def _grams(value: str):
+    """Distinct character trigrams of a lowercased value, used for indexed substring search"""
+    return sorted({value[i:i + SEARCH_GRAM_SIZE] for i in range(len(value) - SEARCH_GRAM_SIZE + 1)})
+
+
+def search_fields(name: Optional[str] = None, email: Optional[str] = None, phone: Optional[int] = None):
+    """Normalized search.* values for whichever of name/email/phone are given, keyed by dotted path"""
+    fields = {}
+    if name is not None:
+        fields["search.name"] = str(name).lower()
+        fields["search.name_grams"] = _grams(str(name).lower())
+    if email is not None:
+        fields["search.email"] = str(email).lower()
+        fields["search.email_grams"] = _grams(str(email).lower())
+    if phone is not None:
+        fields["search.phone"] = str(phone)
+    return fields
+
+
+def _search_document(name: str, email: str, phone: int):
+    return {key.split(".", 1)[1]: value for key, value in search_fields(name, email, phone).items()}
+
+
+async def add_contact(contact: Contact):
     user_id = str(uuid4())  # Generate unique User ID
     contact_data = {
         "user_id": user_id,
         "name": contact.name,
-        "email": contact.email,
-        "phone": contact.phone
+        "email": normalize_email(contact.email),
+        "phone": contact.phone,
+        "version": 1,
+        "search": _search_document(contact.name, contact.email, contact.phone)
     }
-    contacts_collection.insert_one(contact_data)
+    try:
+        await contacts_collection.insert_one(contact_data)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="A contact with this email already exists")
+    cache_contact(contact_data)
 
     # Log activity in PostgreSQL
     activity = ActivityLog(
@@ -23,26 +74,296 @@ def add_contact(contact: Contact):
         activity_type="CONTACT_CREATED",
         description=f"New contact created for {contact.name}"
     )
-    log_activity(activity)
+    await log_activity(activity)
+    publish_change("contact.created", {"user_id": user_id, "contact": public_contact(contact_data)})
 
-    return {"message": "Contact added successfully", "user_id": user_id}
+    return {"message": "Contact added successfully", "user_id": user_id, "version": 1}
 
 
-def get_all_contacts():
-    contacts = list(contacts_collection.find({}, {"_id": 0}))  # Exclude MongoDB's default _id field
-    return contacts
+def parse_ndjson_contacts(body: bytes):
+    """Split an NDJSON body into items; unparsable lines are kept so they get reported as invalid"""
+    items = []
+    for line in body.decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        try:
+            items.append(json.loads(line))
+        except ValueError:
+            items.append(line)
+    return items
 
 
-def update_contact(user_id: str, updated_data: dict):
-    contact = contacts_collection.find_one({"user_id": user_id})
-    if not contact:
-        raise HTTPException(status_code=404, detail="Contact not found")
+def _validation_message(error: ValidationError):
+    return "; ".join(
+        f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in error.errors()
+    )
+
+
+async def add_contacts_bulk(items: List[Any]):
+    """Validate and insert many contacts with chunked unordered inserts, reporting a result per item"""
+    results = [None] * len(items)
+    pending = []  # (index, contact_data) pairs waiting to be written
+    seen_emails = set()
+
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index] = {"index": index, "status": "invalid", "error": "Item is not a JSON object"}
+            continue
+        try:
+            contact = Contact(**item)
+        except ValidationError as e:
+            results[index] = {"index": index, "status": "invalid", "error": _validation_message(e)}
+            continue
+
+        email = normalize_email(contact.email)
+        if email in seen_emails:
+            results[index] = {"index": index, "status": "duplicate", "email": contact.email}
+            continue
+        seen_emails.add(email)
+
+        pending.append((index, {
+            "user_id": str(uuid4()),
+            "name": contact.name,
+            "email": email,
+            "phone": contact.phone,
+            "version": 1,
+            "search": _search_document(contact.name, contact.email, contact.phone)
+        }))
+
+    created = []
+    for start in range(0, len(pending), BULK_INSERT_CHUNK_SIZE):
+        chunk = pending[start:start + BULK_INSERT_CHUNK_SIZE]
+        write_errors = {}
+        try:
+            await contacts_collection.insert_many([doc for _, doc in chunk], ordered=False)
+        except BulkWriteError as e:
+            write_errors = {err["index"]: err for err in e.details.get("writeErrors", [])}
+
+        for position, (index, doc) in enumerate(chunk):
+            err = write_errors.get(position)
+            if err is None:
+                results[index] = {"index": index, "status": "created", "user_id": doc["user_id"]}
+                created.append(doc)
+            elif err.get("code") == DUPLICATE_KEY_ERROR:
+                results[index] = {"index": index, "status": "duplicate", "email": doc["email"]}
+            else:
+                results[index] = {"index": index, "status": "failed", "error": err.get("errmsg")}
+
+    # Log all creations in PostgreSQL with a single bulk insert
+    await log_activities([
+        ActivityLog(
+            user_id=doc["user_id"],
+            activity_type="CONTACT_CREATED",
+            description=f"New contact created for {doc['name']}"
+        )
+        for doc in created
+    ])
+    for doc in created:
+        publish_change("contact.created", {"user_id": doc["user_id"], "contact": public_contact(doc)})
+
+    return {
+        "message": f"Imported {len(created)} of {len(items)} contacts",
+        "created_count": len(created),
+        "results": results
+    }
+
+
+async def get_all_contacts(
+    limit: int = DEFAULT_PAGE_SIZE,
+    after: Optional[str] = None,
+    fields: Optional[List[str]] = None
+):
+    """Return one page of contacts ordered by user_id, starting after the given cursor"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = {"user_id": {"$gt": after}} if after else {}
+
+    # Fetch one extra document to know whether another page exists
+    cursor = contacts_collection.find(query, contact_projection(fields)).sort("user_id", 1).limit(limit + 1)
+    contacts = await cursor.to_list(length=limit + 1)
+
+    next_cursor = None
+    if len(contacts) > limit:
+        contacts = contacts[:limit]
+        next_cursor = contacts[-1]["user_id"]
+
+    return {"contacts": contacts, "next_cursor": next_cursor}
+
+
+async def stream_all_contacts(batch_size: int = STREAM_BATCH_SIZE, fields: Optional[List[str]] = None):
+    """Yield every contact as an NDJSON line, pulling from MongoDB in batches"""
+    cursor = contacts_collection.find({}, contact_projection(fields)).sort("user_id", 1).batch_size(batch_size)
+    try:
+        async for contact in cursor:
+            yield json.dumps(contact, default=str) + "\n"
+    finally:
+        await cursor.close()
+
+
+def _search_filter(q: Optional[str], match: str, phone: Optional[str], phone_match: str):
+    """Build an index-friendly filter: anchored prefixes on normalized fields, trigram sets for substrings"""
+    clauses = []
+    if q:
+        prefix = {"$regex": "^" + re.escape(q)}
+        if match == "substring" and len(q) >= SEARCH_GRAM_SIZE:
+            grams = _grams(q)
+            contains = {"$regex": re.escape(q)}
+            clauses.append({"$or": [
+                {"search.name_grams": {"$all": grams}, "search.name": contains},
+                {"search.email_grams": {"$all": grams}, "search.email": contains}
+            ]})
+        else:
+            # Substrings shorter than a trigram cannot use the gram index, so they match as prefixes
+            clauses.append({"$or": [{"search.name": prefix}, {"search.email": prefix}]})
+    if phone:
+        if phone_match == "prefix":
+            clauses.append({"search.phone": {"$regex": "^" + re.escape(phone)}})
+        else:
+            clauses.append({"search.phone": phone})
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
 
-    update_fields = {key: value for key, value in updated_data.items() if value is not None}
+
+def _relevance_score(q: Optional[str], phone: Optional[str]):
+    """Aggregation expression ranking exact matches above prefixes above plain substrings.
+
+    User input is wrapped in $literal: a bare string starting with $ would be read as a field path.
+    """
+    def when(condition, points):
+        return {"$cond": [condition, points, 0]}
+
+    def starts_with(field, value):
+        return {"$eq": [{"$indexOfCP": [field, value]}, 0]}
+
+    terms = []
+    if q:
+        term = {"$literal": q}
+        terms += [
+            when({"$eq": ["$search.name", term]}, 100),
+            when({"$eq": ["$search.email", term]}, 90),
+            when(starts_with("$search.name", term), 60),
+            when(starts_with("$search.email", term), 50),
+            when({"$gt": [{"$indexOfCP": ["$search.name", {"$literal": " " + q}]}, -1]}, 30),
+        ]
+    if phone:
+        terms.append(when({"$eq": ["$search.phone", {"$literal": phone}]}, 100))
+    return {"$add": terms or [0]}
+
+
+async def search_contacts(
+    q: Optional[str] = None,
+    match: str = "prefix",
+    phone: Optional[str] = None,
+    phone_match: str = "exact",
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    offset: int = 0
+):
+    """Search contacts by name/email (prefix or substring) and phone (exact or prefix), best matches first"""
+    if match not in ("prefix", "substring") or phone_match not in ("exact", "prefix"):
+        raise HTTPException(status_code=400, detail="match must be prefix|substring and phone_match exact|prefix")
+    q = q.strip().lower() if q else None
+    phone = phone.strip() if phone else None
+    if not q and not phone:
+        raise HTTPException(status_code=400, detail="Provide a search term (q) or phone")
+
+    limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+    offset = max(0, offset)
+    pipeline = [
+        {"$match": _search_filter(q, match, phone, phone_match)},
+        {"$addFields": {"relevance": _relevance_score(q, phone)}},
+        {"$sort": {"relevance": -1, "search.name": 1, "user_id": 1}},
+        {"$skip": offset},
+        {"$limit": limit + 1},
+        {"$project": CONTACT_PROJECTION},
+    ]
+    contacts = await contacts_collection.aggregate(pipeline).to_list(length=limit + 1)
+
+    has_more = len(contacts) > limit
+    return {
+        "contacts": contacts[:limit],
+        "next_offset": offset + limit if has_more else None
+    }
+
+
+async def backfill_search_fields(batch_size: int = BULK_INSERT_CHUNK_SIZE):
+    """Populate search.* on contacts created before search existed; safe to re-run"""
+    cursor = contacts_collection.find(
+        {"search": {"$exists": False}}, {"user_id": 1, "name": 1, "email": 1, "phone": 1}
+    ).batch_size(batch_size)
+    updated = 0
+    batch = []
+    async for contact in cursor:
+        batch.append(UpdateOne(
+            {"_id": contact["_id"]},
+            {"$set": search_fields(contact.get("name", ""), contact.get("email", ""), contact.get("phone", ""))}
+        ))
+        if len(batch) >= batch_size:
+            updated += (await contacts_collection.bulk_write(batch, ordered=False)).modified_count
+            batch = []
+    if batch:
+        updated += (await contacts_collection.bulk_write(batch, ordered=False)).modified_count
+    return updated
+
+
+def etag_for(version: int):
+    return f'"{version}"'
+
+
+def version_from_if_match(if_match: Optional[str]):
+    """Translate an If-Match header into the contact version it requires (None means any version)"""
+    if if_match is None or if_match.strip() == "*":
+        return None
+    tag = if_match.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    try:
+        return int(tag.strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid If-Match header")
+
+
+def _contact_filter(user_id: str, expected_version: Optional[int]):
+    contact_filter = {"user_id": user_id}
+    if expected_version is not None:
+        # Contacts created before versioning have no version field and count as version 0
+        contact_filter["version"] = expected_version if expected_version else None
+    return contact_filter
+
+
+async def _raise_missing_or_conflict(user_id: str, expected_version: Optional[int]):
+    """Called only after a conditional write matched nothing, to pick between 404 and 412"""
+    if expected_version is not None and await contacts_collection.find_one({"user_id": user_id}, {"_id": 1}):
+        raise HTTPException(status_code=412, detail="Contact was modified by another request")
+    raise HTTPException(status_code=404, detail="Contact not found")
+
+
+async def update_contact(user_id: str, updated_data: dict, expected_version: Optional[int] = None):
+    update_fields = {
+        key: value for key, value in updated_data.items()
+        if value is not None and key not in PROTECTED_FIELDS
+    }
     if not update_fields:
         raise HTTPException(status_code=400, detail="No valid fields to update")
+    if update_fields.get("email"):
+        update_fields["email"] = normalize_email(update_fields["email"])
 
-    contacts_collection.update_one({"user_id": user_id}, {"$set": update_fields})
+    try:
+        contact = await contacts_collection.find_one_and_update(
+            _contact_filter(user_id, expected_version),
+            {
+                "$set": {
+                    **update_fields,
+                    **search_fields(update_fields.get("name"), update_fields.get("email"), update_fields.get("phone"))
+                },
+                "$inc": {"version": 1}
+            },
+            projection=CONTACT_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="A contact with this email already exists")
+    if not contact:
+        await _raise_missing_or_conflict(user_id, expected_version)
+    cache_contact(contact)
+    invalidate_linked_views_for_contact(user_id)
 
     # Log activity in PostgreSQL
     field_list = ", ".join(update_fields.keys())
@@ -51,17 +372,29 @@ def update_contact(user_id: str, updated_data: dict):
         activity_type="CONTACT_UPDATED",
         description=f"Updated contact fields: {field_list}"
     )
-    log_activity(activity)
+    await log_activity(activity)
+    publish_change("contact.updated", {
+        "user_id": user_id,
+        "updated_fields": update_fields,
+        "version": contact["version"]
+    })
 
-    return {"message": "Contact updated successfully", "updated_fields": update_fields}
+    return {
+        "message": "Contact updated successfully",
+        "updated_fields": update_fields,
+        "version": contact["version"]
+    }
 
 
-def delete_contact(user_id: str):
-    contact = contacts_collection.find_one({"user_id": user_id})
+async def delete_contact(user_id: str, expected_version: Optional[int] = None):
+    contact = await contacts_collection.find_one_and_delete(
+        _contact_filter(user_id, expected_version),
+        projection=CONTACT_PROJECTION
+    )
     if not contact:
-        raise HTTPException(status_code=404, detail="Contact not found")
-
-    contacts_collection.delete_one({"user_id": user_id})
+        await _raise_missing_or_conflict(user_id, expected_version)
+    invalidate_contact(user_id)
+    await remove_contact_relationships(user_id)
 
     # Log activity in PostgreSQL
     activity = ActivityLog(
@@ -69,6 +402,12 @@ def delete_contact(user_id: str):
         activity_type="CONTACT_DELETED",
         description=f"Contact deleted: {contact['name']}"
     )
-    log_activity(activity)
+    await log_activity(activity)
+    publish_change("contact.deleted", {"user_id": user_id})
+
+    return {"message": "Contact deleted successfully"}
+
 
-    return {"message": "Contact deleted successfully"}
\ No newline at end of file
+if __name__ == "__main__":
+    # python -m core.handlers.contact_handlers  -> backfill search fields for existing contacts
+    print(f"Backfilled search fields on {asyncio.run(backfill_search_fields())} contacts")
@@ -0,0 +1,58 @@
+from utilities.event_bus import EventBus
+from typing import Optional
+import asyncio
+import json
+import time
+
+EVENT_HISTORY_SIZE = 10000
+SUBSCRIBER_QUEUE_SIZE = 1000
+HEARTBEAT_SECONDS = 15
+
+# Change feed for contacts and relationships, consumed through GET /contact/events
+# IDs start from the process start time in milliseconds so they keep increasing across restarts
+change_events = EventBus(
+    history_size=EVENT_HISTORY_SIZE,
+    subscriber_queue_size=SUBSCRIBER_QUEUE_SIZE,
+    first_id=int(time.time() * 1000)
+)
+
+
+def publish_change(event_type: str, data: dict):
+    return change_events.publish(event_type, data)
+
+
+def format_sse(event: dict):
+    payload = json.dumps({**event["data"], "timestamp": event["timestamp"]}, default=str)
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {payload}\n\n"
+
+
+def parse_last_event_id(value: Optional[str]):
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+async def stream_change_events(last_event_id: Optional[int] = None, heartbeat: float = HEARTBEAT_SECONDS):
+    """Yield change events as Server-Sent Events, replaying anything after last_event_id first"""
+    if not change_events.can_resume(last_event_id):
+        # The requested position fell out of the replay window; the client must re-read its state
+        yield format_sse({
+            "id": change_events.last_event_id,
+            "type": "resync",
+            "timestamp": "",
+            "data": {"reason": "Requested events are no longer available"}
+        })
+        last_event_id = None
+
+    subscription = change_events.subscribe(last_event_id)
+    try:
+        while not subscription.overflowed or subscription.pending:
+            try:
+                event = await subscription.get(timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield format_sse(event)
+    finally:
+        subscription.close()
@@ -2,13 +2,29 @@ import io
 import xlsxwriter
 from datetime import datetime
 from fastapi import HTTPException
-from core.handlers.relationship_handlers import get_linked_contacts
-from config.database import contacts_collection, get_db_session, ContactRelationshipTable
+from core.handlers.relationship_handlers import get_link_counts
+from config.database import contacts_collection, get_db_session, ContactRelationshipTable, CONTACT_PROJECTION
+from sqlalchemy import select
 
+REPORT_BATCH_SIZE = 5000
 
-def generate_all_users_excel():
+
+async def _iter_relationships(db, batch_size: int = REPORT_BATCH_SIZE):
+    """Yield (owner_email, linked_user_id, relationship_type) tuples in owner order from one streamed scan"""
+    stmt = select(
+        ContactRelationshipTable.owner_email,
+        ContactRelationshipTable.linked_user_id,
+        ContactRelationshipTable.relationship_type
+    ).order_by(ContactRelationshipTable.owner_email, ContactRelationshipTable.linked_user_id)
+    result = await db.stream(stmt.execution_options(yield_per=batch_size))
+    async for rows in result.partitions(batch_size):
+        for row in rows:
+            yield row
+
+
+async def generate_all_users_excel():
     try:
-        all_users = list(contacts_collection.find({}, {"_id": 0}))
+        all_users = await contacts_collection.find({}, CONTACT_PROJECTION).to_list(length=None)
         if not all_users:
             raise HTTPException(status_code=404, detail="No users found in the database")
 
@@ -24,36 +40,6 @@ def generate_all_users_excel():
         for col_num, header in enumerate(summary_headers):
             summary_sheet.write(3, col_num, header)
 
-        user_linked_counts = {}
-        user_emails = [user.get("email", "") for user in all_users if user.get("email")]
-
-        try:
-            with get_db_session() as db:
-                result = db.query(ContactRelationshipTable.owner_email).all()
-                if user_emails:
-                    for email in user_emails:
-                        count = db.query(ContactRelationshipTable).filter(
-                            ContactRelationshipTable.owner_email == email
-                        ).count()
-                        user_linked_counts[email] = count
-        except Exception as e:
-            print(f"Error fetching relationship counts: {e}")
-
-        for row_num, user in enumerate(all_users, start=4):
-            user_id = user.get("user_id", "N/A")
-            name = user.get("name", "N/A")
-            email = user.get("email", "N/A")
-            phone = str(user.get("phone", "N/A"))
-
-            summary_sheet.write(row_num, 0, user_id)
-            summary_sheet.write(row_num, 1, name)
-            summary_sheet.write(row_num, 2, email)
-            summary_sheet.write(row_num, 3, phone)
-            linked_count = user_linked_counts.get(email, 0)
-            summary_sheet.write(row_num, 4, linked_count)
-
-        summary_sheet.write(len(all_users) + 5, 0, f"Total Users: {len(all_users)}")
-
         details_sheet.write(0, 0, "Contact Management System - Detailed Relationships")
         details_sheet.write(1, 0, f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
@@ -63,38 +49,49 @@ def generate_all_users_excel():
 
         user_map = {user.get("user_id", ""): user for user in all_users if user.get("user_id")}
 
-        all_relationships = []
-        try:
-            with get_db_session() as db:
-                all_relationships = db.query(ContactRelationshipTable).order_by(ContactRelationshipTable.owner_email).all()
-        except Exception as e:
-            print(f"Error fetching relationships: {e}")
-
-        row_num = 4
-        for rel in all_relationships:
+        # Two statements whatever the number of users: the maintained counters, then the details scan
+        async with get_db_session() as db:
+            user_linked_counts = {}
             try:
-                owner_email = rel.owner_email
-                linked_user_id = rel.linked_user_id
-                relationship_type = rel.relationship_type or "Not specified"
+                user_linked_counts = await get_link_counts(db=db)
+            except Exception as e:
+                print(f"Error fetching relationship counts: {e}")
+
+            for row_num, user in enumerate(all_users, start=4):
+                email = user.get("email", "N/A")
+                summary_sheet.write(row_num, 0, user.get("user_id", "N/A"))
+                summary_sheet.write(row_num, 1, user.get("name", "N/A"))
+                summary_sheet.write(row_num, 2, email)
+                summary_sheet.write(row_num, 3, str(user.get("phone", "N/A")))
+                summary_sheet.write(row_num, 4, user_linked_counts.get(email, 0))
 
-                if linked_user_id in user_map:
-                    contact = user_map[linked_user_id]
+            summary_sheet.write(len(all_users) + 5, 0, f"Total Users: {len(all_users)}")
+
+            row_num = 4
+            relationship_count = 0
+            try:
+                async for owner_email, linked_user_id, relationship_type in _iter_relationships(db):
+                    relationship_count += 1
+                    contact = user_map.get(linked_user_id)
+                    if contact is None:
+                        continue
 
                     details_sheet.write(row_num, 0, owner_email)
                     details_sheet.write(row_num, 1, linked_user_id)
                     details_sheet.write(row_num, 2, contact.get("name", "N/A"))
                     details_sheet.write(row_num, 3, contact.get("email", "N/A"))
                     details_sheet.write(row_num, 4, str(contact.get("phone", "N/A")))
-                    details_sheet.write(row_num, 5, relationship_type)
+                    details_sheet.write(row_num, 5, relationship_type or "Not specified")
                     row_num += 1
             except Exception as e:
-                print(f"Error processing relationship: {e}")
-                continue
+                print(f"Error fetching relationships: {e}")
 
-        details_sheet.write(row_num + 1, 0, f"Total Relationships: {len(all_relationships)}" if all_relationships else "No relationships found")
+        details_sheet.write(row_num + 1, 0, f"Total Relationships: {relationship_count}" if relationship_count else "No relationships found")
 
         workbook.close()
         output.seek(0)
         return output.getvalue()
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Excel generation failed: {str(e)}")
@@ -0,0 +1,59 @@
+from config.database import get_db_session, ContactRelationshipTable
+from fastapi import HTTPException
+from sqlalchemy import select
+from utilities.relationship_graph import RelationshipGraph, OWNER, CONTACT
+
+GRAPH_LOAD_BATCH_SIZE = 10000
+MAX_GRAPH_HOPS = 6
+DEFAULT_REACH_LIMIT = 1000
+
+# Built from contact_relationships at startup, then kept current by link/unlink
+relationship_graph = RelationshipGraph()
+
+
+async def load_relationship_graph(batch_size: int = GRAPH_LOAD_BATCH_SIZE):
+    """Rebuild the adjacency index from contact_relationships, streaming the edges in batches"""
+    relationship_graph.clear()
+    async with get_db_session() as db:
+        stmt = select(ContactRelationshipTable.owner_email, ContactRelationshipTable.linked_user_id)
+        result = await db.stream(stmt.execution_options(yield_per=batch_size))
+        async for edges in result.partitions(batch_size):
+            relationship_graph.load(edges)
+    return relationship_graph.stats()
+
+
+def _node(kind: str, key: str):
+    return {"type": kind, "id": key}
+
+
+def get_mutual_contacts(owner_a: str, owner_b: str):
+    """Contacts linked by both owners"""
+    mutual = sorted(relationship_graph.mutual(owner_a, owner_b))
+    return {"owner_emails": [owner_a, owner_b], "mutual_user_ids": mutual, "count": len(mutual)}
+
+
+def get_contacts_within(owner_email: str, hops: int, limit: int = DEFAULT_REACH_LIMIT):
+    """Contacts reachable from an owner within hops links, nearest first.
+
+    One hop is the owner's own contacts; three hops adds contacts of owners who share a contact, and so on.
+    The walk stops one contact past limit, which is enough to tell whether the list was truncated.
+    """
+    if hops < 1 or hops > MAX_GRAPH_HOPS:
+        raise HTTPException(status_code=400, detail=f"hops must be between 1 and {MAX_GRAPH_HOPS}")
+
+    distances = relationship_graph.within((OWNER, owner_email), hops, limit=limit + 1, kind=CONTACT)
+    reached = [(key, distance) for (kind, key), distance in distances.items() if kind == CONTACT]
+    contacts = [{"user_id": key, "distance": distance} for key, distance in reached[:limit]]
+    return {"owner_email": owner_email, "hops": hops, "contacts": contacts, "truncated": len(reached) > limit}
+
+
+def get_shortest_path(from_email: str, to_email: str = None, to_user_id: str = None, max_hops: int = MAX_GRAPH_HOPS):
+    """Shortest chain of links from an owner to another owner or to a contact"""
+    if bool(to_email) == bool(to_user_id):
+        raise HTTPException(status_code=400, detail="Pass exactly one of to_email or to_user_id")
+
+    target = (OWNER, to_email) if to_email else (CONTACT, to_user_id)
+    path = relationship_graph.shortest_path((OWNER, from_email), target, max_hops)
+    if path is None:
+        raise HTTPException(status_code=404, detail="No link path found")
+    return {"path": [_node(kind, key) for kind, key in path], "length": len(path) - 1}
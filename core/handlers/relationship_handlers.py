@@ -1,112 +1,442 @@
-from core.models.relationship_model import ContactRelationship, ContactRelationshipBulk
+from core.models.relationship_model import (
+    ContactRelationship,
+    ContactRelationshipBulk,
+    ContactRelationshipUnlinkBulk,
+    ContactRelationshipSet
+)
 from core.models.postgres_models import ActivityLog
-from core.handlers.activity_handlers import log_activity
-from config.database import get_db_session, contacts_collection, ContactRelationshipTable
+from core.handlers.activity_handlers import log_activity, insert_activities
+from config.database import get_db_session, upsert_insert, ContactRelationshipTable, RelationshipCountTable
+from core.handlers.contact_cache import get_cached_contact, get_cached_contacts
+from core.handlers.event_handlers import publish_change
+from core.handlers.graph_handlers import relationship_graph
+from collections import Counter
+from datetime import datetime
 from fastapi import HTTPException
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy import select, insert, delete, func, or_, and_
+from typing import Dict, List, Optional
+import asyncio
+import sys
+from utilities.cursor import encode_cursor, decode_cursor
+from utilities.ttl_cache import LRUTTLCache
 
+DEFAULT_LINKED_PAGE_SIZE = 100
+LINKED_VIEW_MAX_OWNERS = 1000
+LINKED_VIEW_MAX_PAGES = 64
+LINKED_VIEW_TTL_SECONDS = 300
 
-def add_contact_relationship(relationship: ContactRelationship):
-    """Add a relationship between a user email and a contact"""
-    contact = contacts_collection.find_one({"user_id": relationship.linked_user_id})
+LINKED_SORT_COLUMNS = {
+    "created_at": ContactRelationshipTable.created_at,
+    "linked_user_id": ContactRelationshipTable.linked_user_id
+}
+
+# Merged linked-contact pages per owner email ({page key: result}); an owner's entry is
+# dropped whenever one of its links, or a contact it links to, changes
+linked_view_cache = LRUTTLCache(maxsize=LINKED_VIEW_MAX_OWNERS, ttl=LINKED_VIEW_TTL_SECONDS)
+
+
+def invalidate_linked_view(owner_email: str):
+    linked_view_cache.invalidate(owner_email)
+
+
+def invalidate_linked_views_for_contact(user_id: str):
+    """A contact changed: drop the cached views of every owner linking to it"""
+    for owner_email in relationship_graph.owners_of(user_id):
+        linked_view_cache.invalidate(owner_email)
+
+
+async def _adjust_link_counts(db, deltas: Dict[str, int]):
+    """Apply per-owner link count changes on the caller's session"""
+    rows = [{"owner_email": owner_email, "linked_count": delta} for owner_email, delta in deltas.items() if delta]
+    if not rows:
+        return
+    stmt = upsert_insert(db, RelationshipCountTable)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[RelationshipCountTable.owner_email],
+        set_={"linked_count": RelationshipCountTable.linked_count + stmt.excluded.linked_count}
+    )
+    await db.execute(stmt, rows)
+
+
+async def upsert_relationships(db, owner_email: str, linked_user_ids: List[str], relationship_type: Optional[str]):
+    """Link contacts to an owner with one INSERT ... ON CONFLICT DO UPDATE statement.
+
+    Existing links keep their created_at, so a returned created_at equal to this call's
+    timestamp means the row was inserted. Returns {linked_user_id: (id, inserted)}.
+    """
+    now = datetime.utcnow()
+    stmt = upsert_insert(db, ContactRelationshipTable)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ContactRelationshipTable.owner_email, ContactRelationshipTable.linked_user_id],
+        set_={"relationship_type": stmt.excluded.relationship_type}
+    ).returning(ContactRelationshipTable.id, ContactRelationshipTable.linked_user_id, ContactRelationshipTable.created_at)
+    rows = (await db.execute(stmt, [
+        {"owner_email": owner_email, "linked_user_id": user_id, "relationship_type": relationship_type, "created_at": now}
+        for user_id in linked_user_ids
+    ])).all()
+    upserted = {row.linked_user_id: (row.id, row.created_at == now) for row in rows}
+    await _adjust_link_counts(db, {owner_email: sum(1 for _, inserted in upserted.values() if inserted)})
+    return upserted
+
+
+def _relationship_activity(owner_email: str, user_id: str, inserted: bool):
+    if inserted:
+        return ActivityLog(user_id=user_id, activity_type="RELATIONSHIP_ADDED", description=f"Contact linked to {owner_email}")
+    return ActivityLog(
+        user_id=user_id,
+        activity_type="RELATIONSHIP_UPDATED",
+        description=f"Contact relationship with {owner_email} updated"
+    )
+
+
+async def add_contact_relationship(relationship: ContactRelationship):
+    """Add a relationship between a user email and a contact, or update the type of an existing one"""
+    contact = await get_cached_contact(relationship.linked_user_id)
     if not contact:
         raise HTTPException(status_code=404, detail="Linked contact not found")
 
-    with get_db_session() as db:
-        try:
-            new_rel = ContactRelationshipTable(
-                owner_email=relationship.owner_email,
-                linked_user_id=relationship.linked_user_id,
-                relationship_type=relationship.relationship_type
-            )
-            db.add(new_rel)
-            db.commit()
-            db.refresh(new_rel)
-
-            activity = ActivityLog(
-                user_id=relationship.linked_user_id,
-                activity_type="RELATIONSHIP_ADDED",
-                description=f"Contact linked to {relationship.owner_email}"
-            )
-            log_activity(activity)
-            return new_rel.id
-
-        except IntegrityError:
-            db.rollback()
-            existing_rel = db.query(ContactRelationshipTable).filter(
-                ContactRelationshipTable.owner_email == relationship.owner_email,
-                ContactRelationshipTable.linked_user_id == relationship.linked_user_id
-            ).first()
-
-            if existing_rel:
-                existing_rel.relationship_type = relationship.relationship_type
-                db.commit()
-                activity = ActivityLog(
-                    user_id=relationship.linked_user_id,
-                    activity_type="RELATIONSHIP_UPDATED",
-                    description=f"Contact relationship with {relationship.owner_email} updated"
-                )
-                log_activity(activity)
-                return existing_rel.id
-
-
-def add_bulk_relationships(bulk_data: ContactRelationshipBulk):
-    added_count = 0
-    failed_ids = []
-
-    for user_id in bulk_data.linked_user_ids:
-        try:
-            relationship = ContactRelationship(
-                owner_email=bulk_data.owner_email,
-                linked_user_id=user_id,
-                relationship_type=bulk_data.relationship_type
-            )
-            add_contact_relationship(relationship)
-            added_count += 1
-        except HTTPException:
-            failed_ids.append(user_id)
+    async with get_db_session() as db:
+        upserted = await upsert_relationships(
+            db, relationship.owner_email, [relationship.linked_user_id], relationship.relationship_type
+        )
+        await db.commit()
+    relationship_graph.add(relationship.owner_email, relationship.linked_user_id)
+    invalidate_linked_view(relationship.owner_email)
 
-    return {"added_count": added_count, "failed_ids": failed_ids}
+    relationship_id, inserted = upserted[relationship.linked_user_id]
+    await log_activity(_relationship_activity(relationship.owner_email, relationship.linked_user_id, inserted))
+    publish_change("relationship.added" if inserted else "relationship.updated", {
+        "owner_email": relationship.owner_email,
+        "linked_user_id": relationship.linked_user_id,
+        "relationship_type": relationship.relationship_type
+    })
+    return relationship_id
 
 
-def remove_contact_relationship(owner_email: str, linked_user_id: str):
-    with get_db_session() as db:
-        rel = db.query(ContactRelationshipTable).filter(
-            ContactRelationshipTable.owner_email == owner_email,
-            ContactRelationshipTable.linked_user_id == linked_user_id
-        ).first()
+async def add_bulk_relationships(bulk_data: ContactRelationshipBulk):
+    """Link many contacts to an owner with one contact lookup and one transaction.
 
-        if not rel:
-            raise HTTPException(status_code=404, detail="Relationship not found")
+    Unknown contacts are reported in failed_ids; contacts that are already linked to the
+    owner get their relationship_type updated, as with add_contact_relationship.
+    """
+    user_ids = list(dict.fromkeys(bulk_data.linked_user_ids))
+    contacts = await get_cached_contacts(user_ids)
+    found_ids = [user_id for user_id in user_ids if user_id in contacts]
+    failed_ids = [user_id for user_id in user_ids if user_id not in contacts]
+    if not found_ids:
+        return {"added_count": 0, "failed_ids": failed_ids}
+
+    owner_email = bulk_data.owner_email
+    async with get_db_session() as db:
+        upserted = await upsert_relationships(db, owner_email, found_ids, bulk_data.relationship_type)
+        await insert_activities(db, [
+            _relationship_activity(owner_email, user_id, upserted[user_id][1]) for user_id in found_ids
+        ])
+        await db.commit()
+    invalidate_linked_view(owner_email)
+
+    for user_id in found_ids:
+        relationship_graph.add(owner_email, user_id)
+        publish_change("relationship.added" if upserted[user_id][1] else "relationship.updated", {
+            "owner_email": owner_email,
+            "linked_user_id": user_id,
+            "relationship_type": bulk_data.relationship_type
+        })
 
-        db.delete(rel)
-        db.commit()
+    return {"added_count": len(found_ids), "failed_ids": failed_ids}
+
+
+async def remove_contact_relationship(owner_email: str, linked_user_id: str):
+    async with get_db_session() as db:
+        # DELETE ... RETURNING decides the outcome, so of two concurrent unlinks only one decrements the count
+        if not await _delete_links(db, owner_email, [linked_user_id]):
+            raise HTTPException(status_code=404, detail="Relationship not found")
+        await db.commit()
+        relationship_graph.remove(owner_email, linked_user_id)
+        invalidate_linked_view(owner_email)
 
         activity = ActivityLog(
             user_id=linked_user_id,
             activity_type="RELATIONSHIP_REMOVED",
             description=f"Contact unlinked from {owner_email}"
         )
-        log_activity(activity)
+        await log_activity(activity)
+        publish_change("relationship.removed", {"owner_email": owner_email, "linked_user_id": linked_user_id})
         return {"message": "Relationship removed successfully"}
 
 
-def get_linked_contacts(owner_email: str):
-    with get_db_session() as db:
-        relationships = db.query(ContactRelationshipTable).filter(
-            ContactRelationshipTable.owner_email == owner_email
-        ).all()
-
-    if not relationships:
+async def _delete_links(db, owner_email: str, user_ids: List[str]):
+    """Delete an owner's links to user_ids in one statement and return the ids actually removed"""
+    if not user_ids:
         return []
+    removed = (await db.execute(
+        delete(ContactRelationshipTable).where(
+            ContactRelationshipTable.owner_email == owner_email,
+            ContactRelationshipTable.linked_user_id.in_(user_ids)
+        ).returning(ContactRelationshipTable.linked_user_id)
+    )).scalars().all()
+    await _adjust_link_counts(db, {owner_email: -len(removed)})
+    return removed
+
+
+def _unlink_activity(owner_email: str, user_id: str):
+    return ActivityLog(user_id=user_id, activity_type="RELATIONSHIP_REMOVED", description=f"Contact unlinked from {owner_email}")
+
+
+async def remove_bulk_relationships(bulk_data: ContactRelationshipUnlinkBulk):
+    """Unlink many contacts from an owner with one DELETE and one commit"""
+    owner_email = bulk_data.owner_email
+    user_ids = list(dict.fromkeys(bulk_data.linked_user_ids))
+    async with get_db_session() as db:
+        removed = await _delete_links(db, owner_email, user_ids)
+        await insert_activities(db, [_unlink_activity(owner_email, user_id) for user_id in removed])
+        await db.commit()
+
+    for user_id in removed:
+        relationship_graph.remove(owner_email, user_id)
+        publish_change("relationship.removed", {"owner_email": owner_email, "linked_user_id": user_id})
+    invalidate_linked_view(owner_email)
+
+    removed_ids = set(removed)
+    return {
+        "removed_count": len(removed),
+        "not_found_ids": [user_id for user_id in user_ids if user_id not in removed_ids]
+    }
+
+
+async def replace_relationships(owner_email: str, relationship_set: ContactRelationshipSet):
+    """Make an owner's links exactly relationship_set.linked_user_ids.
+
+    The diff against the current links (removals, new links, type changes) is applied in a
+    single transaction together with its activity rows. Ids without a contact are skipped
+    and reported in failed_ids.
+    """
+    user_ids = list(dict.fromkeys(relationship_set.linked_user_ids))
+    relationship_type = relationship_set.relationship_type
+    contacts = await get_cached_contacts(user_ids) if user_ids else {}
+    desired = [user_id for user_id in user_ids if user_id in contacts]
+    failed_ids = [user_id for user_id in user_ids if user_id not in contacts]
+
+    async with get_db_session() as db:
+        current = dict((await db.execute(
+            select(ContactRelationshipTable.linked_user_id, ContactRelationshipTable.relationship_type).where(
+                ContactRelationshipTable.owner_email == owner_email
+            )
+        )).all())
+        desired_ids = set(desired)
+        to_remove = [user_id for user_id in current if user_id not in desired_ids]
+        to_upsert = [
+            user_id for user_id in desired
+            if user_id not in current or current[user_id] != relationship_type
+        ]
+
+        removed = await _delete_links(db, owner_email, to_remove)
+        upserted = await upsert_relationships(db, owner_email, to_upsert, relationship_type) if to_upsert else {}
+        await insert_activities(db, [_unlink_activity(owner_email, user_id) for user_id in removed] + [
+            _relationship_activity(owner_email, user_id, upserted[user_id][1]) for user_id in to_upsert
+        ])
+        await db.commit()
+
+    for user_id in removed:
+        relationship_graph.remove(owner_email, user_id)
+        publish_change("relationship.removed", {"owner_email": owner_email, "linked_user_id": user_id})
+    for user_id in to_upsert:
+        relationship_graph.add(owner_email, user_id)
+        publish_change("relationship.added" if upserted[user_id][1] else "relationship.updated", {
+            "owner_email": owner_email,
+            "linked_user_id": user_id,
+            "relationship_type": relationship_type
+        })
+    invalidate_linked_view(owner_email)
+
+    added_count = sum(1 for _, inserted in upserted.values() if inserted)
+    return {
+        "added_count": added_count,
+        "updated_count": len(upserted) - added_count,
+        "removed_count": len(removed),
+        "unchanged_count": len(desired) - len(upserted),
+        "failed_ids": failed_ids
+    }
+
+
+async def get_contact_owners(user_id: str):
+    """Owners that link to a contact (reverse lookup on idx_linked_user_id)"""
+    async with get_db_session() as db:
+        rows = (await db.execute(
+            select(
+                ContactRelationshipTable.owner_email,
+                ContactRelationshipTable.relationship_type,
+                ContactRelationshipTable.created_at
+            ).where(ContactRelationshipTable.linked_user_id == user_id).order_by(ContactRelationshipTable.owner_email)
+        )).mappings().all()
+    return [dict(row) for row in rows]
+
+
+async def remove_contact_relationships(user_id: str):
+    """Cascade for a deleted contact: drop every link to it with one DELETE and log the unlinks in bulk"""
+    async with get_db_session() as db:
+        owners = (await db.execute(
+            delete(ContactRelationshipTable).where(
+                ContactRelationshipTable.linked_user_id == user_id
+            ).returning(ContactRelationshipTable.owner_email)
+        )).scalars().all()
+        await _adjust_link_counts(db, {owner_email: -count for owner_email, count in Counter(owners).items()})
+        await insert_activities(db, [
+            ActivityLog(
+                user_id=user_id,
+                activity_type="RELATIONSHIP_REMOVED",
+                description=f"Contact unlinked from {owner_email} (contact deleted)"
+            )
+            for owner_email in owners
+        ])
+        await db.commit()
+
+    relationship_graph.remove_contact(user_id)
+    for owner_email in owners:
+        invalidate_linked_view(owner_email)
+        publish_change("relationship.removed", {"owner_email": owner_email, "linked_user_id": user_id})
+    return len(owners)
+
+
+def _encode_link_cursor(sort: str, row):
+    value = getattr(row, sort)
+    return encode_cursor({"sort": sort, "value": value.isoformat() if sort == "created_at" else value, "id": row.id})
+
+
+def _decode_link_cursor(cursor: str, sort: str):
+    data = decode_cursor(cursor)
+    try:
+        if data["sort"] != sort:
+            raise ValueError("cursor was issued for another sort")
+        value = datetime.fromisoformat(data["value"]) if sort == "created_at" else str(data["value"])
+        return value, int(data["id"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def _load_linked_page(owner_email: str, fields, limit: int, cursor, sort: str, order: str):
+    column = LINKED_SORT_COLUMNS[sort]
+    descending = order == "desc"
+    stmt = select(
+        ContactRelationshipTable.id,
+        ContactRelationshipTable.linked_user_id,
+        ContactRelationshipTable.relationship_type,
+        ContactRelationshipTable.created_at
+    ).where(ContactRelationshipTable.owner_email == owner_email)
+
+    if cursor:
+        value, last_id = _decode_link_cursor(cursor, sort)
+        if descending:
+            stmt = stmt.where(or_(column < value, and_(column == value, ContactRelationshipTable.id < last_id)))
+        else:
+            stmt = stmt.where(or_(column > value, and_(column == value, ContactRelationshipTable.id > last_id)))
+
+    ordering = (column.desc(), ContactRelationshipTable.id.desc()) if descending else (column, ContactRelationshipTable.id)
+    async with get_db_session() as db:
+        rows = (await db.execute(stmt.order_by(*ordering).limit(limit + 1))).all()
+
+    page = rows[:limit]
+    next_cursor = _encode_link_cursor(sort, page[-1]) if len(rows) > limit else None
+
+    # The Mongo $in only ever covers one page of ids
+    contact_fields = [field for field in fields if field != "relationship_type"] if fields else None
+    contacts_by_id = await get_cached_contacts([row.linked_user_id for row in page], contact_fields) if page else {}
+    include_type = not fields or "relationship_type" in fields
+
+    linked_contacts = []
+    for row in page:
+        contact = contacts_by_id.get(row.linked_user_id)
+        if contact:
+            if include_type:
+                contact["relationship_type"] = row.relationship_type
+            linked_contacts.append(contact)
+
+    return {"linked_contacts": linked_contacts, "next_cursor": next_cursor}
+
+
+async def get_linked_contacts_page(
+    owner_email: str,
+    fields: Optional[List[str]] = None,
+    limit: int = DEFAULT_LINKED_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    sort: str = "created_at",
+    order: str = "asc"
+):
+    """One keyset page of an owner's linked contacts, merged with the contact documents.
+
+    Pages are cached per owner until a link/unlink for that owner or an update to one of its contacts.
+    """
+    key = (limit, cursor, sort, order, tuple(fields) if fields else None)
+    view = linked_view_cache.get(owner_email)
+    if view is None:
+        view = {}
+        linked_view_cache.set(owner_email, view)
+    elif key in view:
+        return view[key]
+
+    result = await _load_linked_page(owner_email, fields, limit, cursor, sort, order)
+
+    # Skip caching if the owner's view was invalidated while this page was being built
+    if linked_view_cache.get(owner_email) is view:
+        if len(view) >= LINKED_VIEW_MAX_PAGES:
+            view.clear()
+        view[key] = result
+    return result
+
+
+async def get_link_counts(owner_emails: Optional[List[str]] = None, db=None):
+    """Maintained link counts keyed by owner email (all owners when owner_emails is None).
+
+    Runs on db when given, so callers can read the counts in the same session as their other queries.
+    """
+    stmt = select(RelationshipCountTable.owner_email, RelationshipCountTable.linked_count)
+    if owner_emails is not None:
+        stmt = stmt.where(RelationshipCountTable.owner_email.in_(owner_emails))
+    if db is not None:
+        return dict((await db.execute(stmt)).all())
+    async with get_db_session() as db:
+        return dict((await db.execute(stmt)).all())
+
+
+async def get_link_count(owner_email: str):
+    async with get_db_session() as db:
+        count = (await db.execute(
+            select(RelationshipCountTable.linked_count).where(RelationshipCountTable.owner_email == owner_email)
+        )).scalar()
+    return count or 0
+
+
+async def check_relationship_counts(repair: bool = False):
+    """Compare relationship_counts with the links actually stored; with repair, rebuild the counters"""
+    async with get_db_session() as db:
+        actual = dict((await db.execute(
+            select(ContactRelationshipTable.owner_email, func.count()).group_by(ContactRelationshipTable.owner_email)
+        )).all())
+        stored = dict((await db.execute(
+            select(RelationshipCountTable.owner_email, RelationshipCountTable.linked_count)
+        )).all())
+
+        mismatches = [
+            {"owner_email": owner_email, "stored": stored.get(owner_email, 0), "actual": actual.get(owner_email, 0)}
+            for owner_email in sorted(set(actual) | set(stored))
+            if stored.get(owner_email, 0) != actual.get(owner_email, 0)
+        ]
+
+        if repair and mismatches:
+            await db.execute(delete(RelationshipCountTable))
+            if actual:
+                await db.execute(insert(RelationshipCountTable), [
+                    {"owner_email": owner_email, "linked_count": count} for owner_email, count in actual.items()
+                ])
+            await db.commit()
 
-    user_ids = [rel.linked_user_id for rel in relationships]
-    relationship_map = {rel.linked_user_id: rel.relationship_type for rel in relationships}
-    linked_contacts = list(contacts_collection.find({"user_id": {"$in": user_ids}}, {"_id": 0}))
+    return {"owners_checked": len(set(actual) | set(stored)), "mismatches": mismatches, "repaired": repair and bool(mismatches)}
 
-    for contact in linked_contacts:
-        contact["relationship_type"] = relationship_map.get(contact["user_id"])
 
-    return linked_contacts
+if __name__ == "__main__":
+    # python -m core.handlers.relationship_handlers [--repair]  -> verify (and optionally rebuild) link counters
+    report = asyncio.run(check_relationship_counts(repair="--repair" in sys.argv[1:]))
+    for mismatch in report["mismatches"]:
+        print(f"{mismatch['owner_email']}: stored {mismatch['stored']}, actual {mismatch['actual']}")
+    print(f"Checked {report['owners_checked']} owners, {len(report['mismatches'])} mismatched"
+          + (", counters rebuilt" if report["repaired"] else ""))
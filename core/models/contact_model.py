@@ -1,4 +1,9 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, AfterValidator
+from typing import Annotated
+from config.database import normalize_email
+
+# An email in the form contacts and relationships store it, usable on models and as a route parameter
+NormalizedEmail = Annotated[EmailStr, AfterValidator(normalize_email)]
 
 class Contact(BaseModel):
     name: str
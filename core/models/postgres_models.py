@@ -1,17 +1,39 @@
-from pydantic import BaseModel
-from datetime import datetime
-from typing import Optional
+from pydantic import BaseModel, Field, AfterValidator
+from datetime import datetime, timezone
+from typing import Optional, List, Annotated
+
+
+def naive_utc(timestamp: Optional[datetime]):
+    """Activity timestamps are stored and archived as naive UTC; convert timezone-aware values to match"""
+    if timestamp is None or timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+# A client-supplied datetime ("...Z" or with an offset) in the form activity timestamps are compared in
+UtcDateTime = Annotated[datetime, AfterValidator(naive_utc)]
 
 
 class ActivityLog(BaseModel):
     user_id: str
     activity_type: str
     description: Optional[str] = None
-    timestamp: Optional[datetime] = None
+    timestamp: Optional[UtcDateTime] = None
 
 
 class ActivityQuery(BaseModel):
     user_id: Optional[str] = None
     activity_type: Optional[str] = None
-    start_date: Optional[datetime] = None
-    end_date: Optional[datetime] = None
\ No newline at end of file
+    start_date: Optional[UtcDateTime] = None
+    end_date: Optional[UtcDateTime] = None
+    limit: int = Field(100, ge=1, le=1000)
+    cursor: Optional[str] = None  # opaque next_cursor from a previous page
+    include_archived: bool = False  # also read archived monthly partitions inside the date range
+
+
+class ActivityBatchQuery(BaseModel):
+    user_ids: List[str] = Field(..., min_length=1, max_length=500)
+    limit: int = Field(10, ge=1, le=100)  # newest activities returned per user
+    activity_type: Optional[str] = None
+    start_date: Optional[UtcDateTime] = None
+    end_date: Optional[UtcDateTime] = None
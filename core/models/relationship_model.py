@@ -1,17 +1,26 @@
 from pydantic import BaseModel, EmailStr
 from typing import Optional, List
 from datetime import datetime
+from core.models.contact_model import NormalizedEmail
 
 class ContactRelationship(BaseModel):
-    owner_email: EmailStr
+    owner_email: NormalizedEmail
     linked_user_id: str
     relationship_type: Optional[str] = None
 
 class ContactRelationshipBulk(BaseModel):
-    owner_email: EmailStr
+    owner_email: NormalizedEmail
     linked_user_ids: List[str]
     relationship_type: Optional[str] = None
 
+class ContactRelationshipUnlinkBulk(BaseModel):
+    owner_email: NormalizedEmail
+    linked_user_ids: List[str]
+
+class ContactRelationshipSet(BaseModel):
+    linked_user_ids: List[str]  # the complete set of contacts the owner should be linked to
+    relationship_type: Optional[str] = None
+
 class LinkedContact(BaseModel):
     user_id: str
     name: str
@@ -1,26 +1,104 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response, Header
+from fastapi.responses import StreamingResponse
+from typing import Optional, Annotated
 from core.models.contact_model import Contact
-from core.handlers.contact_handlers import add_contact, get_all_contacts, update_contact, delete_contact
+from core.handlers.contact_handlers import (
+    add_contact,
+    add_contacts_bulk,
+    parse_ndjson_contacts,
+    get_all_contacts,
+    stream_all_contacts,
+    search_contacts,
+    update_contact,
+    delete_contact,
+    etag_for,
+    version_from_if_match,
+    DEFAULT_PAGE_SIZE,
+    DEFAULT_SEARCH_LIMIT
+)
+from core.handlers.contact_cache import contact_cache
+from core.handlers.event_handlers import stream_change_events, parse_last_event_id
+from config.database import CONTACT_FIELDS
+from utilities.fields import parse_fields
 
 router = APIRouter(prefix="/contact", tags=["Contact Management"])
 
 @router.post("/add")
 async def add_new_contact(contact: Contact):
-    response = add_contact(contact)
+    response = await add_contact(contact)
+    return response
+
+@router.post("/bulk")
+async def add_contacts_in_bulk(request: Request):
+    """Import many contacts from a JSON array or an application/x-ndjson body"""
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        items = parse_ndjson_contacts(await request.body())
+    else:
+        try:
+            items = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Request body is not valid JSON")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON array of contacts")
+    response = await add_contacts_bulk(items)
     return response
 
 @router.get("/all")
-async def fetch_all_contacts():
-    contacts = get_all_contacts()
-    return {"contacts": contacts}
+async def fetch_all_contacts(
+    limit: int = DEFAULT_PAGE_SIZE,
+    after: Optional[str] = None,
+    stream: bool = False,
+    fields: Optional[str] = None
+):
+    """List contacts page by page, or stream all of them as NDJSON when stream=true"""
+    selected = parse_fields(fields, CONTACT_FIELDS)
+    if stream:
+        return StreamingResponse(stream_all_contacts(fields=selected), media_type="application/x-ndjson")
+    return await get_all_contacts(limit, after, selected)
+
+@router.get("/events")
+async def stream_contact_events(
+    last_event_id: Optional[str] = None,
+    last_event_id_header: Annotated[Optional[str], Header(alias="Last-Event-ID")] = None
+):
+    """Server-Sent Events feed of contact and relationship changes; resumes after Last-Event-ID"""
+    resume_from = parse_last_event_id(last_event_id_header or last_event_id)
+    return StreamingResponse(
+        stream_change_events(resume_from),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/search")
+async def search_contact_list(
+    q: Optional[str] = None,
+    match: str = "prefix",
+    phone: Optional[str] = None,
+    phone_match: str = "exact",
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    offset: int = 0
+):
+    """Search contacts by name/email prefix or substring and by phone, ordered by relevance"""
+    return await search_contacts(q, match, phone, phone_match, limit, offset)
 
 @router.put("/update/{user_id}")
-async def update_contact_details(user_id: str, updated_data: dict):
-    response = update_contact(user_id, updated_data)
-    return response
+async def update_contact_details(
+    user_id: str,
+    updated_data: dict,
+    response: Response,
+    if_match: Annotated[Optional[str], Header()] = None
+):
+    """Update a contact; send the ETag from a previous response in If-Match to avoid lost updates"""
+    result = await update_contact(user_id, updated_data, version_from_if_match(if_match))
+    response.headers["ETag"] = etag_for(result["version"])
+    return result
 
 @router.delete("/delete/{user_id}")
-async def delete_contact_details(user_id: str):
-    response = delete_contact(user_id)
+async def delete_contact_details(user_id: str, if_match: Annotated[Optional[str], Header()] = None):
+    response = await delete_contact(user_id, version_from_if_match(if_match))
     return response
 
+@router.get("/cache/stats")
+async def get_contact_cache_stats():
+    """Hit/miss counters and size of the in-process contact cache"""
+    return contact_cache.stats()
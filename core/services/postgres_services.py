@@ -1,24 +1,85 @@
-from fastapi import APIRouter, HTTPException
-from core.models.postgres_models import ActivityQuery
-from core.handlers.activity_handlers import get_user_activities, get_contact_with_activities
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from core.models.postgres_models import ActivityQuery, ActivityBatchQuery, UtcDateTime
+from core.handlers.activity_handlers import (
+    get_user_activities,
+    get_contact_with_activities,
+    get_activity_stats,
+    get_activities_for_users,
+    stream_activities,
+    decode_activity_cursor,
+    ACTIVITY_FIELDS,
+    activity_writer
+)
+from utilities.fields import parse_fields
+from datetime import datetime
+from typing import Optional, Annotated, Literal
 
 router = APIRouter(prefix="/activities", tags=["Activity Tracking"])
 
 @router.get("/user/{user_id}")
-async def get_user_activity_history(user_id: str):
-    """Get all activity logs for a specific user"""
-    query = ActivityQuery(user_id=user_id)
-    activities = get_user_activities(query)
-    return {"activities": activities}
+async def get_user_activity_history(
+    user_id: str,
+    limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+    cursor: Optional[str] = None,
+    include_archived: bool = False
+):
+    """Get activity logs for a specific user, newest first, one page at a time"""
+    query = ActivityQuery(user_id=user_id, limit=limit, cursor=cursor, include_archived=include_archived)
+    return await get_user_activities(query)
 
 @router.post("/search")
-async def search_activities(query: ActivityQuery):
-    """Search for activities based on various criteria"""
-    activities = get_user_activities(query)
-    return {"activities": activities}
+async def search_activities(
+    query: ActivityQuery,
+    fields: Optional[str] = None,
+    stream: bool = False,
+    format: Literal["ndjson", "csv"] = "ndjson"
+):
+    """Search for activities based on various criteria; pass next_cursor back as cursor for the next page.
+
+    With stream=true every match is exported as NDJSON or CSV instead of one page.
+    """
+    selected = parse_fields(fields, ACTIVITY_FIELDS)
+    if stream:
+        # Validate the cursor before the 200 headers go out; errors inside the stream can't change the status
+        cursor = decode_activity_cursor(query.cursor) if query.cursor else None
+        if format == "csv":
+            return StreamingResponse(
+                stream_activities(query, selected, "csv", cursor=cursor),
+                media_type="text/csv",
+                headers={"Content-Disposition": 'attachment; filename="activities.csv"'}
+            )
+        return StreamingResponse(stream_activities(query, selected, cursor=cursor), media_type="application/x-ndjson")
+    return await get_user_activities(query, selected)
+
+@router.post("/batch")
+async def get_batch_activities(batch: ActivityBatchQuery, fields: Optional[str] = None):
+    """Newest activities for up to 500 users in one call, grouped by user_id"""
+    return await get_activities_for_users(batch, parse_fields(fields, ACTIVITY_FIELDS))
+
+@router.get("/stats")
+async def get_activity_statistics(
+    interval: Literal["hour", "day"] = "hour",
+    start: Optional[UtcDateTime] = None,
+    end: Optional[UtcDateTime] = None,
+    activity_type: Optional[str] = None,
+    user_id: Optional[str] = None
+):
+    """Activity counts per hour or day and activity type, served from pre-aggregated rollups"""
+    return await get_activity_stats(interval, start, end, activity_type, user_id)
 
 @router.get("/contact-with-history/{user_id}")
-async def get_contact_details_with_history(user_id: str):
-    """Get contact details from MongoDB with activity history from PostgreSQL"""
-    result = get_contact_with_activities(user_id)
-    return result
\ No newline at end of file
+async def get_contact_details_with_history(
+    user_id: str,
+    limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+    cursor: Optional[str] = None,
+    include_relationships: bool = False
+):
+    """Get contact details from MongoDB with a page of activity history (and optionally its relationships)"""
+    result = await get_contact_with_activities(user_id, limit, cursor, include_relationships)
+    return result
+
+@router.get("/writer/stats")
+async def get_activity_writer_stats():
+    """Queue depth and throughput of the background activity log writer"""
+    return activity_writer.stats()
@@ -1,16 +1,38 @@
-from fastapi import APIRouter, HTTPException, Response
+from fastapi import APIRouter, HTTPException, Query, Response
 from datetime import datetime
-from core.models.relationship_model import ContactRelationship, ContactRelationshipBulk
+from core.models.contact_model import NormalizedEmail
+from core.models.relationship_model import (
+    ContactRelationship,
+    ContactRelationshipBulk,
+    ContactRelationshipUnlinkBulk,
+    ContactRelationshipSet
+)
 from core.handlers.relationship_handlers import (
     add_contact_relationship,
     add_bulk_relationships,
     remove_contact_relationship,
-    get_linked_contacts
+    remove_bulk_relationships,
+    replace_relationships,
+    get_linked_contacts_page,
+    get_contact_owners,
+    get_link_count,
+    DEFAULT_LINKED_PAGE_SIZE
+)
+from core.handlers.graph_handlers import (
+    get_mutual_contacts,
+    get_contacts_within,
+    get_shortest_path,
+    relationship_graph,
+    DEFAULT_REACH_LIMIT,
+    MAX_GRAPH_HOPS
 )
 from core.handlers.excel_handler import generate_all_users_excel
 from core.models.postgres_models import ActivityLog
 from core.handlers.activity_handlers import log_activity
 from pydantic import EmailStr
+from typing import Optional, Annotated, Literal
+from config.database import CONTACT_FIELDS
+from utilities.fields import parse_fields
 
 router = APIRouter(prefix="/contacts/relationships", tags=["Contact Relationships"])
 
@@ -18,7 +40,7 @@ router = APIRouter(prefix="/contacts/relationships", tags=["Contact Relationship
 @router.post("/link")
 async def link_contact(relationship: ContactRelationship):
     """Link a contact to a user by email"""
-    relationship_id = add_contact_relationship(relationship)
+    relationship_id = await add_contact_relationship(relationship)
     return {
         "message": "Contact linked successfully",
         "relationship_id": relationship_id
@@ -28,7 +50,7 @@ async def link_contact(relationship: ContactRelationship):
 @router.post("/link-bulk")
 async def link_multiple_contacts(bulk_data: ContactRelationshipBulk):
     """Link multiple contacts to a user by email in a single operation"""
-    result = add_bulk_relationships(bulk_data)
+    result = await add_bulk_relationships(bulk_data)
     return {
         "message": f"Added {result['added_count']} relationships",
         "failed_ids": result["failed_ids"]
@@ -36,17 +58,82 @@ async def link_multiple_contacts(bulk_data: ContactRelationshipBulk):
 
 
 @router.delete("/unlink")
-async def unlink_contact(owner_email: EmailStr, linked_user_id: str):
+async def unlink_contact(owner_email: NormalizedEmail, linked_user_id: str):
     """Remove a link between a contact and a user"""
-    result = remove_contact_relationship(owner_email, linked_user_id)
+    result = await remove_contact_relationship(owner_email, linked_user_id)
+    return result
+
+
+@router.post("/unlink-bulk")
+async def unlink_multiple_contacts(bulk_data: ContactRelationshipUnlinkBulk):
+    """Remove many links from a user in a single operation"""
+    result = await remove_bulk_relationships(bulk_data)
+    return {
+        "message": f"Removed {result['removed_count']} relationships",
+        "not_found_ids": result["not_found_ids"]
+    }
+
+
+@router.put("/{owner_email}")
+async def replace_linked_contacts(owner_email: NormalizedEmail, relationship_set: ContactRelationshipSet):
+    """Replace a user's links with exactly the given contacts (links not listed are removed)"""
+    result = await replace_relationships(owner_email, relationship_set)
     return result
 
 
 @router.get("/linked/{owner_email}")
-async def get_linked_contact_list(owner_email: EmailStr):
-    """Get all contacts linked to a specific user email"""
-    contacts = get_linked_contacts(owner_email)
-    return {"linked_contacts": contacts, "count": len(contacts)}
+async def get_linked_contact_list(
+    owner_email: NormalizedEmail,
+    fields: Optional[str] = None,
+    limit: Annotated[int, Query(ge=1, le=1000)] = DEFAULT_LINKED_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    sort: Literal["created_at", "linked_user_id"] = "created_at",
+    order: Literal["asc", "desc"] = "asc"
+):
+    """Get contacts linked to a specific user email, one page at a time; pass next_cursor back as cursor"""
+    selected = parse_fields(fields, CONTACT_FIELDS | {"relationship_type"})
+    page = await get_linked_contacts_page(owner_email, selected, limit, cursor, sort, order)
+    return {**page, "count": len(page["linked_contacts"]), "total_count": await get_link_count(owner_email)}
+
+
+@router.get("/owners/{user_id}")
+async def get_linking_owners(user_id: str):
+    """Owners that have linked a specific contact"""
+    owners = await get_contact_owners(user_id)
+    return {"user_id": user_id, "owners": owners, "count": len(owners)}
+
+
+@router.get("/graph/mutual")
+async def get_mutual_linked_contacts(owner_a: NormalizedEmail, owner_b: NormalizedEmail):
+    """Contacts linked by both owners"""
+    return get_mutual_contacts(owner_a, owner_b)
+
+
+@router.get("/graph/reach/{owner_email}")
+async def get_reachable_contacts(
+    owner_email: NormalizedEmail,
+    hops: Annotated[int, Query(ge=1, le=MAX_GRAPH_HOPS)] = 3,
+    limit: Annotated[int, Query(ge=1, le=10000)] = DEFAULT_REACH_LIMIT
+):
+    """Contacts within N links of an owner, nearest first"""
+    return get_contacts_within(owner_email, hops, limit)
+
+
+@router.get("/graph/path")
+async def get_link_path(
+    from_email: NormalizedEmail,
+    to_email: Optional[NormalizedEmail] = None,
+    to_user_id: Optional[str] = None,
+    max_hops: Annotated[int, Query(ge=1, le=MAX_GRAPH_HOPS)] = MAX_GRAPH_HOPS
+):
+    """Shortest chain of links from an owner to another owner (to_email) or a contact (to_user_id)"""
+    return get_shortest_path(from_email, to_email, to_user_id, max_hops)
+
+
+@router.get("/graph/stats")
+async def get_graph_stats():
+    """Size of the in-memory relationship graph"""
+    return relationship_graph.stats()
 
 
 @router.get("/export-excel/{owner_email}")
@@ -59,7 +146,7 @@ async def export_contacts_to_excel(owner_email: EmailStr):
             activity_type="EXPORT_EXCEL",
             description=f"Excel export generated for {owner_email}"
         )
-        log_activity(activity)
+        await log_activity(activity)
 
         # Generate Excel file
         excel_data = generate_contacts_excel(owner_email)
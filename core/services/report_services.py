@@ -19,10 +19,10 @@ async def export_all_users_to_excel():
             activity_type="EXPORT_ALL_USERS",
             description="Excel export generated for all users and their relationships"
         )
-        log_activity(activity)
+        await log_activity(activity)
 
         # Generate Excel file
-        excel_data = generate_all_users_excel()
+        excel_data = await generate_all_users_excel()
 
         # ✅ Send MQTT notification after Excel generation
         send_excel_generated_message("All Users Excel exported")
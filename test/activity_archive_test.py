@@ -0,0 +1,159 @@
+import json
+import pytest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+from sqlalchemy import select, func
+from core.handlers.activity_archive import (
+    archive_activity_logs,
+    archived_months,
+    partitions_for_range,
+    scan_archived_activities
+)
+from core.handlers.activity_handlers import (
+    get_user_activities,
+    get_activity_stats,
+    rebuild_activity_rollups,
+    stream_activities,
+    write_activity_rows
+)
+from core.models.postgres_models import ActivityQuery
+from config.database import ActivityLogTable
+
+SQLITE_DB_MODULES = ["core.handlers.activity_handlers", "core.handlers.activity_archive"]
+
+mock_user_id = "123e4567-e89b-12d3-a456-426614174000"
+
+
+@pytest.fixture(autouse=True)
+def archive_dir(tmp_path):
+    with patch('core.handlers.activity_archive.settings.ACTIVITY_ARCHIVE_DIR', str(tmp_path / "archive")):
+        yield tmp_path / "archive"
+
+
+def _rows(*stamps, user_id=mock_user_id):
+    return [
+        {"user_id": user_id, "activity_type": "TEST_ACTIVITY", "description": ts.isoformat(), "timestamp": ts}
+        for ts in stamps
+    ]
+
+
+async def _hot_count(engine):
+    async with engine.connect() as conn:
+        return (await conn.execute(select(func.count()).select_from(ActivityLogTable))).scalar()
+
+
+@pytest.mark.asyncio
+async def test_archive_moves_months_past_retention(sqlite_db):
+    await write_activity_rows(_rows(
+        datetime(2025, 1, 5), datetime(2025, 1, 20), datetime(2025, 2, 10), datetime(2025, 4, 1)
+    ))
+
+    moved = await archive_activity_logs(retention_months=2, now=datetime(2025, 5, 15))
+
+    # Months before March are archived; April stays hot
+    assert moved == {"2025-01": 2, "2025-02": 1}
+    assert archived_months() == [datetime(2025, 2, 1), datetime(2025, 1, 1)]
+    assert await _hot_count(sqlite_db) == 1
+
+
+@pytest.mark.asyncio
+async def test_archive_merges_late_rows_into_existing_partition(sqlite_db):
+    await write_activity_rows(_rows(datetime(2025, 1, 5)))
+    await archive_activity_logs(retention_months=1, now=datetime(2025, 3, 1))
+    await write_activity_rows(_rows(datetime(2025, 1, 25)))
+    await archive_activity_logs(retention_months=1, now=datetime(2025, 3, 1))
+
+    rows = scan_archived_activities(user_id=mock_user_id)
+    assert [row["timestamp"] for row in rows] == [datetime(2025, 1, 25), datetime(2025, 1, 5)]
+    assert await _hot_count(sqlite_db) == 0
+
+
+def test_partition_pruning():
+    months = [datetime(2025, 3, 1), datetime(2025, 2, 1), datetime(2025, 1, 1)]
+    with patch('core.handlers.activity_archive.archived_months', return_value=months):
+        assert partitions_for_range(datetime(2025, 2, 15), datetime(2025, 2, 20)) == [datetime(2025, 2, 1)]
+        assert partitions_for_range(start=datetime(2025, 2, 1)) == months[:2]
+        assert partitions_for_range(end=datetime(2025, 1, 31)) == [datetime(2025, 1, 1)]
+        assert partitions_for_range() == months
+
+
+@pytest.mark.asyncio
+async def test_get_user_activities_reads_archive_on_demand(sqlite_db):
+    base = datetime(2025, 1, 10)
+    await write_activity_rows(_rows(*(base + timedelta(days=15 * n) for n in range(6))))
+    await archive_activity_logs(retention_months=1, now=datetime(2025, 3, 15))
+
+    # January is archived, so the hot table alone only has February onwards
+    hot = await get_user_activities(ActivityQuery(user_id=mock_user_id))
+    assert len(hot["activities"]) == 4
+
+    # Pages continue from the hot table into the archive in timestamp order
+    seen = []
+    cursor = None
+    while True:
+        page = await get_user_activities(ActivityQuery(
+            user_id=mock_user_id, limit=4, cursor=cursor, include_archived=True
+        ))
+        seen += [a["timestamp"] for a in page["activities"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert seen == sorted((base + timedelta(days=15 * n) for n in range(6)), reverse=True)
+
+    # Date ranges only touch the partitions they overlap
+    ranged = await get_user_activities(ActivityQuery(
+        user_id=mock_user_id, start_date=datetime(2025, 1, 1), end_date=datetime(2025, 1, 31), include_archived=True
+    ))
+    assert [a["timestamp"] for a in ranged["activities"]] == [datetime(2025, 1, 25), datetime(2025, 1, 10)]
+
+
+@pytest.mark.asyncio
+async def test_archive_reads_accept_timezone_aware_bounds(sqlite_db):
+    await write_activity_rows(_rows(datetime(2025, 1, 10, 12), datetime(2025, 1, 20, 12), datetime(2025, 3, 2)))
+    await archive_activity_logs(retention_months=1, now=datetime(2025, 3, 15))
+
+    # What a client sends as "2025-01-15T00:00:00Z" / "+02:00"; compared as naive UTC like the stored rows
+    query = ActivityQuery.model_validate({
+        "user_id": mock_user_id,
+        "start_date": "2025-01-15T00:00:00Z",
+        "end_date": "2025-01-20T13:30:00+02:00",
+        "include_archived": True
+    })
+    assert query.start_date == datetime(2025, 1, 15)
+    assert query.end_date == datetime(2025, 1, 20, 11, 30)
+
+    page = await get_user_activities(query)
+    assert [a["timestamp"] for a in page["activities"]] == []
+
+    widened = query.model_copy(update={"end_date": datetime(2025, 1, 20, 12)})
+    page = await get_user_activities(widened)
+    assert [a["timestamp"] for a in page["activities"]] == [datetime(2025, 1, 20, 12)]
+
+    # Direct archive reads normalize aware bounds themselves
+    rows = scan_archived_activities(start_date=datetime(2025, 1, 1, tzinfo=timezone.utc))
+    assert [row["timestamp"] for row in rows] == [datetime(2025, 1, 20, 12), datetime(2025, 1, 10, 12)]
+
+
+@pytest.mark.asyncio
+async def test_archived_rows_stay_in_rollups(sqlite_db):
+    await write_activity_rows(_rows(datetime(2025, 1, 5, 9), datetime(2025, 1, 5, 9, 30)))
+    await archive_activity_logs(retention_months=1, now=datetime(2025, 3, 1))
+
+    await rebuild_activity_rollups()
+
+    stats = await get_activity_stats("day")
+    assert stats["buckets"] == [{"bucket": datetime(2025, 1, 5), "activity_type": "TEST_ACTIVITY", "count": 2}]
+
+
+@pytest.mark.asyncio
+async def test_stream_activities_includes_archive(sqlite_db):
+    await write_activity_rows(_rows(datetime(2025, 1, 5), datetime(2025, 1, 6), datetime(2025, 3, 2)))
+    await archive_activity_logs(retention_months=1, now=datetime(2025, 3, 15))
+
+    chunks = [chunk async for chunk in stream_activities(
+        ActivityQuery(user_id=mock_user_id, include_archived=True), ["description"], batch_size=1
+    )]
+
+    assert [json.loads(chunk)["description"] for chunk in chunks] == [
+        "2025-03-02T00:00:00", "2025-01-06T00:00:00", "2025-01-05T00:00:00"
+    ]
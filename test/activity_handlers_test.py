@@ -1,10 +1,29 @@
+import asyncio
+import csv
+import io
+import json
 import pytest
-from unittest.mock import patch, MagicMock
-from datetime import datetime
-from core.handlers.activity_handlers import log_activity, get_user_activities, get_contact_with_activities
-from core.models.postgres_models import ActivityLog, ActivityQuery
+from unittest.mock import patch, MagicMock, AsyncMock
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from core.handlers.activity_handlers import (
+    log_activity,
+    log_activities,
+    activity_writer,
+    get_user_activities,
+    get_contact_with_activities,
+    get_activity_stats,
+    rebuild_activity_rollups,
+    get_activities_for_users,
+    stream_activities,
+    write_activity_rows
+)
+from core.handlers import activity_handlers
+from core.models.postgres_models import ActivityLog, ActivityQuery, ActivityBatchQuery
+from config.database import ActivityRollupTable, ContactRelationshipTable
 from fastapi import HTTPException
-import psycopg2
+
+SQLITE_DB_MODULES = ["core.handlers.activity_handlers", "core.handlers.relationship_handlers"]
 
 # Mock data
 mock_user_id = "123e4567-e89b-12d3-a456-426614174000"
@@ -17,54 +36,44 @@ mock_timestamp = datetime(2025, 1, 1, 12, 0, 0)
 
 
 @pytest.fixture
-def mock_pg_connection():
-    with patch('core.handlers.activity_handlers.get_pg_connection') as mock:
-        mock_conn = MagicMock()
-        mock_cursor = MagicMock()
-        mock_conn.__enter__.return_value = mock_conn
-        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
-        mock.return_value = mock_conn
-        yield mock, mock_conn, mock_cursor
+def mock_db_session():
+    with patch('core.handlers.activity_handlers.get_db_session') as mock:
+        mock_session = MagicMock()
+        mock_session.execute = AsyncMock(return_value=MagicMock())
+        mock_session.commit = AsyncMock()
+        mock.return_value.__aenter__.return_value = mock_session
+        yield mock, mock_session
 
 
 @pytest.fixture
-def mock_contacts_collection():
-    with patch('core.handlers.activity_handlers.contacts_collection') as mock:
+def mock_get_cached_contact():
+    with patch('core.handlers.activity_handlers.get_cached_contact', new_callable=AsyncMock) as mock:
         yield mock
 
 
-def test_log_activity(mock_pg_connection):
-    _, mock_conn, mock_cursor = mock_pg_connection
-
-    # Mock cursor.fetchone to return an ID
-    mock_cursor.fetchone.return_value = [1]
+@pytest.mark.asyncio
+async def test_log_activity(mock_db_session):
+    _, mock_session = mock_db_session
 
-    # Test with no timestamp
-    activity_id = log_activity(mock_activity)
+    # The writer is not started in tests, so the row is written straight through
+    await log_activity(mock_activity)
 
-    # Check if execute was called with right parameters
-    mock_cursor.execute.assert_called_once()
-    # Get the SQL and parameters from the call
-    sql, params = mock_cursor.execute.call_args[0]
-    assert "INSERT INTO activity_logs" in sql
-    assert params[0] == mock_user_id
-    assert params[1] == "TEST_ACTIVITY"
-    assert params[2] == "Test activity description"
+    stmt, rows = mock_session.execute.call_args_list[0][0]
+    assert "INSERT INTO activity_logs" in str(stmt)
+    assert len(rows) == 1
+    assert rows[0]["user_id"] == mock_user_id
+    assert rows[0]["activity_type"] == "TEST_ACTIVITY"
+    assert rows[0]["description"] == "Test activity description"
+    assert rows[0]["timestamp"] is not None
 
     # Check if commit was called
-    mock_conn.commit.assert_called_once()
-
-    # Check result
-    assert activity_id == 1
-
+    mock_session.commit.assert_awaited_once()
 
-def test_log_activity_with_timestamp(mock_pg_connection):
-    _, mock_conn, mock_cursor = mock_pg_connection
 
-    # Mock cursor.fetchone to return an ID
-    mock_cursor.fetchone.return_value = [1]
+@pytest.mark.asyncio
+async def test_log_activity_with_timestamp(mock_db_session):
+    _, mock_session = mock_db_session
 
-    # Create an activity with a specific timestamp
     activity_with_timestamp = ActivityLog(
         user_id=mock_user_id,
         activity_type="TEST_ACTIVITY",
@@ -72,44 +81,91 @@ def test_log_activity_with_timestamp(mock_pg_connection):
         timestamp=mock_timestamp
     )
 
-    activity_id = log_activity(activity_with_timestamp)
+    await log_activity(activity_with_timestamp)
 
     # Check if timestamp was used
-    sql, params = mock_cursor.execute.call_args[0]
-    assert params[3] == mock_timestamp
-
-    # Check result
-    assert activity_id == 1
-
-
-def test_get_user_activities_no_filters(mock_pg_connection):
-    _, _, mock_cursor = mock_pg_connection
-
-    # Mock expected return value
-    mock_cursor.fetchall.return_value = [
+    _, rows = mock_session.execute.call_args_list[0][0]
+    assert rows[0]["timestamp"] == mock_timestamp
+
+
+@pytest.mark.asyncio
+async def test_log_activities_bulk(mock_db_session):
+    _, mock_session = mock_db_session
+
+    count = await log_activities([mock_activity, mock_activity])
+
+    # One executemany-style INSERT plus one rollup upsert, committed together
+    assert mock_session.execute.await_count == 2
+    stmt, rows = mock_session.execute.call_args_list[0][0]
+    assert "INSERT INTO activity_logs" in str(stmt)
+    assert len(rows) == 2
+    assert rows[0]["user_id"] == mock_user_id
+    rollup_stmt, rollup_rows = mock_session.execute.call_args_list[1][0]
+    assert "INSERT INTO activity_rollups" in str(rollup_stmt)
+    assert len(rollup_rows) == 1
+    assert rollup_rows[0]["count"] == 2
+    mock_session.commit.assert_awaited_once()
+    assert count == 2
+
+
+@pytest.mark.asyncio
+async def test_log_activity_queues_when_writer_running(mock_db_session):
+    _, mock_session = mock_db_session
+    writer = activity_writer
+
+    await writer.start()
+    try:
+        await log_activity(mock_activity)
+        await log_activity(mock_activity)
+        await writer.flush()
+    finally:
+        await writer.stop()
+
+    # Both events were group-committed in a single INSERT (plus its rollup upsert)
+    assert mock_session.execute.await_count == 2
+    _, rows = mock_session.execute.call_args_list[0][0]
+    assert len(rows) == 2
+
+
+@pytest.mark.asyncio
+async def test_get_user_activities_no_filters(mock_db_session):
+    _, mock_session = mock_db_session
+    mock_session.execute.return_value.mappings.return_value.all.return_value = [
         {"id": 1, "user_id": mock_user_id, "activity_type": "TEST_ACTIVITY"}
     ]
 
-    # Create empty query
-    query = ActivityQuery()
+    result = await get_user_activities(ActivityQuery())
 
-    results = get_user_activities(query)
-
-    # Check SQL has no WHERE clause
-    sql, params = mock_cursor.execute.call_args[0]
+    # Check SQL has no WHERE clause and is bounded
+    stmt = mock_session.execute.call_args[0][0]
+    sql = str(stmt)
     assert "WHERE" not in sql
-    assert "ORDER BY timestamp DESC" in sql
-    assert not params  # No parameters for an empty query
+    assert "ORDER BY activity_logs.timestamp DESC, activity_logs.id DESC" in sql
+    assert "LIMIT" in sql
 
     # Check result
-    assert len(results) == 1
-    assert results[0]["user_id"] == mock_user_id
+    assert len(result["activities"]) == 1
+    assert result["activities"][0]["user_id"] == mock_user_id
+    assert result["next_cursor"] is None
+
+
+@pytest.mark.asyncio
+async def test_get_user_activities_sparse_fields(mock_db_session):
+    _, mock_session = mock_db_session
+    mock_session.execute.return_value.mappings.return_value.all.return_value = []
+
+    await get_user_activities(ActivityQuery(user_id=mock_user_id), ["id", "activity_type"])
 
+    # Only the requested columns (plus the cursor columns) are selected, so description is never read
+    stmt = mock_session.execute.call_args[0][0]
+    assert [c.name for c in stmt.selected_columns] == ["id", "timestamp", "activity_type"]
 
-def test_get_user_activities_with_filters(mock_pg_connection):
-    _, _, mock_cursor = mock_pg_connection
 
-    # Create query with filters
+@pytest.mark.asyncio
+async def test_get_user_activities_with_filters(mock_db_session):
+    _, mock_session = mock_db_session
+    mock_session.execute.return_value.mappings.return_value.all.return_value = []
+
     query = ActivityQuery(
         user_id=mock_user_id,
         activity_type="TEST_ACTIVITY",
@@ -117,59 +173,275 @@ def test_get_user_activities_with_filters(mock_pg_connection):
         end_date=datetime(2025, 1, 31)
     )
 
-    results = get_user_activities(query)
+    await get_user_activities(query)
 
     # Check SQL has WHERE clause with conditions
-    sql, params = mock_cursor.execute.call_args[0]
+    stmt = mock_session.execute.call_args[0][0]
+    sql = str(stmt)
     assert "WHERE" in sql
-    assert "user_id = %s" in sql
-    assert "activity_type = %s" in sql
-    assert "timestamp >= %s" in sql
-    assert "timestamp <= %s" in sql
-    assert params == [mock_user_id, "TEST_ACTIVITY", datetime(2025, 1, 1), datetime(2025, 1, 31)]
+    assert "activity_logs.user_id = :user_id_1" in sql
+    assert "activity_logs.activity_type = :activity_type_1" in sql
+    assert "activity_logs.timestamp >= :timestamp_1" in sql
+    assert "activity_logs.timestamp <= :timestamp_2" in sql
+    params = stmt.compile().params
+    assert params["user_id_1"] == mock_user_id
+    assert params["timestamp_1"] == datetime(2025, 1, 1)
 
 
-def test_get_contact_with_activities_success(mock_pg_connection, mock_contacts_collection):
-    _, _, mock_cursor = mock_pg_connection
+@pytest.mark.asyncio
+async def test_get_contact_with_activities_success(mock_db_session, mock_get_cached_contact):
+    _, mock_session = mock_db_session
 
-    # Mock MongoDB find_one
-    mock_contacts_collection.find_one.return_value = {
+    # Mock the cached contact lookup
+    mock_get_cached_contact.return_value = {
         "user_id": mock_user_id,
         "name": "John Doe",
         "email": "john@example.com"
     }
-
-    # Mock PostgreSQL activity logs
-    mock_cursor.fetchall.return_value = [
-        {"id": 1, "user_id": mock_user_id, "activity_type": "TEST_ACTIVITY"}
+    mock_session.execute.return_value.mappings.return_value.all.return_value = [
+        {"id": 1, "user_id": mock_user_id, "activity_type": "TEST_ACTIVITY", "timestamp": mock_timestamp}
     ]
 
-    result = get_contact_with_activities(mock_user_id)
+    result = await get_contact_with_activities(mock_user_id, limit=10)
 
-    # Check MongoDB query
-    mock_contacts_collection.find_one.assert_called_once_with(
-        {"user_id": mock_user_id},
-        {"_id": 0}
-    )
+    # Check contact lookup
+    mock_get_cached_contact.assert_awaited_once_with(mock_user_id)
 
-    # Check PostgreSQL query
-    sql, params = mock_cursor.execute.call_args[0]
-    assert "SELECT * FROM activity_logs WHERE user_id = %s" in sql
-    assert params == (mock_user_id,)
+    # The activity part is a bounded page
+    stmt = mock_session.execute.call_args[0][0]
+    assert stmt.compile().params["param_1"] == 11
 
     # Check result structure
-    assert "contact" in result
-    assert "activities" in result
     assert result["contact"]["user_id"] == mock_user_id
     assert len(result["activities"]) == 1
+    assert result["next_cursor"] is None
+    assert "relationships" not in result
+
 
+@pytest.mark.asyncio
+async def test_get_contact_with_activities_fans_out(mock_get_cached_contact):
+    activities_started = asyncio.Event()
+    relationships_started = asyncio.Event()
 
-def test_get_contact_with_activities_not_found(mock_pg_connection, mock_contacts_collection):
-    # Mock MongoDB find_one to return None
-    mock_contacts_collection.find_one.return_value = None
+    async def contact_lookup(user_id):
+        # Only completes if the other lookups were started alongside it
+        await asyncio.wait_for(activities_started.wait(), timeout=1)
+        await asyncio.wait_for(relationships_started.wait(), timeout=1)
+        return {"user_id": user_id}
+
+    async def activities_lookup(query):
+        activities_started.set()
+        return {"activities": [], "next_cursor": None}
+
+    async def relationships_lookup(user_id):
+        relationships_started.set()
+        return [{"owner_email": "owner@example.com", "relationship_type": "friend"}]
+
+    mock_get_cached_contact.side_effect = contact_lookup
+    with patch('core.handlers.activity_handlers.get_user_activities', side_effect=activities_lookup), \
+            patch('core.handlers.relationship_handlers.get_contact_owners', side_effect=relationships_lookup):
+        result = await get_contact_with_activities(mock_user_id, include_relationships=True)
+
+    assert result["contact"] == {"user_id": mock_user_id}
+    assert result["relationships"] == [{"owner_email": "owner@example.com", "relationship_type": "friend"}]
+
+
+@pytest.mark.asyncio
+async def test_get_contact_with_activities_not_found(mock_db_session, mock_get_cached_contact):
+    # Mock the cached contact lookup to return None
+    mock_get_cached_contact.return_value = None
 
     with pytest.raises(HTTPException) as excinfo:
-        get_contact_with_activities(mock_user_id)
+        await get_contact_with_activities(mock_user_id)
 
     assert excinfo.value.status_code == 404
-    assert excinfo.value.detail == "Contact not found"
\ No newline at end of file
+    assert excinfo.value.detail == "Contact not found"
+
+
+@pytest.mark.asyncio
+async def test_get_user_activities_keyset_pages(sqlite_db):
+    # Five events, two sharing a timestamp, so the id tiebreaker matters
+    base = datetime(2025, 1, 1)
+    stamps = [base, base + timedelta(minutes=1), base + timedelta(minutes=1), base + timedelta(minutes=2), base + timedelta(minutes=3)]
+    await write_activity_rows([
+        {"user_id": mock_user_id, "activity_type": "TEST_ACTIVITY", "description": str(n), "timestamp": ts}
+        for n, ts in enumerate(stamps)
+    ])
+
+    seen = []
+    cursor = None
+    while True:
+        page = await get_user_activities(ActivityQuery(user_id=mock_user_id, limit=2, cursor=cursor))
+        seen += [a["description"] for a in page["activities"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+
+    assert seen == ["4", "3", "2", "1", "0"]
+
+
+@pytest.mark.asyncio
+async def test_get_user_activities_invalid_cursor(sqlite_db):
+    with pytest.raises(HTTPException) as excinfo:
+        await get_user_activities(ActivityQuery(cursor="not-a-cursor"))
+    assert excinfo.value.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_activity_queries_use_composite_indexes(sqlite_db):
+    async with sqlite_db.connect() as conn:
+        plan = (await conn.execute(text(
+            "EXPLAIN QUERY PLAN SELECT id, timestamp FROM activity_logs "
+            "WHERE user_id = 'u' ORDER BY timestamp DESC, id DESC LIMIT 10"
+        ))).all()
+        assert "idx_activity_user_ts" in " ".join(str(row) for row in plan)
+
+        plan = (await conn.execute(text(
+            "EXPLAIN QUERY PLAN SELECT id, timestamp FROM activity_logs "
+            "WHERE activity_type = 't' ORDER BY timestamp DESC, id DESC LIMIT 10"
+        ))).all()
+        assert "idx_activity_type_ts" in " ".join(str(row) for row in plan)
+
+
+@pytest.mark.asyncio
+async def test_rollups_follow_activity_writes(sqlite_db):
+    base = datetime(2025, 1, 1, 10, 15)
+    await write_activity_rows([
+        {"user_id": "u1", "activity_type": "CONTACT_CREATED", "description": None, "timestamp": base},
+        {"user_id": "u2", "activity_type": "CONTACT_CREATED", "description": None, "timestamp": base + timedelta(minutes=30)},
+        {"user_id": "u1", "activity_type": "CONTACT_UPDATED", "description": None, "timestamp": base + timedelta(hours=1)},
+    ])
+    # A second batch lands in an existing rollup row and increments it
+    await write_activity_rows([
+        {"user_id": "u1", "activity_type": "CONTACT_CREATED", "description": None, "timestamp": base + timedelta(minutes=5)},
+        {"user_id": "u1", "activity_type": "CONTACT_CREATED", "description": None, "timestamp": base + timedelta(days=1)},
+    ])
+
+    hourly = await get_activity_stats("hour")
+    assert hourly["buckets"] == [
+        {"bucket": datetime(2025, 1, 1, 10), "activity_type": "CONTACT_CREATED", "count": 3},
+        {"bucket": datetime(2025, 1, 1, 11), "activity_type": "CONTACT_UPDATED", "count": 1},
+        {"bucket": datetime(2025, 1, 2, 10), "activity_type": "CONTACT_CREATED", "count": 1},
+    ]
+
+    daily = await get_activity_stats("day", end=datetime(2025, 1, 1, 23, 59))
+    assert daily["buckets"] == [
+        {"bucket": datetime(2025, 1, 1), "activity_type": "CONTACT_CREATED", "count": 3},
+        {"bucket": datetime(2025, 1, 1), "activity_type": "CONTACT_UPDATED", "count": 1},
+    ]
+
+    per_user = await get_activity_stats("day", user_id="u2")
+    assert per_user["buckets"] == [{"bucket": datetime(2025, 1, 1), "activity_type": "CONTACT_CREATED", "count": 1}]
+
+    # Bounds are inclusive at the interval's granularity: a bare date covers the whole day
+    one_day = await get_activity_stats("day", start=datetime(2025, 1, 1), end=datetime(2025, 1, 1))
+    assert one_day["buckets"] == daily["buckets"]
+    one_hour = await get_activity_stats("hour", start=datetime(2025, 1, 1, 10, 45), end=datetime(2025, 1, 1, 10, 15))
+    assert one_hour["buckets"] == [{"bucket": datetime(2025, 1, 1, 10), "activity_type": "CONTACT_CREATED", "count": 3}]
+
+
+@pytest.mark.asyncio
+async def test_rebuild_activity_rollups(sqlite_db):
+    base = datetime(2025, 1, 1, 10)
+    await write_activity_rows([
+        {"user_id": "u1", "activity_type": "TEST_ACTIVITY", "description": None, "timestamp": base + timedelta(minutes=n)}
+        for n in range(4)
+    ])
+    # Simulate rollups that drifted (or predate the rollup table)
+    async with sqlite_db.begin() as conn:
+        await conn.execute(ActivityRollupTable.__table__.delete())
+
+    assert await rebuild_activity_rollups(batch_size=2) == 1
+    stats = await get_activity_stats()
+    assert stats["buckets"] == [{"bucket": base, "activity_type": "TEST_ACTIVITY", "count": 4}]
+
+
+@pytest.mark.asyncio
+async def test_stream_activities_ndjson_in_batches(sqlite_db):
+    base = datetime(2025, 1, 1)
+    await write_activity_rows([
+        {"user_id": mock_user_id, "activity_type": "TEST_ACTIVITY", "description": str(n), "timestamp": base + timedelta(minutes=n)}
+        for n in range(5)
+    ] + [{"user_id": "other", "activity_type": "TEST_ACTIVITY", "description": "x", "timestamp": base}])
+
+    chunks = [chunk async for chunk in stream_activities(
+        ActivityQuery(user_id=mock_user_id, limit=1), ["description"], batch_size=2
+    )]
+
+    # One chunk per batch; limit does not cap an export
+    assert len(chunks) == 3
+    lines = [json.loads(line) for line in "".join(chunks).splitlines()]
+    assert [line["description"] for line in lines] == ["4", "3", "2", "1", "0"]
+    assert set(lines[0]) == {"id", "timestamp", "description"}
+
+
+@pytest.mark.asyncio
+async def test_stream_activities_csv(sqlite_db):
+    await write_activity_rows([
+        {"user_id": mock_user_id, "activity_type": "TEST_ACTIVITY", "description": "a, quoted \"value\"", "timestamp": mock_timestamp}
+    ])
+
+    body = "".join([chunk async for chunk in stream_activities(ActivityQuery(), export_format="csv")])
+
+    rows = list(csv.reader(io.StringIO(body)))
+    assert rows[0] == ["id", "user_id", "activity_type", "description", "timestamp"]
+    assert rows[1][1:4] == [mock_user_id, "TEST_ACTIVITY", 'a, quoted "value"']
+    assert len(rows) == 2
+
+
+@pytest.mark.asyncio
+async def test_get_contact_with_activities_relationships(sqlite_db, mock_get_cached_contact):
+    mock_get_cached_contact.return_value = {"user_id": mock_user_id}
+    async with sqlite_db.begin() as conn:
+        await conn.execute(ContactRelationshipTable.__table__.insert(), [
+            {"owner_email": "a@example.com", "linked_user_id": mock_user_id, "relationship_type": "friend"},
+            {"owner_email": "b@example.com", "linked_user_id": "someone-else", "relationship_type": "friend"},
+        ])
+    await write_activity_rows([
+        {"user_id": mock_user_id, "activity_type": "TEST_ACTIVITY", "description": str(n), "timestamp": mock_timestamp + timedelta(minutes=n)}
+        for n in range(3)
+    ])
+
+    result = await get_contact_with_activities(mock_user_id, limit=2, include_relationships=True)
+
+    assert [a["description"] for a in result["activities"]] == ["2", "1"]
+    assert result["next_cursor"] is not None
+    # Same reverse lookup as GET /relationships/owners/{user_id}
+    assert [(r["owner_email"], r["relationship_type"]) for r in result["relationships"]] == [("a@example.com", "friend")]
+    assert result["relationships"][0]["created_at"] is not None
+
+
+@pytest.mark.asyncio
+async def test_get_activities_for_users_single_statement(sqlite_db):
+    await write_activity_rows([
+        {"user_id": user_id, "activity_type": "TEST_ACTIVITY", "description": f"{user_id}-{n}", "timestamp": mock_timestamp + timedelta(minutes=n)}
+        for user_id in ("u1", "u2", "u3")
+        for n in range(4)
+    ])
+
+    with patch('core.handlers.activity_handlers.get_db_session', wraps=activity_handlers.get_db_session) as sessions:
+        result = await get_activities_for_users(ActivityBatchQuery(user_ids=["u2", "u1", "u2", "nobody"], limit=2))
+
+    # One session for the whole batch
+    assert sessions.call_count == 1
+    assert list(result["results"]) == ["u2", "u1", "nobody"]
+    assert [a["description"] for a in result["results"]["u2"]] == ["u2-3", "u2-2"]
+    assert [a["description"] for a in result["results"]["u1"]] == ["u1-3", "u1-2"]
+    assert result["results"]["nobody"] == []
+
+
+@pytest.mark.asyncio
+async def test_get_activities_for_users_sparse_fields(mock_db_session):
+    _, mock_session = mock_db_session
+    mock_session.execute.return_value.mappings.return_value.all.return_value = [
+        {"id": 1, "timestamp": mock_timestamp, "activity_type": "TEST_ACTIVITY", "user_id": "u1"}
+    ]
+
+    result = await get_activities_for_users(ActivityBatchQuery(user_ids=["u1"]), ["activity_type"])
+
+    stmt = mock_session.execute.call_args[0][0]
+    sql = str(stmt)
+    assert "row_number() OVER (PARTITION BY activity_logs.user_id" in sql
+    assert "description" not in sql
+    # user_id is selected for grouping but only returned when asked for
+    assert result["results"]["u1"] == [{"id": 1, "timestamp": mock_timestamp, "activity_type": "TEST_ACTIVITY"}]
@@ -0,0 +1,105 @@
+import asyncio
+import pytest
+from utilities.batch_writer import BatchWriter
+
+
+class RecordingSink:
+    def __init__(self, failures: int = 0):
+        self.batches = []
+        self.failures = failures
+
+    async def __call__(self, batch):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database is locked")
+        self.batches.append(list(batch))
+
+
+@pytest.mark.asyncio
+async def test_writes_through_when_not_started():
+    sink = RecordingSink()
+    writer = BatchWriter(sink, batch_size=2)
+
+    await writer.submit("a")
+    await writer.submit_many(["b", "c", "d"])
+
+    assert sink.batches == [["a"], ["b", "c"], ["d"]]
+
+
+@pytest.mark.asyncio
+async def test_synchronous_mode_never_starts_a_task():
+    sink = RecordingSink()
+    writer = BatchWriter(sink, synchronous=True)
+
+    await writer.start()
+    await writer.submit("a")
+
+    assert not writer.running
+    assert sink.batches == [["a"]]
+
+
+@pytest.mark.asyncio
+async def test_groups_items_by_batch_size():
+    sink = RecordingSink()
+    writer = BatchWriter(sink, batch_size=3, flush_interval=10)
+    await writer.start()
+
+    await writer.submit_many(list(range(7)))
+    await writer.stop()
+
+    # Full batches go out immediately; stop() flushes the remainder
+    assert sink.batches == [[0, 1, 2], [3, 4, 5], [6]]
+    assert writer.written == 7
+
+
+@pytest.mark.asyncio
+async def test_flushes_after_interval():
+    sink = RecordingSink()
+    writer = BatchWriter(sink, batch_size=100, flush_interval=0.01)
+    await writer.start()
+
+    await writer.submit("a")
+    await writer.submit("b")
+    await asyncio.wait_for(writer.flush(), timeout=1)
+
+    assert sink.batches == [["a", "b"]]
+    await writer.stop()
+
+
+@pytest.mark.asyncio
+async def test_bounded_queue_applies_backpressure():
+    release = asyncio.Event()
+    written = []
+
+    async def slow_sink(batch):
+        await release.wait()
+        written.extend(batch)
+
+    writer = BatchWriter(slow_sink, batch_size=1, flush_interval=0, max_queue_size=2)
+    await writer.start()
+
+    await writer.submit(1)          # picked up by the flusher, which blocks in the sink
+    await asyncio.sleep(0)
+    await writer.submit(2)
+    await writer.submit(3)          # queue is now full
+    producer = asyncio.create_task(writer.submit(4))
+    await asyncio.sleep(0.01)
+    assert not producer.done()
+
+    release.set()
+    await asyncio.wait_for(producer, timeout=1)
+    await writer.stop()
+    assert written == [1, 2, 3, 4]
+
+
+@pytest.mark.asyncio
+async def test_retries_failed_batches():
+    sink = RecordingSink(failures=1)
+    writer = BatchWriter(sink, batch_size=10, flush_interval=0.01)
+    await writer.start()
+
+    await writer.submit("a")
+    await writer.stop()
+
+    assert sink.batches == [["a"]]
+    assert writer.dropped == 0
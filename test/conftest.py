@@ -0,0 +1,29 @@
+import pytest_asyncio
+from contextlib import asynccontextmanager, ExitStack
+from unittest.mock import patch
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import StaticPool
+from config.database import Base
+
+
+@pytest_asyncio.fixture
+async def sqlite_db(request):
+    """Real in-memory SQLite database behind get_db_session.
+
+    The session factory is patched into every module named in the test module's SQLITE_DB_MODULES.
+    """
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+    @asynccontextmanager
+    async def session():
+        async with session_factory() as db:
+            yield db
+
+    with ExitStack() as stack:
+        for module in getattr(request.module, "SQLITE_DB_MODULES", ()):
+            stack.enter_context(patch(f"{module}.get_db_session", session))
+        yield engine
+    await engine.dispose()
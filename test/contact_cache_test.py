@@ -0,0 +1,205 @@
+import asyncio
+import pytest
+from unittest.mock import patch, AsyncMock, MagicMock
+from utilities.ttl_cache import LRUTTLCache
+from config.database import CONTACT_PROJECTION
+from core.handlers.contact_cache import (
+    contact_cache,
+    contact_writes,
+    cache_contact,
+    invalidate_contact,
+    get_cached_contact,
+    get_cached_contacts
+)
+
+# Mock data
+mock_contact_data = {
+    "user_id": "id1",
+    "name": "John Doe",
+    "email": "john@example.com",
+    "phone": 1234567890
+}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(autouse=True)
+def clear_contact_cache():
+    contact_cache.clear()
+    yield
+    contact_cache.clear()
+
+
+@pytest.fixture
+def mock_contacts_collection():
+    with patch('core.handlers.contact_cache.contacts_collection') as mock:
+        mock.find_one = AsyncMock()
+        yield mock
+
+
+def test_lru_eviction_and_counters():
+    cache = LRUTTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "a" becomes most recently used
+    cache.set("c", 3)           # evicts "b"
+
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+    stats = cache.stats()
+    assert stats["size"] == 2
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["evictions"] == 1
+
+
+def test_ttl_expiry():
+    clock = FakeClock()
+    cache = LRUTTLCache(maxsize=10, ttl=5, clock=clock)
+    cache.set("a", 1)
+
+    clock.now = 4.9
+    assert cache.get("a") == 1
+
+    clock.now = 5.0
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_get_cached_contact_reads_through_once(mock_contacts_collection):
+    mock_contacts_collection.find_one.return_value = dict(mock_contact_data)
+
+    first = await get_cached_contact("id1")
+    second = await get_cached_contact("id1")
+
+    mock_contacts_collection.find_one.assert_awaited_once_with({"user_id": "id1"}, CONTACT_PROJECTION)
+    assert first == second == mock_contact_data
+
+    # Callers get copies, so annotating a result leaves the cache untouched
+    second["relationship_type"] = "Friend"
+    assert "relationship_type" not in (await get_cached_contact("id1"))
+
+
+@pytest.mark.asyncio
+async def test_get_cached_contact_does_not_cache_misses(mock_contacts_collection):
+    mock_contacts_collection.find_one.return_value = None
+
+    assert await get_cached_contact("missing") is None
+    assert await get_cached_contact("missing") is None
+    assert mock_contacts_collection.find_one.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_get_cached_contacts_fetches_only_misses(mock_contacts_collection):
+    cache_contact(mock_contact_data)
+    mock_contacts_collection.find.return_value.to_list = AsyncMock(return_value=[
+        {"user_id": "id2", "name": "Jane Doe", "email": "jane@example.com", "phone": 9876543210}
+    ])
+
+    result = await get_cached_contacts(["id1", "id2", "id3"])
+
+    mock_contacts_collection.find.assert_called_once_with({"user_id": {"$in": ["id2", "id3"]}}, CONTACT_PROJECTION)
+    assert set(result) == {"id1", "id2"}
+
+
+@pytest.mark.asyncio
+async def test_invalidate_contact(mock_contacts_collection):
+    cache_contact({**mock_contact_data, "_id": "mongo-id"})
+    assert (await get_cached_contact("id1")) == mock_contact_data
+
+    invalidate_contact("id1")
+    mock_contacts_collection.find_one.return_value = None
+
+    assert await get_cached_contact("id1") is None
+
+
+@pytest.mark.asyncio
+async def test_get_cached_contacts_sparse_fields(mock_contacts_collection):
+    cache_contact(mock_contact_data)
+    mock_contacts_collection.find.return_value.to_list = AsyncMock(return_value=[{"user_id": "id2", "name": "Jane Doe"}])
+
+    result = await get_cached_contacts(["id1", "id2"], ["name"])
+
+    # Misses use a narrow projection and the partial documents stay out of the cache
+    mock_contacts_collection.find.assert_called_once_with(
+        {"user_id": {"$in": ["id2"]}}, {"_id": 0, "user_id": 1, "name": 1}
+    )
+    assert result["id1"] == {"user_id": "id1", "name": "John Doe"}
+    assert contact_cache.get("id2") is None
+
+
+@pytest.mark.asyncio
+async def test_get_cached_contacts_empty_fieldset_keeps_only_user_id(mock_contacts_collection):
+    cache_contact(mock_contact_data)
+    mock_contacts_collection.find.return_value.to_list = AsyncMock(return_value=[{"user_id": "id2"}])
+
+    result = await get_cached_contacts(["id1", "id2"], [])
+
+    # [] is an explicit empty selection, not "no fieldset"
+    mock_contacts_collection.find.assert_called_once_with({"user_id": {"$in": ["id2"]}}, {"_id": 0, "user_id": 1})
+    assert result == {"id1": {"user_id": "id1"}, "id2": {"user_id": "id2"}}
+    assert contact_cache.get("id2") is None
+
+
+@pytest.mark.asyncio
+async def test_read_through_does_not_cache_over_concurrent_writes(mock_contacts_collection):
+    release = asyncio.Event()
+
+    async def slow_find_one(*args):
+        await release.wait()
+        return dict(mock_contact_data)
+
+    mock_contacts_collection.find_one.side_effect = slow_find_one
+
+    # The contact is deleted while the read is waiting on MongoDB
+    pending = asyncio.create_task(get_cached_contact("id1"))
+    await asyncio.sleep(0)
+    invalidate_contact("id1")
+    release.set()
+
+    assert (await pending)["name"] == "John Doe"
+    assert contact_cache.get("id1") is None
+
+    # Same for an update racing a bulk read
+    release.clear()
+
+    async def slow_to_list(length=None):
+        await release.wait()
+        return [dict(mock_contact_data)]
+
+    mock_contacts_collection.find.return_value = MagicMock(to_list=slow_to_list)
+    pending = asyncio.create_task(get_cached_contacts(["id1"]))
+    await asyncio.sleep(0)
+    cache_contact({**mock_contact_data, "name": "Jane Doe"})
+    release.set()
+    await pending
+
+    assert contact_cache.get("id1")["name"] == "Jane Doe"
+    # Nothing is remembered once no read is in flight
+    assert contact_writes.last_write == {}
+
+
+@pytest.mark.asyncio
+async def test_read_through_still_caches_other_contacts(mock_contacts_collection):
+    release = asyncio.Event()
+
+    async def slow_find_one(*args):
+        await release.wait()
+        return dict(mock_contact_data)
+
+    mock_contacts_collection.find_one.side_effect = slow_find_one
+    pending = asyncio.create_task(get_cached_contact("id1"))
+    await asyncio.sleep(0)
+    invalidate_contact("someone-else")
+    release.set()
+    await pending
+
+    assert contact_cache.get("id1") == mock_contact_data
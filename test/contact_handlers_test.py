@@ -1,7 +1,22 @@
+import json
 import pytest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 from uuid import UUID
-from core.handlers.contact_handlers import add_contact, get_all_contacts, update_contact, delete_contact
+from core.handlers.contact_handlers import (
+    add_contact,
+    add_contacts_bulk,
+    parse_ndjson_contacts,
+    get_all_contacts,
+    stream_all_contacts,
+    update_contact,
+    delete_contact,
+    search_contacts,
+    search_fields,
+    version_from_if_match
+)
+from core.handlers.contact_cache import contact_cache
+from config.database import CONTACT_PROJECTION
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from core.models.contact_model import Contact
 from core.models.postgres_models import ActivityLog
 from fastapi import HTTPException
@@ -19,7 +34,7 @@ mock_contact_data = {
 
 @pytest.fixture
 def mock_uuid():
-    with patch('uuid.uuid4') as mock:
+    with patch('core.handlers.contact_handlers.uuid4') as mock:
         mock.return_value = UUID(mock_user_id)
         yield mock
 
@@ -27,23 +42,41 @@ def mock_uuid():
 @pytest.fixture
 def mock_contacts_collection():
     with patch('core.handlers.contact_handlers.contacts_collection') as mock:
+        mock.insert_one = AsyncMock()
+        mock.insert_many = AsyncMock()
+        mock.find_one = AsyncMock()
+        mock.find_one_and_update = AsyncMock()
+        mock.find_one_and_delete = AsyncMock()
+        yield mock
+
+
+@pytest.fixture(autouse=True)
+def mock_publish_change():
+    with patch('core.handlers.contact_handlers.publish_change') as mock:
+        yield mock
+
+
+@pytest.fixture(autouse=True)
+def mock_remove_contact_relationships():
+    with patch('core.handlers.contact_handlers.remove_contact_relationships', new_callable=AsyncMock) as mock:
         yield mock
 
 
 @pytest.fixture
 def mock_log_activity():
-    with patch('core.handlers.contact_handlers.log_activity') as mock:
+    with patch('core.handlers.contact_handlers.log_activity', new_callable=AsyncMock) as mock:
         yield mock
 
 
-def test_add_contact(mock_uuid, mock_contacts_collection, mock_log_activity):
+@pytest.mark.asyncio
+async def test_add_contact(mock_uuid, mock_contacts_collection, mock_log_activity):
     # Configure the mock to properly return a value for insert_one
     mock_insert_result = MagicMock()
     mock_insert_result.acknowledged = True
     mock_contacts_collection.insert_one.return_value = mock_insert_result
 
     # Test adding a new contact
-    result = add_contact(mock_contact)
+    result = await add_contact(mock_contact)
 
     # Check if insert_one was called with right data
     mock_contacts_collection.insert_one.assert_called_once()
@@ -65,38 +98,163 @@ def test_add_contact(mock_uuid, mock_contacts_collection, mock_log_activity):
     assert result["user_id"] == mock_user_id
 
 
-def test_get_all_contacts(mock_contacts_collection):
-    # Mock find() to return a list of contacts
+@pytest.mark.asyncio
+async def test_add_contact_duplicate_email(mock_uuid, mock_contacts_collection, mock_log_activity):
+    # The unique email index rejects the insert
+    mock_contacts_collection.insert_one.side_effect = DuplicateKeyError("E11000 duplicate key error")
+
+    with pytest.raises(HTTPException) as excinfo:
+        await add_contact(mock_contact)
+
+    assert excinfo.value.status_code == 409
+    mock_log_activity.assert_not_called()
+
+
+@pytest.fixture
+def mock_log_activities():
+    with patch('core.handlers.contact_handlers.log_activities', new_callable=AsyncMock) as mock:
+        yield mock
+
+
+@pytest.mark.asyncio
+async def test_add_contacts_bulk(mock_contacts_collection, mock_log_activities):
+    items = [
+        {"name": "John Doe", "email": "john@example.com", "phone": 1234567890},
+        {"name": "Jane Doe", "email": "jane@example.com", "phone": 9876543210},
+        {"name": "John Again", "email": "JOHN@example.com", "phone": 1111111111},
+        {"name": "No Email", "phone": 1},
+        "not an object",
+        {"name": "Jim Doe", "email": "Jim@Example.com", "phone": 5555555555}
+    ]
+
+    result = await add_contacts_bulk(items)
+
+    # Only the valid, distinct contacts are written, in a single unordered batch, with emails stored lowercase
+    mock_contacts_collection.insert_many.assert_awaited_once()
+    docs = mock_contacts_collection.insert_many.call_args[0][0]
+    assert [doc["email"] for doc in docs] == ["john@example.com", "jane@example.com", "jim@example.com"]
+    assert mock_contacts_collection.insert_many.call_args[1] == {"ordered": False}
+
+    # All activity rows go through one bulk call
+    mock_log_activities.assert_awaited_once()
+    activities = mock_log_activities.call_args[0][0]
+    assert [a.activity_type for a in activities] == ["CONTACT_CREATED"] * 3
+
+    assert result["created_count"] == 3
+    assert [r["status"] for r in result["results"]] == ["created", "created", "duplicate", "invalid", "invalid", "created"]
+
+
+@pytest.mark.asyncio
+async def test_add_contacts_bulk_write_errors(mock_contacts_collection, mock_log_activities):
+    mock_contacts_collection.insert_many.side_effect = BulkWriteError({
+        "writeErrors": [
+            {"index": 0, "code": 11000, "errmsg": "E11000 duplicate key error"},
+            {"index": 2, "code": 121, "errmsg": "Document failed validation"}
+        ]
+    })
+    items = [
+        {"name": "John Doe", "email": "john@example.com", "phone": 1234567890},
+        {"name": "Jane Doe", "email": "jane@example.com", "phone": 9876543210},
+        {"name": "Jim Doe", "email": "jim@example.com", "phone": 5555555555}
+    ]
+
+    result = await add_contacts_bulk(items)
+
+    assert [r["status"] for r in result["results"]] == ["duplicate", "created", "failed"]
+    assert result["results"][2]["error"] == "Document failed validation"
+    activities = mock_log_activities.call_args[0][0]
+    assert len(activities) == 1
+    assert activities[0].user_id == result["results"][1]["user_id"]
+
+
+def test_parse_ndjson_contacts():
+    body = b'{"name": "John Doe", "email": "john@example.com", "phone": 1}\n\nnot json\n'
+
+    items = parse_ndjson_contacts(body)
+
+    assert items[0]["name"] == "John Doe"
+    assert items[1] == "not json"
+
+
+@pytest.mark.asyncio
+async def test_get_all_contacts(mock_contacts_collection):
+    # Mock find().sort().limit() to return a single page of contacts
     mock_cursor = MagicMock()
-    mock_cursor.__iter__.return_value = [mock_contact_data]
-    mock_contacts_collection.find.return_value = mock_cursor
+    mock_cursor.to_list = AsyncMock(return_value=[mock_contact_data])
+    mock_contacts_collection.find.return_value.sort.return_value.limit.return_value = mock_cursor
 
-    result = get_all_contacts()
+    result = await get_all_contacts()
 
     # Check if find was called with right parameters
-    mock_contacts_collection.find.assert_called_once_with({}, {"_id": 0})
+    mock_contacts_collection.find.assert_called_once_with({}, CONTACT_PROJECTION)
+    mock_contacts_collection.find.return_value.sort.assert_called_once_with("user_id", 1)
 
     # Check result
-    assert len(result) == 1
-    assert result[0] == mock_contact_data
+    assert len(result["contacts"]) == 1
+    assert result["contacts"][0] == mock_contact_data
+    assert result["next_cursor"] is None
 
 
-def test_update_contact_success(mock_contacts_collection, mock_log_activity):
-    # Mock find_one to return a contact
-    mock_contacts_collection.find_one.return_value = mock_contact_data
+@pytest.mark.asyncio
+async def test_get_all_contacts_next_page(mock_contacts_collection):
+    # Return one more document than requested so a next cursor is produced
+    mock_cursor = MagicMock()
+    mock_cursor.to_list = AsyncMock(return_value=[{"user_id": "id1"}, {"user_id": "id2"}, {"user_id": "id3"}])
+    mock_contacts_collection.find.return_value.sort.return_value.limit.return_value = mock_cursor
 
-    updated_data = {"name": "Jane Doe", "email": "jane@example.com"}
+    result = await get_all_contacts(limit=2, after="id0")
 
-    result = update_contact(mock_user_id, updated_data)
+    mock_contacts_collection.find.assert_called_once_with({"user_id": {"$gt": "id0"}}, CONTACT_PROJECTION)
+    mock_contacts_collection.find.return_value.sort.return_value.limit.assert_called_once_with(3)
+    assert [c["user_id"] for c in result["contacts"]] == ["id1", "id2"]
+    assert result["next_cursor"] == "id2"
 
-    # Check if find_one was called
-    mock_contacts_collection.find_one.assert_called_once_with({"user_id": mock_user_id})
 
-    # Check if update_one was called with right parameters
-    mock_contacts_collection.update_one.assert_called_once_with(
-        {"user_id": mock_user_id},
-        {"$set": updated_data}
-    )
+@pytest.mark.asyncio
+async def test_get_all_contacts_sparse_fields(mock_contacts_collection):
+    mock_cursor = MagicMock()
+    mock_cursor.to_list = AsyncMock(return_value=[{"user_id": mock_user_id, "name": "John Doe"}])
+    mock_contacts_collection.find.return_value.sort.return_value.limit.return_value = mock_cursor
+
+    result = await get_all_contacts(fields=["name"])
+
+    mock_contacts_collection.find.assert_called_once_with({}, {"_id": 0, "user_id": 1, "name": 1})
+    assert result["contacts"] == [{"user_id": mock_user_id, "name": "John Doe"}]
+
+
+@pytest.mark.asyncio
+async def test_stream_all_contacts(mock_contacts_collection):
+    mock_cursor = MagicMock()
+    mock_cursor.__aiter__.return_value = [mock_contact_data]
+    mock_cursor.close = AsyncMock()
+    mock_contacts_collection.find.return_value.sort.return_value.batch_size.return_value = mock_cursor
+
+    lines = [line async for line in stream_all_contacts(batch_size=10)]
+
+    mock_contacts_collection.find.return_value.sort.return_value.batch_size.assert_called_once_with(10)
+    assert lines == [json.dumps(mock_contact_data) + "\n"]
+    mock_cursor.close.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_update_contact_success(mock_contacts_collection, mock_log_activity, mock_publish_change):
+    # find_one_and_update returns the document after the update
+    mock_contacts_collection.find_one_and_update.return_value = {**mock_contact_data, "name": "Jane Doe", "version": 2}
+
+    updated_data = {"name": "Jane Doe", "email": "jane@example.com"}
+
+    result = await update_contact(mock_user_id, updated_data)
+
+    # A single atomic round trip that bumps the version
+    mock_contacts_collection.find_one_and_update.assert_awaited_once()
+    args, kwargs = mock_contacts_collection.find_one_and_update.call_args
+    assert args[0] == {"user_id": mock_user_id}
+    assert args[1]["$inc"] == {"version": 1}
+    assert {key: args[1]["$set"][key] for key in updated_data} == updated_data
+    # Normalized search fields move together with the edited values
+    assert args[1]["$set"]["search.name"] == "jane doe"
+    assert args[1]["$set"]["search.email"] == "jane@example.com"
+    mock_contacts_collection.find_one.assert_not_called()
 
     # Check if activity was logged
     mock_log_activity.assert_called_once()
@@ -106,42 +264,101 @@ def test_update_contact_success(mock_contacts_collection, mock_log_activity):
     # Check result
     assert result["message"] == "Contact updated successfully"
     assert result["updated_fields"] == updated_data
+    assert result["version"] == 2
+
+    # The cache now holds the updated document
+    assert contact_cache.get(mock_user_id)["name"] == "Jane Doe"
+
+    # Subscribers of the change feed are notified
+    mock_publish_change.assert_called_once_with("contact.updated", {
+        "user_id": mock_user_id,
+        "updated_fields": updated_data,
+        "version": 2
+    })
+
+
+@pytest.mark.asyncio
+async def test_update_contact_normalizes_email(mock_contacts_collection, mock_log_activity):
+    mock_contacts_collection.find_one_and_update.return_value = {**mock_contact_data, "version": 2}
+
+    await update_contact(mock_user_id, {"email": " Jane@Example.com"})
 
+    # Stored lowercase, so the case-sensitive uniq_email index catches case-only twins
+    args, _ = mock_contacts_collection.find_one_and_update.call_args
+    assert args[1]["$set"]["email"] == "jane@example.com"
 
-def test_update_contact_not_found(mock_contacts_collection):
-    # Mock find_one to return None (contact not found)
-    mock_contacts_collection.find_one.return_value = None
+
+@pytest.mark.asyncio
+async def test_update_contact_ignores_protected_fields(mock_contacts_collection, mock_log_activity):
+    mock_contacts_collection.find_one_and_update.return_value = {**mock_contact_data, "version": 2}
+
+    result = await update_contact(mock_user_id, {"name": "Jane Doe", "user_id": "other", "version": 99})
+
+    assert result["updated_fields"] == {"name": "Jane Doe"}
+
+
+@pytest.mark.asyncio
+async def test_update_contact_with_matching_version(mock_contacts_collection, mock_log_activity):
+    mock_contacts_collection.find_one_and_update.return_value = {**mock_contact_data, "version": 4}
+
+    result = await update_contact(mock_user_id, {"name": "Jane Doe"}, expected_version=3)
+
+    args, _ = mock_contacts_collection.find_one_and_update.call_args
+    assert args[0] == {"user_id": mock_user_id, "version": 3}
+    assert result["version"] == 4
+
+
+@pytest.mark.asyncio
+async def test_update_contact_version_conflict(mock_contacts_collection, mock_log_activity):
+    # The versioned filter misses but the contact still exists
+    mock_contacts_collection.find_one_and_update.return_value = None
+    mock_contacts_collection.find_one.return_value = {"_id": "abc"}
+
+    with pytest.raises(HTTPException) as excinfo:
+        await update_contact(mock_user_id, {"name": "Jane Doe"}, expected_version=3)
+
+    assert excinfo.value.status_code == 412
+    mock_log_activity.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_update_contact_not_found(mock_contacts_collection):
+    mock_contacts_collection.find_one_and_update.return_value = None
 
     with pytest.raises(HTTPException) as excinfo:
-        update_contact(mock_user_id, {"name": "Jane Doe"})
+        await update_contact(mock_user_id, {"name": "Jane Doe"})
 
     assert excinfo.value.status_code == 404
     assert excinfo.value.detail == "Contact not found"
 
 
-def test_update_contact_no_valid_fields(mock_contacts_collection):
-    # Mock find_one to return a contact
-    mock_contacts_collection.find_one.return_value = mock_contact_data
-
+@pytest.mark.asyncio
+async def test_update_contact_no_valid_fields(mock_contacts_collection):
     # Empty update data or all None values
     with pytest.raises(HTTPException) as excinfo:
-        update_contact(mock_user_id, {})
+        await update_contact(mock_user_id, {})
 
     assert excinfo.value.status_code == 400
     assert excinfo.value.detail == "No valid fields to update"
+    mock_contacts_collection.find_one_and_update.assert_not_called()
 
 
-def test_delete_contact_success(mock_contacts_collection, mock_log_activity):
-    # Mock find_one to return a contact
-    mock_contacts_collection.find_one.return_value = mock_contact_data
+@pytest.mark.asyncio
+async def test_delete_contact_success(mock_contacts_collection, mock_log_activity, mock_remove_contact_relationships):
+    # find_one_and_delete returns the removed document
+    mock_contacts_collection.find_one_and_delete.return_value = mock_contact_data
+    contact_cache.set(mock_user_id, mock_contact_data)
 
-    result = delete_contact(mock_user_id)
+    result = await delete_contact(mock_user_id)
 
-    # Check if find_one was called
-    mock_contacts_collection.find_one.assert_called_once_with({"user_id": mock_user_id})
+    mock_contacts_collection.find_one_and_delete.assert_awaited_once_with(
+        {"user_id": mock_user_id},
+        projection=CONTACT_PROJECTION
+    )
+    mock_contacts_collection.find_one.assert_not_called()
 
-    # Check if delete_one was called with right parameters
-    mock_contacts_collection.delete_one.assert_called_once_with({"user_id": mock_user_id})
+    # Links to the contact are removed with it
+    mock_remove_contact_relationships.assert_awaited_once_with(mock_user_id)
 
     # Check if activity was logged
     mock_log_activity.assert_called_once()
@@ -150,14 +367,119 @@ def test_delete_contact_success(mock_contacts_collection, mock_log_activity):
 
     # Check result
     assert result["message"] == "Contact deleted successfully"
+    assert contact_cache.get(mock_user_id) is None
 
 
-def test_delete_contact_not_found(mock_contacts_collection):
-    # Mock find_one to return None (contact not found)
-    mock_contacts_collection.find_one.return_value = None
+@pytest.mark.asyncio
+async def test_delete_contact_version_conflict(mock_contacts_collection, mock_log_activity):
+    mock_contacts_collection.find_one_and_delete.return_value = None
+    mock_contacts_collection.find_one.return_value = {"_id": "abc"}
 
     with pytest.raises(HTTPException) as excinfo:
-        delete_contact(mock_user_id)
+        await delete_contact(mock_user_id, expected_version=1)
+
+    assert excinfo.value.status_code == 412
+    mock_log_activity.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_delete_contact_not_found(mock_contacts_collection, mock_remove_contact_relationships):
+    mock_contacts_collection.find_one_and_delete.return_value = None
+
+    with pytest.raises(HTTPException) as excinfo:
+        await delete_contact(mock_user_id)
 
     assert excinfo.value.status_code == 404
-    assert excinfo.value.detail == "Contact not found"
\ No newline at end of file
+    mock_remove_contact_relationships.assert_not_awaited()
+    assert excinfo.value.detail == "Contact not found"
+
+
+def test_version_from_if_match():
+    assert version_from_if_match(None) is None
+    assert version_from_if_match("*") is None
+    assert version_from_if_match('"3"') == 3
+    assert version_from_if_match('W/"7"') == 7
+
+    with pytest.raises(HTTPException) as excinfo:
+        version_from_if_match('"abc"')
+    assert excinfo.value.status_code == 400
+
+
+def test_search_fields():
+    fields = search_fields("John Doe", "John@Example.com", 1234567890)
+
+    assert fields["search.name"] == "john doe"
+    assert fields["search.name_grams"] == sorted({"joh", "ohn", "hn ", "n d", " do", "doe"})
+    assert fields["search.email"] == "john@example.com"
+    assert fields["search.phone"] == "1234567890"
+    assert search_fields(name="Al") == {"search.name": "al", "search.name_grams": []}
+
+
+@pytest.mark.asyncio
+async def test_search_contacts_prefix(mock_contacts_collection):
+    mock_contacts_collection.aggregate.return_value.to_list = AsyncMock(return_value=[mock_contact_data])
+
+    result = await search_contacts(q="Jo", limit=10)
+
+    pipeline = mock_contacts_collection.aggregate.call_args[0][0]
+    # Prefix search is an anchored regex on the lowercased, indexed field
+    assert pipeline[0] == {"$match": {"$or": [
+        {"search.name": {"$regex": "^jo"}},
+        {"search.email": {"$regex": "^jo"}}
+    ]}}
+    assert pipeline[2]["$sort"]["relevance"] == -1
+    assert pipeline[-1] == {"$project": CONTACT_PROJECTION}
+    assert result["contacts"] == [mock_contact_data]
+    assert result["next_offset"] is None
+
+
+@pytest.mark.asyncio
+async def test_search_contacts_dollar_term_is_literal(mock_contacts_collection):
+    mock_contacts_collection.aggregate.return_value.to_list = AsyncMock(return_value=[])
+
+    await search_contacts(q="$email", phone="$1")
+
+    # Every user value in the relevance expression is a $literal, never a field path
+    def user_strings(node, literal=False):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                yield from user_strings(value, literal or key == "$literal")
+        elif isinstance(node, list):
+            for value in node:
+                yield from user_strings(value, literal)
+        elif isinstance(node, str) and node.startswith("$") and not node.startswith("$search."):
+            yield node, literal
+
+    relevance = mock_contacts_collection.aggregate.call_args[0][0][1]["$addFields"]["relevance"]
+    found = list(user_strings(relevance))
+    assert {value for value, _ in found} == {"$email", "$1"}
+    assert all(literal for _, literal in found)
+
+
+@pytest.mark.asyncio
+async def test_search_contacts_substring_and_phone(mock_contacts_collection):
+    mock_contacts_collection.aggregate.return_value.to_list = AsyncMock(
+        return_value=[{"user_id": str(i)} for i in range(3)]
+    )
+
+    result = await search_contacts(q="doe", match="substring", phone="123", phone_match="prefix", limit=2, offset=4)
+
+    pipeline = mock_contacts_collection.aggregate.call_args[0][0]
+    name_clause, phone_clause = pipeline[0]["$match"]["$and"]
+    # Substring search narrows candidates through the trigram index before the regex check
+    assert name_clause["$or"][0] == {"search.name_grams": {"$all": ["doe"]}, "search.name": {"$regex": "doe"}}
+    assert phone_clause == {"search.phone": {"$regex": "^123"}}
+    assert {"$skip": 4} in pipeline and {"$limit": 3} in pipeline
+    assert len(result["contacts"]) == 2
+    assert result["next_offset"] == 6
+
+
+@pytest.mark.asyncio
+async def test_search_contacts_requires_term(mock_contacts_collection):
+    with pytest.raises(HTTPException) as excinfo:
+        await search_contacts()
+    assert excinfo.value.status_code == 400
+
+    with pytest.raises(HTTPException) as excinfo:
+        await search_contacts(q="jo", match="fuzzy")
+    assert excinfo.value.status_code == 400
@@ -1,6 +1,6 @@
 import pytest
-from unittest.mock import patch, MagicMock
-from fastapi import HTTPException
+from unittest.mock import patch, MagicMock, AsyncMock
+from fastapi import HTTPException, Response
 from core.services.contact_services import (
     add_new_contact,
     fetch_all_contacts,
@@ -16,30 +16,33 @@ mock_user_id = "123e4567-e89b-12d3-a456-426614174000"
 
 @pytest.fixture
 def mock_add_contact():
-    with patch('core.services.contact_services.add_contact') as mock:
+    with patch('core.services.contact_services.add_contact', new_callable=AsyncMock) as mock:
         mock.return_value = {"message": "Contact added successfully", "user_id": mock_user_id}
         yield mock
 
 
 @pytest.fixture
 def mock_get_all_contacts():
-    with patch('core.services.contact_services.get_all_contacts') as mock:
-        mock.return_value = [
-            {"user_id": mock_user_id, "name": "John Doe", "email": "john@example.com", "phone": 1234567890}
-        ]
+    with patch('core.services.contact_services.get_all_contacts', new_callable=AsyncMock) as mock:
+        mock.return_value = {
+            "contacts": [
+                {"user_id": mock_user_id, "name": "John Doe", "email": "john@example.com", "phone": 1234567890}
+            ],
+            "next_cursor": None
+        }
         yield mock
 
 
 @pytest.fixture
 def mock_update_contact():
-    with patch('core.services.contact_services.update_contact') as mock:
-        mock.return_value = {"message": "Contact updated successfully", "updated_fields": {"name": "Jane Doe"}}
+    with patch('core.services.contact_services.update_contact', new_callable=AsyncMock) as mock:
+        mock.return_value = {"message": "Contact updated successfully", "updated_fields": {"name": "Jane Doe"}, "version": 2}
         yield mock
 
 
 @pytest.fixture
 def mock_delete_contact():
-    with patch('core.services.contact_services.delete_contact') as mock:
+    with patch('core.services.contact_services.delete_contact', new_callable=AsyncMock) as mock:
         mock.return_value = {"message": "Contact deleted successfully"}
         yield mock
 
@@ -72,9 +75,21 @@ async def test_fetch_all_contacts(mock_get_all_contacts):
 @pytest.mark.asyncio
 async def test_update_contact_details(mock_update_contact):
     updated_data = {"name": "Jane Doe"}
-    result = await update_contact_details(mock_user_id, updated_data)
+    response = Response()
+    result = await update_contact_details(mock_user_id, updated_data, response, if_match='"1"')
 
-    # Check if handler was called with right data
-    mock_update_contact.assert_called_once_with(mock_user_id, updated_data)
+    # Check if handler was called with right data and the If-Match version
+    mock_update_contact.assert_called_once_with(mock_user_id, updated_data, 1)
+
+    # The new version is exposed as an ETag
+    assert response.headers["ETag"] == '"2"'
+
+    #
+
+@pytest.mark.asyncio
+async def test_fetch_all_contacts_rejects_unknown_fields(mock_get_all_contacts):
+    with pytest.raises(HTTPException) as excinfo:
+        await fetch_all_contacts(fields="name,password")
 
-    #
\ No newline at end of file
+    assert excinfo.value.status_code == 400
+    mock_get_all_contacts.assert_not_called()
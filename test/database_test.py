@@ -0,0 +1,249 @@
+import pytest
+from datetime import datetime
+from unittest.mock import patch, AsyncMock, MagicMock
+from sqlalchemy import text, insert, select, func, inspect
+from config.database import (
+    CONTACT_INDEXES,
+    ensure_contact_indexes,
+    find_duplicate_emails,
+    normalize_email,
+    build_engine,
+    build_async_engine,
+    ActivityLogTable,
+    ContactRelationshipTable,
+    Base,
+    dedupe_relationships,
+    seed_relationship_counts,
+    normalize_relationship_emails,
+    NORMALIZED_EMAIL_EXPR,
+    RelationshipCountTable,
+    ensure_sql_indexes
+)
+from config.migrate import migrate
+
+
+def _index_specs():
+    return {model.document["name"]: model.document for model in CONTACT_INDEXES}
+
+
+def test_contact_index_registry():
+    specs = _index_specs()
+
+    # Every lookup field used by the handlers is covered
+    assert dict(specs["uniq_user_id"]["key"]) == {"user_id": 1}
+    assert specs["uniq_user_id"]["unique"] is True
+
+    assert dict(specs["uniq_email"]["key"]) == {"email": 1}
+    assert specs["uniq_email"]["unique"] is True
+
+    assert dict(specs["idx_phone"]["key"]) == {"phone": 1}
+    assert not specs["idx_phone"].get("unique", False)
+
+    # Contact search only ever queries these normalized, indexed fields
+    for field in ("search.name", "search.email", "search.phone", "search.name_grams", "search.email_grams"):
+        assert any(dict(spec["key"]) == {field: 1} for spec in specs.values()), field
+
+
+@pytest.fixture
+def mock_contacts_collection():
+    with patch('config.database.contacts_collection') as mock_collection:
+        mock_collection.create_indexes = AsyncMock(return_value=list(_index_specs()))
+        mock_collection.index_information = AsyncMock(return_value={"_id_": {}})
+        mock_collection.aggregate.return_value.to_list = AsyncMock(return_value=[])
+        mock_collection.update_many = AsyncMock(return_value=MagicMock(modified_count=0))
+        yield mock_collection
+
+
+@pytest.mark.asyncio
+async def test_ensure_contact_indexes_is_idempotent(mock_contacts_collection):
+    mock_contacts_collection.index_information.return_value = {"_id_": {}, "uniq_email": {}}
+
+    # Running twice issues the same declaration; MongoDB treats the repeat as a no-op
+    await ensure_contact_indexes()
+    await ensure_contact_indexes()
+
+    assert mock_contacts_collection.create_indexes.await_count == 2
+    for call in mock_contacts_collection.create_indexes.call_args_list:
+        assert call[0][0] is CONTACT_INDEXES
+    # Once uniq_email exists there is nothing left to check or migrate
+    mock_contacts_collection.aggregate.assert_not_called()
+    mock_contacts_collection.update_many.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_ensure_contact_indexes_normalizes_emails_first(mock_contacts_collection):
+    await ensure_contact_indexes()
+
+    mock_contacts_collection.update_many.assert_awaited_once()
+    mock_contacts_collection.create_indexes.assert_awaited_once_with(CONTACT_INDEXES)
+
+
+@pytest.mark.asyncio
+async def test_ensure_contact_indexes_skips_uniq_email_over_duplicates(mock_contacts_collection, capsys):
+    mock_contacts_collection.aggregate.return_value.to_list.return_value = [
+        {"_id": "john@example.com", "user_ids": ["id1", "id2"], "count": 2}
+    ]
+
+    await ensure_contact_indexes()
+
+    # Startup continues with every other index; the twins are reported instead of failing the build
+    created = [index.document["name"] for index in mock_contacts_collection.create_indexes.call_args[0][0]]
+    assert "uniq_email" not in created
+    assert "uniq_user_id" in created
+    mock_contacts_collection.update_many.assert_not_called()
+    assert "uniq_email not created" in capsys.readouterr().out
+
+    assert await find_duplicate_emails() == [{"email": "john@example.com", "user_ids": ["id1", "id2"]}]
+    pipeline = mock_contacts_collection.aggregate.call_args[0][0]
+    assert pipeline[0]["$group"]["_id"] == NORMALIZED_EMAIL_EXPR
+
+
+@pytest.mark.asyncio
+async def test_duplicate_check_and_email_rewrite_use_the_same_rule(mock_contacts_collection):
+    await ensure_contact_indexes()
+
+    # Emails differing only by case or surrounding spaces are reported by the preflight iff the rewrite merges them
+    pipeline = mock_contacts_collection.aggregate.call_args[0][0]
+    update_filter, update = mock_contacts_collection.update_many.call_args[0]
+    assert pipeline[0]["$group"]["_id"] == {"$toLower": {"$trim": {"input": "$email"}}}
+    assert update_filter == {"$expr": {"$ne": ["$email", NORMALIZED_EMAIL_EXPR]}}
+    assert update == [{"$set": {"email": NORMALIZED_EMAIL_EXPR}}]
+
+
+def test_normalize_email():
+    assert normalize_email(" John.Doe@Example.COM ") == "john.doe@example.com"
+
+
+def test_sqlite_engine_applies_pragmas(tmp_path):
+    engine = build_engine(f"sqlite:///{tmp_path / 'contacts.db'}")
+    try:
+        with engine.connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            # synchronous=NORMAL is reported as 1
+            assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
+            assert conn.execute(text("PRAGMA busy_timeout")).scalar() > 0
+    finally:
+        engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_async_sqlite_engine_applies_pragmas(tmp_path):
+    engine = build_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'contacts.db'}")
+    try:
+        async with engine.connect() as conn:
+            assert (await conn.execute(text("PRAGMA journal_mode"))).scalar() == "wal"
+    finally:
+        await engine.dispose()
+
+
+def test_migrate_copies_tables_in_batches(tmp_path):
+    source_url = f"sqlite:///{tmp_path / 'source.db'}"
+    target_url = f"sqlite:///{tmp_path / 'target.db'}"
+    source = build_engine(source_url)
+    Base.metadata.create_all(bind=source)
+    with source.begin() as conn:
+        conn.execute(insert(ActivityLogTable), [
+            {"user_id": "u1", "activity_type": "TEST", "description": str(n), "timestamp": datetime(2025, 1, 1)}
+            for n in range(7)
+        ])
+    source.dispose()
+
+    counts = migrate(source_url, target_url, batch_size=3)
+
+    assert counts["activity_logs"] == 7
+    assert counts["contact_relationships"] == 0
+    target = build_engine(target_url)
+    try:
+        with target.connect() as conn:
+            assert conn.execute(select(func.count()).select_from(ActivityLogTable)).scalar() == 7
+    finally:
+        target.dispose()
+
+
+def test_dedupe_relationships_before_unique_index(tmp_path):
+    engine = build_engine(f"sqlite:///{tmp_path / 'contacts.db'}")
+    try:
+        # A table created before uniq_owner_linked existed, holding duplicate links
+        with engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE contact_relationships (id INTEGER PRIMARY KEY, owner_email VARCHAR(255) NOT NULL, "
+                "linked_user_id VARCHAR(50) NOT NULL, relationship_type VARCHAR(50), created_at DATETIME)"
+            ))
+            conn.execute(insert(ContactRelationshipTable), [
+                {"owner_email": "o@example.com", "linked_user_id": "u1", "relationship_type": "old"},
+                {"owner_email": "o@example.com", "linked_user_id": "u1", "relationship_type": "new"},
+                {"owner_email": "o@example.com", "linked_user_id": "u2", "relationship_type": "only"},
+            ])
+
+        assert dedupe_relationships(engine) == 1
+        Base.metadata.create_all(bind=engine)
+        ensure_sql_indexes(engine)
+
+        with engine.connect() as conn:
+            rows = conn.execute(
+                select(ContactRelationshipTable.linked_user_id, ContactRelationshipTable.relationship_type)
+                .order_by(ContactRelationshipTable.linked_user_id)
+            ).all()
+        assert [tuple(row) for row in rows] == [("u1", "new"), ("u2", "only")]
+        indexes = {index["name"]: index for index in inspect(engine).get_indexes("contact_relationships")}
+        assert indexes["uniq_owner_linked"]["unique"]
+
+        # Once the unique index exists the migration is a no-op
+        assert dedupe_relationships(engine) == 0
+    finally:
+        engine.dispose()
+
+
+def test_seed_relationship_counts(tmp_path):
+    engine = build_engine(f"sqlite:///{tmp_path / 'contacts.db'}")
+    try:
+        Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            conn.execute(insert(ContactRelationshipTable), [
+                {"owner_email": "a@example.com", "linked_user_id": "u1"},
+                {"owner_email": "a@example.com", "linked_user_id": "u2"},
+                {"owner_email": "b@example.com", "linked_user_id": "u1"},
+            ])
+
+        assert seed_relationship_counts(engine) == 2
+        with engine.connect() as conn:
+            counts = dict(conn.execute(select(RelationshipCountTable.owner_email, RelationshipCountTable.linked_count)).all())
+        assert counts == {"a@example.com": 2, "b@example.com": 1}
+
+        # Only seeds an empty counter table
+        assert seed_relationship_counts(engine) == 0
+    finally:
+        engine.dispose()
+
+
+def test_normalize_relationship_emails(tmp_path):
+    engine = build_engine(f"sqlite:///{tmp_path / 'contacts.db'}")
+    try:
+        Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            conn.execute(insert(ContactRelationshipTable), [
+                {"owner_email": "John.Doe@example.com", "linked_user_id": "u1"},
+                {"owner_email": "john.doe@example.com", "linked_user_id": "u1"},
+                {"owner_email": "John.Doe@example.com", "linked_user_id": "u2"},
+                {"owner_email": "b@example.com", "linked_user_id": "u1"},
+            ])
+            conn.execute(insert(RelationshipCountTable), [
+                {"owner_email": "John.Doe@example.com", "linked_count": 2},
+                {"owner_email": "john.doe@example.com", "linked_count": 1},
+                {"owner_email": "b@example.com", "linked_count": 1},
+            ])
+
+        # One case-only duplicate removed, one link rewritten
+        assert normalize_relationship_emails(engine) == 2
+        with engine.connect() as conn:
+            links = conn.execute(
+                select(ContactRelationshipTable.owner_email, ContactRelationshipTable.linked_user_id)
+                .order_by(ContactRelationshipTable.owner_email, ContactRelationshipTable.linked_user_id)
+            ).all()
+            counts = dict(conn.execute(select(RelationshipCountTable.owner_email, RelationshipCountTable.linked_count)).all())
+        assert links == [("b@example.com", "u1"), ("john.doe@example.com", "u1"), ("john.doe@example.com", "u2")]
+        assert counts == {"b@example.com": 1, "john.doe@example.com": 2}
+
+        assert normalize_relationship_emails(engine) == 0
+    finally:
+        engine.dispose()
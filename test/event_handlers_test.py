@@ -0,0 +1,132 @@
+import json
+import pytest
+from unittest.mock import patch
+from utilities.event_bus import EventBus
+from core.handlers.event_handlers import format_sse, parse_last_event_id, stream_change_events
+
+
+@pytest.fixture
+def bus():
+    bus = EventBus(history_size=3, subscriber_queue_size=2)
+    with patch('core.handlers.event_handlers.change_events', bus):
+        yield bus
+
+
+def _parse_sse(chunk):
+    fields = dict(line.split(": ", 1) for line in chunk.strip().split("\n"))
+    return int(fields["id"]), fields["event"], json.loads(fields["data"])
+
+
+@pytest.mark.asyncio
+async def test_publish_reaches_subscribers(bus):
+    subscription = bus.subscribe()
+
+    event = bus.publish("contact.created", {"user_id": "id1"})
+
+    assert event["id"] == 1
+    assert (await subscription.get(timeout=1)) is event
+    subscription.close()
+    assert bus.subscriber_count() == 0
+
+
+@pytest.mark.asyncio
+async def test_subscribe_replays_after_last_event_id(bus):
+    for n in range(3):
+        bus.publish("contact.updated", {"n": n})
+
+    subscription = bus.subscribe(last_event_id=1)
+
+    assert [(await subscription.get(timeout=1))["id"] for _ in range(2)] == [2, 3]
+
+
+def test_can_resume_only_inside_replay_window(bus):
+    for n in range(5):
+        bus.publish("contact.updated", {"n": n})
+
+    # History keeps events 3..5, so resuming after 2 is still gap-free but after 1 is not
+    assert bus.can_resume(2)
+    assert not bus.can_resume(1)
+    assert bus.can_resume(None)
+
+
+@pytest.mark.asyncio
+async def test_replay_is_not_bounded_by_subscriber_queue():
+    bus = EventBus(history_size=10, subscriber_queue_size=2)
+    for n in range(8):
+        bus.publish("contact.updated", {"n": n})
+
+    assert bus.can_resume(1)
+    subscription = bus.subscribe(last_event_id=1)
+    bus.publish("contact.updated", {"n": 8})
+
+    replayed = []
+    while subscription.pending:
+        replayed.append((await subscription.get(timeout=1))["id"])
+    assert replayed == list(range(2, 10))
+    assert not subscription.overflowed
+
+
+def test_event_ids_from_previous_process_cannot_resume():
+    previous = EventBus(history_size=10)
+    for n in range(5):
+        previous.publish("contact.updated", {"n": n})
+
+    # Ahead of this bus: a client that saw more events than this process has published
+    assert not EventBus(history_size=10).can_resume(previous.last_event_id)
+
+    # Behind a bus started from a later epoch, even once the new bus has a full window of history
+    restarted = EventBus(history_size=10, first_id=1000)
+    for n in range(20):
+        restarted.publish("contact.updated", {"n": n})
+    assert not restarted.can_resume(previous.last_event_id)
+    assert restarted.can_resume(restarted.last_event_id)
+
+
+def test_slow_subscriber_is_cut_off(bus):
+    subscription = bus.subscribe()
+    for n in range(3):
+        bus.publish("contact.updated", {"n": n})
+
+    assert subscription.overflowed
+    assert subscription.queue.qsize() == 2
+
+
+def test_format_sse():
+    chunk = format_sse({"id": 7, "type": "contact.deleted", "timestamp": "2025-01-01T00:00:00", "data": {"user_id": "id1"}})
+
+    assert chunk.endswith("\n\n")
+    assert _parse_sse(chunk) == (7, "contact.deleted", {"user_id": "id1", "timestamp": "2025-01-01T00:00:00"})
+
+
+def test_parse_last_event_id():
+    assert parse_last_event_id("42") == 42
+    assert parse_last_event_id(None) is None
+    assert parse_last_event_id("abc") is None
+
+
+@pytest.mark.asyncio
+async def test_stream_change_events_resumes_and_heartbeats(bus):
+    bus.publish("contact.created", {"user_id": "id1"})
+    bus.publish("contact.deleted", {"user_id": "id1"})
+
+    stream = stream_change_events(last_event_id=1, heartbeat=0.01)
+    assert _parse_sse(await stream.__anext__())[:2] == (2, "contact.deleted")
+    assert await stream.__anext__() == ": keep-alive\n\n"
+
+    bus.publish("relationship.added", {"owner_email": "owner@example.com", "linked_user_id": "id2"})
+    assert _parse_sse(await stream.__anext__())[:2] == (3, "relationship.added")
+
+    await stream.aclose()
+    assert bus.subscriber_count() == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_change_events_requests_resync_when_gap(bus):
+    for n in range(5):
+        bus.publish("contact.updated", {"n": n})
+
+    stream = stream_change_events(last_event_id=0, heartbeat=0.01)
+    event_id, event_type, _ = _parse_sse(await stream.__anext__())
+
+    assert (event_id, event_type) == (5, "resync")
+    await stream.aclose()
@@ -1,55 +1,20 @@
-import pytest
-from unittest.mock import patch, MagicMock
 import io
 import openpyxl
-from datetime import datetime
+import pytest
+from unittest.mock import patch, AsyncMock, MagicMock
 from fastapi import HTTPException
-from core.handlers.excel_handler import generate_contacts_excel, generate_all_users_excel
-
-# Mock data
-mock_owner_email = "owner@example.com"
-mock_linked_contacts = [
-    {
-        "user_id": "id1",
-        "name": "John Doe",
-        "email": "john@example.com",
-        "phone": 1234567890,
-        "relationship_type": "Friend"
-    },
-    {
-        "user_id": "id2",
-        "name": "Jane Doe",
-        "email": "jane@example.com",
-        "phone": 9876543210,
-        "relationship_type": "Colleague"
-    }
-]
-
-mock_contacts = [
-    {
-        "user_id": "id1",
-        "name": "John Doe",
-        "email": "john@example.com",
-        "phone": 1234567890
-    },
-    {
-        "user_id": "id2",
-        "name": "Jane Doe",
-        "email": "jane@example.com",
-        "phone": 9876543210
-    }
-]
-
-mock_relationships = [
-    ("john@example.com", "id2", "Friend"),
-    ("jane@example.com", "id1", "Colleague")
-]
+from sqlalchemy import event
+from core.handlers.excel_handler import generate_all_users_excel
+from config.database import ContactRelationshipTable, RelationshipCountTable
 
+SQLITE_DB_MODULES = ["core.handlers.excel_handler"]
 
-@pytest.fixture
-def mock_get_linked_contacts():
-    with patch('core.handlers.excel_handler.get_linked_contacts') as mock:
-        yield mock
+
+def _users(count):
+    return [
+        {"user_id": f"id{n}", "name": f"User {n}", "email": f"user{n}@example.com", "phone": 1000000000 + n}
+        for n in range(count)
+    ]
 
 
 @pytest.fixture
@@ -58,94 +23,64 @@ def mock_contacts_collection():
         yield mock
 
 
-@pytest.fixture
-def mock_pg_connection():
-    with patch('core.handlers.excel_handler.get_pg_connection') as mock:
-        mock_conn = MagicMock()
-        mock_cursor = MagicMock()
-        mock_conn.__enter__.return_value = mock_conn
-        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
-        mock.return_value = mock_conn
-        yield mock, mock_conn, mock_cursor
-
-
-def test_generate_contacts_excel_success(mock_get_linked_contacts):
-    # Mock get_linked_contacts to return test data
-    mock_get_linked_contacts.return_value = mock_linked_contacts
-
-    # Generate Excel file
-    excel_data = generate_contacts_excel(mock_owner_email)
-
-    # Check if xlsx data was returned
-    assert isinstance(excel_data, bytes)
-    assert len(excel_data) > 0
-
-    # Parse the Excel file to check its content
-    file_like_object = io.BytesIO(excel_data)
-    workbook = openpyxl.load_workbook(file_like_object)
-    worksheet = workbook["Linked Contacts"]
-
-    # Check headers (row 4 - note: openpyxl uses 1-based indexing)
-    assert worksheet.cell(row=4, column=1).value == "User ID"
-    assert worksheet.cell(row=4, column=2).value == "Name"
-    assert worksheet.cell(row=4, column=3).value == "Email"
-    assert worksheet.cell(row=4, column=4).value == "Phone"
-    assert worksheet.cell(row=4, column=5).value == "Relationship Type"
-
-    # Check data rows
-    assert worksheet.cell(row=5, column=1).value == "id1"
-    assert worksheet.cell(row=5, column=2).value == "John Doe"
-    assert worksheet.cell(row=5, column=5).value == "Friend"
-
-    assert worksheet.cell(row=6, column=1).value == "id2"
-    assert worksheet.cell(row=6, column=2).value == "Jane Doe"
-    assert worksheet.cell(row=6, column=5).value == "Colleague"
-
-
-def test_generate_contacts_excel_empty(mock_get_linked_contacts):
-    # Mock get_linked_contacts to return empty list
-    mock_get_linked_contacts.return_value = []
-
-    # Check that it raises HTTPException
-    with pytest.raises(HTTPException) as excinfo:
-        generate_contacts_excel(mock_owner_email)
+async def _report(sqlite_db, mock_contacts_collection, users):
+    """Seed every user with links to the next two users, build the report and count SQL statements"""
+    mock_contacts_collection.find.return_value = MagicMock(to_list=AsyncMock(return_value=users))
+    links = [
+        {"owner_email": user["email"], "linked_user_id": users[(n + step) % len(users)]["user_id"], "relationship_type": "Friend"}
+        for n, user in enumerate(users) for step in (1, 2)
+    ]
+    async with sqlite_db.begin() as conn:
+        await conn.execute(ContactRelationshipTable.__table__.insert(), links)
+        await conn.execute(RelationshipCountTable.__table__.insert(), [
+            {"owner_email": user["email"], "linked_count": 2} for user in users
+        ])
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(sqlite_db.sync_engine, "before_cursor_execute", listener)
+    try:
+        excel_data = await generate_all_users_excel()
+    finally:
+        event.remove(sqlite_db.sync_engine, "before_cursor_execute", listener)
+    return openpyxl.load_workbook(io.BytesIO(excel_data)), statements
+
+
+@pytest.mark.asyncio
+async def test_generate_all_users_excel(sqlite_db, mock_contacts_collection):
+    workbook, _ = await _report(sqlite_db, mock_contacts_collection, _users(3))
 
-    assert excinfo.value.status_code == 404
-    assert "No linked contacts found" in excinfo.value.detail
+    summary_sheet = workbook["Users Summary"]
+    assert summary_sheet.cell(row=4, column=5).value == "Linked Contacts"
+    assert [summary_sheet.cell(row=row, column=5).value for row in range(5, 8)] == [2, 2, 2]
 
+    details_sheet = workbook["Contact Details"]
+    rows = [[cell.value for cell in row] for row in details_sheet.iter_rows(min_row=5, max_row=10)]
+    assert [row[0] for row in rows] == sorted(row[0] for row in rows)
+    assert rows[0] == ["user0@example.com", "id1", "User 1", "user1@example.com", "1000000001", "Friend"]
+    assert details_sheet.cell(row=12, column=1).value == "Total Relationships: 6"
 
-def test_generate_all_users_excel_success(mock_contacts_collection, mock_pg_connection):
-    _, _, mock_cursor = mock_pg_connection
 
-    # Mock MongoDB contacts_collection.find to return test data
-    mock_contacts_cursor = MagicMock()
-    mock_contacts_cursor.__iter__.return_value = mock_contacts
-    mock_contacts_collection.find.return_value = mock_contacts_cursor
+@pytest.mark.asyncio
+async def test_generate_all_users_excel_statement_count_is_constant(sqlite_db, mock_contacts_collection):
+    _, small = await _report(sqlite_db, mock_contacts_collection, _users(3))
+    async with sqlite_db.begin() as conn:
+        await conn.execute(ContactRelationshipTable.__table__.delete())
+        await conn.execute(RelationshipCountTable.__table__.delete())
 
-    # Mock PostgreSQL cursor to return test data for relationship counts
-    mock_cursor.fetchall.side_effect = [
-        [("john@example.com", 2), ("jane@example.com", 1)],  # First fetchall for counts
-        mock_relationships  # Second fetchall for relationship details
-    ]
+    _, large = await _report(sqlite_db, mock_contacts_collection, _users(300))
 
-    # Generate Excel file
-    excel_data = generate_all_users_excel()
+    # One read of the maintained counters and one scan for the details, however many users there are
+    assert len(small) == len(large) == 2
+    assert "FROM relationship_counts" in large[0]
+    assert "GROUP BY" not in large[0]
 
-    # Check if xlsx data was returned
-    assert isinstance(excel_data, bytes)
-    assert len(excel_data) > 0
 
-    # Parse the Excel file to check its content
-    file_like_object = io.BytesIO(excel_data)
-    workbook = openpyxl.load_workbook(file_like_object)
+@pytest.mark.asyncio
+async def test_generate_all_users_excel_no_users(mock_contacts_collection):
+    mock_contacts_collection.find.return_value = MagicMock(to_list=AsyncMock(return_value=[]))
 
-    # Check summary sheet
-    summary_sheet = workbook["Users Summary"]
-    assert summary_sheet.cell(row=4, column=1).value == "User ID"
-    assert summary_sheet.cell(row=4, column=5).value == "Linked Contacts"
-    assert "id1" in [summary_sheet.cell(row=5, column=1).value, summary_sheet.cell(row=6, column=1).value]
+    with pytest.raises(HTTPException) as excinfo:
+        await generate_all_users_excel()
 
-    # Check details sheet
-    details_sheet = workbook["Contact Details"]
-    assert details_sheet.cell(row=4, column=1).value == "Owner Email"
-    assert details_sheet.cell(row=4, column=6).value == "Relationship Type"
\ No newline at end of file
+    assert excinfo.value.status_code == 404
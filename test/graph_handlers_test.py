@@ -0,0 +1,83 @@
+import pytest
+from unittest.mock import patch
+from fastapi import HTTPException
+from core.handlers.graph_handlers import (
+    load_relationship_graph,
+    get_mutual_contacts,
+    get_contacts_within,
+    get_shortest_path
+)
+from config.database import ContactRelationshipTable
+from utilities.relationship_graph import RelationshipGraph
+
+SQLITE_DB_MODULES = ["core.handlers.graph_handlers"]
+
+
+@pytest.fixture(autouse=True)
+def graph():
+    graph = RelationshipGraph()
+    with patch('core.handlers.graph_handlers.relationship_graph', graph):
+        yield graph
+
+
+@pytest.mark.asyncio
+async def test_load_relationship_graph(sqlite_db, graph):
+    graph.add("stale@example.com", "gone")
+    async with sqlite_db.begin() as conn:
+        await conn.execute(ContactRelationshipTable.__table__.insert(), [
+            {"owner_email": "a@example.com", "linked_user_id": f"c{n}", "relationship_type": None} for n in range(5)
+        ] + [{"owner_email": "b@example.com", "linked_user_id": "c4", "relationship_type": None}])
+
+    stats = await load_relationship_graph(batch_size=2)
+
+    assert stats == {"owners": 2, "contacts": 5, "edges": 6}
+    assert graph.contacts_of("stale@example.com") == set()
+
+
+def test_get_mutual_contacts(graph):
+    graph.load([("a@example.com", "c2"), ("a@example.com", "c1"), ("b@example.com", "c2"), ("b@example.com", "c1")])
+
+    result = get_mutual_contacts("a@example.com", "b@example.com")
+
+    assert result == {"owner_emails": ["a@example.com", "b@example.com"], "mutual_user_ids": ["c1", "c2"], "count": 2}
+
+
+def test_get_contacts_within(graph):
+    graph.load([("a@example.com", "c1"), ("b@example.com", "c1"), ("b@example.com", "c2"), ("b@example.com", "c3")])
+
+    result = get_contacts_within("a@example.com", 3, limit=2)
+
+    # Only contacts are listed, nearest first; owners are just stepping stones
+    assert result["contacts"][0] == {"user_id": "c1", "distance": 1}
+    assert result["contacts"][1] in ({"user_id": "c2", "distance": 3}, {"user_id": "c3", "distance": 3})
+    assert result["truncated"] is True
+
+    result = get_contacts_within("a@example.com", 3, limit=3)
+    assert sorted(contact["user_id"] for contact in result["contacts"]) == ["c1", "c2", "c3"]
+    assert result["truncated"] is False
+
+    with pytest.raises(HTTPException) as excinfo:
+        get_contacts_within("a@example.com", 0)
+    assert excinfo.value.status_code == 400
+
+
+def test_get_shortest_path(graph):
+    graph.load([("a@example.com", "c1"), ("b@example.com", "c1")])
+
+    result = get_shortest_path("a@example.com", to_email="b@example.com")
+    assert result == {
+        "path": [
+            {"type": "owner", "id": "a@example.com"},
+            {"type": "contact", "id": "c1"},
+            {"type": "owner", "id": "b@example.com"}
+        ],
+        "length": 2
+    }
+
+    with pytest.raises(HTTPException) as excinfo:
+        get_shortest_path("a@example.com", to_user_id="unlinked")
+    assert excinfo.value.status_code == 404
+
+    with pytest.raises(HTTPException) as excinfo:
+        get_shortest_path("a@example.com")
+    assert excinfo.value.status_code == 400
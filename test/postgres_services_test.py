@@ -0,0 +1,37 @@
+import pytest
+from unittest.mock import patch, MagicMock
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from core.services.postgres_services import search_activities
+from core.handlers.activity_handlers import encode_activity_cursor
+from core.models.postgres_models import ActivityQuery
+from datetime import datetime
+
+
+@pytest.fixture
+def mock_stream_activities():
+    with patch('core.services.postgres_services.stream_activities', MagicMock()) as mock:
+        yield mock
+
+
+@pytest.mark.asyncio
+async def test_search_activities_stream_rejects_invalid_cursor(mock_stream_activities):
+    with pytest.raises(HTTPException) as excinfo:
+        await search_activities(ActivityQuery(cursor="!!notbase64"), stream=True)
+
+    assert excinfo.value.status_code == 400
+    assert excinfo.value.detail == "Invalid cursor"
+    mock_stream_activities.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_search_activities_stream_passes_decoded_cursor(mock_stream_activities):
+    mock_stream_activities.return_value = iter([])
+    timestamp = datetime(2025, 1, 1, 12, 0)
+    query = ActivityQuery(cursor=encode_activity_cursor(timestamp, 42))
+
+    response = await search_activities(query, stream=True, format="csv")
+
+    assert isinstance(response, StreamingResponse)
+    assert response.media_type == "text/csv"
+    mock_stream_activities.assert_called_once_with(query, None, "csv", cursor=(timestamp, 42))
@@ -1,13 +1,33 @@
 import pytest
-from unittest.mock import patch, MagicMock
+from datetime import datetime, timedelta
+from unittest.mock import patch, MagicMock, AsyncMock
+from sqlalchemy import select, func, text
 from fastapi import HTTPException
 from core.handlers.relationship_handlers import (
     add_contact_relationship,
     add_bulk_relationships,
     remove_contact_relationship,
-    get_linked_contacts
+    remove_contact_relationships,
+    remove_bulk_relationships,
+    replace_relationships,
+    check_relationship_counts,
+    get_link_count,
+    get_link_counts,
+    get_contact_owners,
+    get_linked_contacts_page,
+    invalidate_linked_views_for_contact,
+    linked_view_cache
 )
-from core.models.relationship_model import ContactRelationship, ContactRelationshipBulk
+from core.models.relationship_model import (
+    ContactRelationship,
+    ContactRelationshipBulk,
+    ContactRelationshipUnlinkBulk,
+    ContactRelationshipSet
+)
+from config.database import ActivityLogTable, ContactRelationshipTable, RelationshipCountTable
+from utilities.relationship_graph import RelationshipGraph
+
+SQLITE_DB_MODULES = ["core.handlers.relationship_handlers"]
 
 # Mock data
 mock_user_id = "123e4567-e89b-12d3-a456-426614174000"
@@ -28,111 +48,473 @@ mock_contact_data = {
 def mock_db_session():
     with patch('core.handlers.relationship_handlers.get_db_session') as mock:
         mock_session = MagicMock()
-        mock.__enter__.return_value = mock_session
+        mock_session.execute = AsyncMock(return_value=MagicMock())
+        mock_session.commit = AsyncMock()
+        mock_session.rollback = AsyncMock()
+        mock_session.delete = AsyncMock()
+        mock.return_value.__aenter__.return_value = mock_session
         yield mock, mock_session
 
+
+@pytest.fixture
+def mock_get_cached_contact():
+    with patch('core.handlers.relationship_handlers.get_cached_contact', new_callable=AsyncMock) as mock:
+        yield mock
+
 @pytest.fixture
-def mock_contacts_collection():
-    with patch('core.handlers.relationship_handlers.contacts_collection') as mock:
+def mock_get_cached_contacts():
+    with patch('core.handlers.relationship_handlers.get_cached_contacts', new_callable=AsyncMock) as mock:
+        yield mock
+
+@pytest.fixture(autouse=True)
+def clear_linked_views():
+    linked_view_cache.clear()
+    yield
+    linked_view_cache.clear()
+
+@pytest.fixture(autouse=True)
+def graph():
+    graph = RelationshipGraph()
+    with patch('core.handlers.relationship_handlers.relationship_graph', graph):
+        yield graph
+
+@pytest.fixture(autouse=True)
+def mock_publish_change():
+    with patch('core.handlers.relationship_handlers.publish_change') as mock:
         yield mock
 
 @pytest.fixture
 def mock_log_activity():
-    with patch('core.handlers.relationship_handlers.log_activity') as mock:
+    with patch('core.handlers.relationship_handlers.log_activity', new_callable=AsyncMock) as mock:
         yield mock
 
-def test_add_contact_relationship_success(mock_db_session, mock_contacts_collection, mock_log_activity):
-    _, mock_session = mock_db_session
+@pytest.mark.asyncio
+async def test_add_contact_relationship_success(sqlite_db, mock_get_cached_contact, mock_log_activity, mock_publish_change):
+    mock_get_cached_contact.return_value = mock_contact_data
 
-    mock_contacts_collection.find_one.return_value = mock_contact_data
-    mock_session.add.return_value = None
-    mock_session.commit.return_value = None
+    relationship_id = await add_contact_relationship(mock_relationship)
 
-    relationship_id = add_contact_relationship(mock_relationship)
+    mock_get_cached_contact.assert_awaited_once_with(mock_user_id)
+    assert mock_log_activity.call_args[0][0].activity_type == "RELATIONSHIP_ADDED"
+    assert mock_publish_change.call_args[0][0] == "relationship.added"
+    assert relationship_id == 1
 
-    mock_contacts_collection.find_one.assert_called_once_with({"user_id": mock_user_id})
-    mock_session.add.assert_called_once()
-    mock_session.commit.assert_called_once()
-    mock_log_activity.assert_called_once()
-    assert relationship_id is not None
+@pytest.mark.asyncio
+async def test_add_contact_relationship_upserts(sqlite_db, mock_get_cached_contact, mock_log_activity, mock_publish_change, graph):
+    mock_get_cached_contact.return_value = mock_contact_data
+
+    first_id = await add_contact_relationship(mock_relationship)
+    second_id = await add_contact_relationship(ContactRelationship(
+        owner_email=mock_owner_email, linked_user_id=mock_user_id, relationship_type="Colleague"
+    ))
 
-def test_add_contact_relationship_not_found(mock_contacts_collection):
-    mock_contacts_collection.find_one.return_value = None
+    # The second link updates the first row instead of adding a duplicate
+    assert second_id == first_id
+    assert graph.contacts_of(mock_owner_email) == {mock_user_id}
+    assert mock_log_activity.call_args[0][0].activity_type == "RELATIONSHIP_UPDATED"
+    assert mock_publish_change.call_args[0][0] == "relationship.updated"
+    async with sqlite_db.connect() as conn:
+        rows = (await conn.execute(select(ContactRelationshipTable.relationship_type))).scalars().all()
+    assert rows == ["Colleague"]
+
+@pytest.mark.asyncio
+async def test_add_contact_relationship_not_found(mock_get_cached_contact):
+    mock_get_cached_contact.return_value = None
 
     with pytest.raises(HTTPException) as excinfo:
-        add_contact_relationship(mock_relationship)
+        await add_contact_relationship(mock_relationship)
 
     assert excinfo.value.status_code == 404
     assert excinfo.value.detail == "Linked contact not found"
 
-def test_add_bulk_relationships(mock_contacts_collection):
-    with patch('core.handlers.relationship_handlers.add_contact_relationship') as mock_add:
-        def side_effect(rel):
-            if rel.linked_user_id == "id1":
-                return 1
-            else:
-                raise HTTPException(status_code=404, detail="Contact not found")
+@pytest.mark.asyncio
+async def test_add_bulk_relationships(sqlite_db, mock_get_cached_contacts, mock_publish_change, graph):
+    mock_get_cached_contacts.return_value = {"id1": {"user_id": "id1"}, "id3": {"user_id": "id3"}}
+    async with sqlite_db.begin() as conn:
+        # id3 is already linked to the owner
+        await conn.execute(ContactRelationshipTable.__table__.insert().values(
+            owner_email=mock_owner_email, linked_user_id="id3", relationship_type="Colleague"
+        ))
+
+    bulk_data = ContactRelationshipBulk(
+        owner_email=mock_owner_email,
+        linked_user_ids=["id1", "id2", "id3", "id1"],
+        relationship_type="Friend"
+    )
 
-        mock_add.side_effect = side_effect
+    with patch('core.handlers.relationship_handlers.insert_activities', new_callable=AsyncMock) as mock_insert_activities:
+        result = await add_bulk_relationships(bulk_data)
 
-        bulk_data = ContactRelationshipBulk(
-            owner_email=mock_owner_email,
-            linked_user_ids=["id1", "id2"],
-            relationship_type="Friend"
-        )
+    # One $in lookup for every id
+    mock_get_cached_contacts.assert_awaited_once_with(["id1", "id2", "id3"])
+    async with sqlite_db.connect() as conn:
+        rows = (await conn.execute(
+            select(ContactRelationshipTable.linked_user_id, ContactRelationshipTable.relationship_type)
+            .order_by(ContactRelationshipTable.linked_user_id)
+        )).all()
+    assert [tuple(row) for row in rows] == [("id1", "Friend"), ("id3", "Friend")]
 
-        result = add_bulk_relationships(bulk_data)
+    activities = mock_insert_activities.call_args[0][1]
+    assert [(a.user_id, a.activity_type) for a in activities] == [("id1", "RELATIONSHIP_ADDED"), ("id3", "RELATIONSHIP_UPDATED")]
+    assert [call[0][0] for call in mock_publish_change.call_args_list] == ["relationship.added", "relationship.updated"]
 
-        assert result["added_count"] == 1
-        assert result["failed_ids"] == ["id2"]
+    assert result["added_count"] == 2
+    assert result["failed_ids"] == ["id2"]
+    assert graph.contacts_of(mock_owner_email) == {"id1", "id3"}
 
-def test_remove_contact_relationship_success(mock_db_session, mock_log_activity):
+@pytest.mark.asyncio
+async def test_add_bulk_relationships_single_statement(mock_db_session, mock_get_cached_contacts):
     _, mock_session = mock_db_session
+    mock_get_cached_contacts.return_value = {"id1": {"user_id": "id1"}}
+    mock_session.execute.return_value.all.return_value = [MagicMock(id=1, linked_user_id="id1", created_at=None)]
+
+    with patch('core.handlers.relationship_handlers.insert_activities', new_callable=AsyncMock):
+        await add_bulk_relationships(ContactRelationshipBulk(owner_email=mock_owner_email, linked_user_ids=["id1"]))
+
+    # Inserts and updates are one ON CONFLICT statement, committed once
+    mock_session.execute.assert_awaited_once()
+    sql = str(mock_session.execute.call_args[0][0])
+    assert "ON CONFLICT (owner_email, linked_user_id) DO UPDATE" in sql
+    mock_session.commit.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_add_bulk_relationships_none_found(mock_db_session, mock_get_cached_contacts):
+    mock, _ = mock_db_session
+    mock_get_cached_contacts.return_value = {}
+
+    result = await add_bulk_relationships(ContactRelationshipBulk(owner_email=mock_owner_email, linked_user_ids=["id1"]))
 
-    mock_session.query().filter().first.return_value = True
-    result = remove_contact_relationship(mock_owner_email, mock_user_id)
+    # Nothing to write, so no session is opened
+    mock.assert_not_called()
+    assert result == {"added_count": 0, "failed_ids": ["id1"]}
 
-    mock_session.query().filter().delete.assert_called_once()
-    mock_session.commit.assert_called_once()
+@pytest.mark.asyncio
+async def test_add_bulk_relationships_sqlite(sqlite_db, mock_get_cached_contacts):
+    mock_get_cached_contacts.return_value = {f"id{n}": {"user_id": f"id{n}"} for n in range(1000)}
+
+    result = await add_bulk_relationships(ContactRelationshipBulk(
+        owner_email=mock_owner_email,
+        linked_user_ids=[f"id{n}" for n in range(1000)] + ["missing"],
+        relationship_type="Friend"
+    ))
+
+    assert result["added_count"] == 1000
+    assert result["failed_ids"] == ["missing"]
+    async with sqlite_db.connect() as conn:
+        relationships = (await conn.execute(select(func.count()).select_from(ContactRelationshipTable))).scalar()
+        activities = (await conn.execute(
+            select(func.count()).select_from(ActivityLogTable).where(ActivityLogTable.activity_type == "RELATIONSHIP_ADDED")
+        )).scalar()
+    assert relationships == 1000
+    assert activities == 1000
+
+@pytest.mark.asyncio
+async def test_remove_contact_relationship_success(mock_db_session, mock_log_activity, graph):
+    _, mock_session = mock_db_session
+    graph.add(mock_owner_email, mock_user_id)
+
+    mock_session.execute.return_value.scalars.return_value.all.return_value = [mock_user_id]
+    result = await remove_contact_relationship(mock_owner_email, mock_user_id)
+
+    # One DELETE ... RETURNING, then the counter adjustment, in one commit
+    assert mock_session.execute.await_count == 2
+    mock_session.commit.assert_awaited_once()
     mock_log_activity.assert_called_once()
     assert result["message"] == "Relationship removed successfully"
+    assert graph.contacts_of(mock_owner_email) == set()
 
-def test_remove_contact_relationship_not_found(mock_db_session):
+@pytest.mark.asyncio
+async def test_remove_contact_relationship_not_found(mock_db_session):
     _, mock_session = mock_db_session
 
-    mock_session.query().filter().first.return_value = None
+    mock_session.execute.return_value.scalars.return_value.all.return_value = []
 
     with pytest.raises(HTTPException) as excinfo:
-        remove_contact_relationship(mock_owner_email, mock_user_id)
+        await remove_contact_relationship(mock_owner_email, mock_user_id)
 
     assert excinfo.value.status_code == 404
     assert excinfo.value.detail == "Relationship not found"
+    # Nothing was removed, so the counter is left alone
+    mock_session.execute.assert_awaited_once()
+    mock_session.commit.assert_not_called()
 
-def test_get_linked_contacts_empty(mock_db_session):
-    _, mock_session = mock_db_session
-    mock_session.query().filter().all.return_value = []
-    result = get_linked_contacts(mock_owner_email)
-    assert result == []
+@pytest.mark.asyncio
+async def test_get_contact_owners(sqlite_db):
+    async with sqlite_db.begin() as conn:
+        await conn.execute(ContactRelationshipTable.__table__.insert(), [
+            {"owner_email": "b@example.com", "linked_user_id": mock_user_id, "relationship_type": "Friend"},
+            {"owner_email": "a@example.com", "linked_user_id": mock_user_id, "relationship_type": None},
+            {"owner_email": "a@example.com", "linked_user_id": "other", "relationship_type": None},
+        ])
+        plan = (await conn.execute(text(
+            "EXPLAIN QUERY PLAN SELECT owner_email FROM contact_relationships WHERE linked_user_id = 'x'"
+        ))).all()
+    assert "idx_linked_user_id" in " ".join(str(row) for row in plan)
 
-def test_get_linked_contacts_with_data(mock_db_session, mock_contacts_collection):
-    _, mock_session = mock_db_session
+    owners = await get_contact_owners(mock_user_id)
+
+    assert [(o["owner_email"], o["relationship_type"]) for o in owners] == [("a@example.com", None), ("b@example.com", "Friend")]
 
-    mock_session.query().filter().all.return_value = [
-        MagicMock(linked_user_id="id1", relationship_type="Friend"),
-        MagicMock(linked_user_id="id2", relationship_type="Colleague")
+@pytest.mark.asyncio
+async def test_remove_contact_relationships_cascade(sqlite_db, graph, mock_publish_change):
+    async with sqlite_db.begin() as conn:
+        await conn.execute(ContactRelationshipTable.__table__.insert(), [
+            {"owner_email": "a@example.com", "linked_user_id": mock_user_id, "relationship_type": None},
+            {"owner_email": "b@example.com", "linked_user_id": mock_user_id, "relationship_type": None},
+            {"owner_email": "a@example.com", "linked_user_id": "other", "relationship_type": None},
+        ])
+    graph.load([("a@example.com", mock_user_id), ("b@example.com", mock_user_id), ("a@example.com", "other")])
+
+    removed = await remove_contact_relationships(mock_user_id)
+
+    assert removed == 2
+    async with sqlite_db.connect() as conn:
+        remaining = (await conn.execute(select(ContactRelationshipTable.linked_user_id))).scalars().all()
+        activities = (await conn.execute(
+            select(ActivityLogTable.description).where(ActivityLogTable.activity_type == "RELATIONSHIP_REMOVED")
+        )).scalars().all()
+    assert remaining == ["other"]
+    assert sorted(activities) == [
+        "Contact unlinked from a@example.com (contact deleted)",
+        "Contact unlinked from b@example.com (contact deleted)"
     ]
+    assert graph.owners_of(mock_user_id) == set()
+    assert graph.contacts_of("a@example.com") == {"other"}
+    assert mock_publish_change.call_count == 2
+
+@pytest.mark.asyncio
+async def test_remove_contact_relationships_none(sqlite_db, mock_publish_change):
+    assert await remove_contact_relationships(mock_user_id) == 0
+    mock_publish_change.assert_not_called()
+
+async def _link_rows(engine, count, owner_email=mock_owner_email):
+    async with engine.begin() as conn:
+        await conn.execute(ContactRelationshipTable.__table__.insert(), [
+            {
+                "owner_email": owner_email,
+                "linked_user_id": f"id{n:02d}",
+                "relationship_type": "Friend",
+                "created_at": datetime(2025, 1, 1) + timedelta(minutes=(n * 7) % count)
+            }
+            for n in range(count)
+        ])
+
+def _contacts_for(user_ids, fields=None):
+    return {user_id: {"user_id": user_id, "name": user_id.upper()} for user_id in user_ids if user_id != "id03"}
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("sort,order", [("created_at", "asc"), ("created_at", "desc"), ("linked_user_id", "desc")])
+async def test_get_linked_contacts_page_keyset(sqlite_db, mock_get_cached_contacts, sort, order):
+    await _link_rows(sqlite_db, 10)
+    mock_get_cached_contacts.side_effect = _contacts_for
+
+    seen = []
+    cursor = None
+    while True:
+        page = await get_linked_contacts_page(mock_owner_email, limit=4, cursor=cursor, sort=sort, order=order)
+        seen += [contact["user_id"] for contact in page["linked_contacts"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+
+    # Each $in only covers one page of ids
+    assert all(len(call[0][0]) <= 4 for call in mock_get_cached_contacts.call_args_list)
+    async with sqlite_db.connect() as conn:
+        column = getattr(ContactRelationshipTable, sort)
+        ordering = column.desc() if order == "desc" else column
+        expected = (await conn.execute(
+            select(ContactRelationshipTable.linked_user_id).order_by(ordering)
+        )).scalars().all()
+    # id03 has no contact document (orphaned link), so it is skipped
+    assert seen == [user_id for user_id in expected if user_id != "id03"]
+
+@pytest.mark.asyncio
+async def test_get_linked_contacts_page_relationship_type_only(sqlite_db):
+    await _link_rows(sqlite_db, 2)
+    with patch('core.handlers.contact_cache.contacts_collection') as mock_collection:
+        mock_collection.find.return_value.to_list = AsyncMock(return_value=[
+            {"user_id": "id00"}, {"user_id": "id01"}
+        ])
+        page = await get_linked_contacts_page(mock_owner_email, fields=["relationship_type"])
 
-    mock_contacts_cursor = MagicMock()
-    mock_contacts_cursor.__iter__.return_value = [
-        {"user_id": "id1", "name": "John", "email": "john@example.com", "phone": 1234567890},
-        {"user_id": "id2", "name": "Jane", "email": "jane@example.com", "phone": 9876543210}
+    # Only user_id is read from MongoDB; no name, email, phone or version leaks into the response
+    assert mock_collection.find.call_args[0][1] == {"_id": 0, "user_id": 1}
+    assert sorted(page["linked_contacts"], key=lambda c: c["user_id"]) == [
+        {"user_id": "id00", "relationship_type": "Friend"},
+        {"user_id": "id01", "relationship_type": "Friend"}
     ]
-    mock_contacts_collection.find.return_value = mock_contacts_cursor
 
-    result = get_linked_contacts(mock_owner_email)
+@pytest.mark.asyncio
+async def test_get_linked_contacts_page_cursor_for_other_sort(sqlite_db, mock_get_cached_contacts):
+    await _link_rows(sqlite_db, 3)
+    mock_get_cached_contacts.side_effect = _contacts_for
+    page = await get_linked_contacts_page(mock_owner_email, limit=1)
+
+    with pytest.raises(HTTPException) as excinfo:
+        await get_linked_contacts_page(mock_owner_email, limit=1, cursor=page["next_cursor"], sort="linked_user_id")
+    assert excinfo.value.status_code == 400
+
+@pytest.mark.asyncio
+async def test_linked_view_cache_invalidation(sqlite_db, mock_get_cached_contacts, mock_get_cached_contact, mock_log_activity, graph):
+    await _link_rows(sqlite_db, 2)
+    graph.load([(mock_owner_email, "id00"), (mock_owner_email, "id01")])
+    mock_get_cached_contacts.side_effect = _contacts_for
+
+    first = await get_linked_contacts_page(mock_owner_email)
+    second = await get_linked_contacts_page(mock_owner_email)
+    # The second read is served from the owner's cached view
+    assert second is first
+    assert mock_get_cached_contacts.await_count == 1
+
+    # Linking another contact drops the owner's view
+    mock_get_cached_contact.return_value = {"user_id": "id05"}
+    await add_contact_relationship(ContactRelationship(owner_email=mock_owner_email, linked_user_id="id05"))
+    third = await get_linked_contacts_page(mock_owner_email)
+    assert [contact["user_id"] for contact in third["linked_contacts"]] == ["id00", "id01", "id05"]
+
+    # So does an update to one of the linked contacts
+    invalidate_linked_views_for_contact("id00")
+    assert linked_view_cache.get(mock_owner_email) is None
+
+async def _links(engine, owner_email=mock_owner_email):
+    async with engine.connect() as conn:
+        rows = (await conn.execute(
+            select(ContactRelationshipTable.linked_user_id, ContactRelationshipTable.relationship_type)
+            .where(ContactRelationshipTable.owner_email == owner_email)
+            .order_by(ContactRelationshipTable.linked_user_id)
+        )).all()
+    return [tuple(row) for row in rows]
+
+async def _activity_types(engine):
+    async with engine.connect() as conn:
+        rows = (await conn.execute(
+            select(ActivityLogTable.user_id, ActivityLogTable.activity_type).order_by(ActivityLogTable.user_id)
+        )).all()
+    return [tuple(row) for row in rows]
+
+@pytest.mark.asyncio
+async def test_remove_bulk_relationships(sqlite_db, graph, mock_publish_change):
+    await _link_rows(sqlite_db, 4)
+    await _link_rows(sqlite_db, 1, owner_email="other@example.com")
+    graph.load([(mock_owner_email, f"id{n:02d}") for n in range(4)])
+
+    result = await remove_bulk_relationships(ContactRelationshipUnlinkBulk(
+        owner_email=mock_owner_email, linked_user_ids=["id00", "id02", "missing", "id00"]
+    ))
+
+    assert result == {"removed_count": 2, "not_found_ids": ["missing"]}
+    assert await _links(sqlite_db) == [("id01", "Friend"), ("id03", "Friend")]
+    # Another owner's link to the same contact is untouched
+    assert await _links(sqlite_db, "other@example.com") == [("id00", "Friend")]
+    assert await _activity_types(sqlite_db) == [("id00", "RELATIONSHIP_REMOVED"), ("id02", "RELATIONSHIP_REMOVED")]
+    assert graph.contacts_of(mock_owner_email) == {"id01", "id03"}
+    assert mock_publish_change.call_count == 2
+
+@pytest.mark.asyncio
+async def test_replace_relationships_applies_diff(sqlite_db, mock_get_cached_contacts, graph, mock_publish_change):
+    await _link_rows(sqlite_db, 3)
+    async with sqlite_db.begin() as conn:
+        await conn.execute(ContactRelationshipTable.__table__.update().where(
+            ContactRelationshipTable.linked_user_id == "id01"
+        ).values(relationship_type="Colleague"))
+    graph.load([(mock_owner_email, f"id{n:02d}") for n in range(3)])
+    mock_get_cached_contacts.side_effect = _contacts_for
+
+    # Keep id00 as is, retype id01, drop id02, add id04; id03 has no contact
+    result = await replace_relationships(mock_owner_email, ContactRelationshipSet(
+        linked_user_ids=["id00", "id01", "id04", "id03"], relationship_type="Friend"
+    ))
+
+    assert result == {
+        "added_count": 1,
+        "updated_count": 1,
+        "removed_count": 1,
+        "unchanged_count": 1,
+        "failed_ids": ["id03"]
+    }
+    assert await _links(sqlite_db) == [("id00", "Friend"), ("id01", "Friend"), ("id04", "Friend")]
+    assert await _activity_types(sqlite_db) == [
+        ("id01", "RELATIONSHIP_UPDATED"), ("id02", "RELATIONSHIP_REMOVED"), ("id04", "RELATIONSHIP_ADDED")
+    ]
+    assert graph.contacts_of(mock_owner_email) == {"id00", "id01", "id04"}
+
+@pytest.mark.asyncio
+async def test_replace_relationships_with_empty_set(sqlite_db, mock_get_cached_contacts, graph):
+    await _link_rows(sqlite_db, 2)
+
+    result = await replace_relationships(mock_owner_email, ContactRelationshipSet(linked_user_ids=[]))
+
+    mock_get_cached_contacts.assert_not_awaited()
+    assert result["removed_count"] == 2
+    assert await _links(sqlite_db) == []
+
+@pytest.mark.asyncio
+async def test_link_counts_follow_every_write_path(
+    sqlite_db, mock_get_cached_contact, mock_get_cached_contacts, mock_log_activity
+):
+    mock_get_cached_contact.return_value = {"user_id": "id00"}
+    mock_get_cached_contacts.side_effect = _contacts_for
+
+    await add_contact_relationship(ContactRelationship(owner_email=mock_owner_email, linked_user_id="id00"))
+    # Re-linking only updates the type, so the count does not move
+    await add_contact_relationship(ContactRelationship(owner_email=mock_owner_email, linked_user_id="id00", relationship_type="Friend"))
+    assert await get_link_count(mock_owner_email) == 1
+
+    await add_bulk_relationships(ContactRelationshipBulk(owner_email=mock_owner_email, linked_user_ids=["id00", "id01", "id02"]))
+    await add_bulk_relationships(ContactRelationshipBulk(owner_email="other@example.com", linked_user_ids=["id01"]))
+    assert await get_link_counts() == {mock_owner_email: 3, "other@example.com": 1}
+
+    await remove_contact_relationship(mock_owner_email, "id00")
+    await remove_bulk_relationships(ContactRelationshipUnlinkBulk(owner_email=mock_owner_email, linked_user_ids=["id02"]))
+    assert await get_link_count(mock_owner_email) == 1
+
+    await replace_relationships(mock_owner_email, ContactRelationshipSet(linked_user_ids=["id04", "id05", "id06"]))
+    assert await get_link_count(mock_owner_email) == 3
+
+    await remove_contact_relationships("id01")
+    assert await get_link_counts([mock_owner_email, "other@example.com"]) == {mock_owner_email: 3, "other@example.com": 0}
+
+    # Every path kept the counters consistent with the rows
+    assert (await check_relationship_counts())["mismatches"] == []
+    assert await get_link_count("nobody@example.com") == 0
+
+@pytest.mark.asyncio
+async def test_check_relationship_counts_repair(sqlite_db):
+    await _link_rows(sqlite_db, 3)
+    async with sqlite_db.begin() as conn:
+        await conn.execute(RelationshipCountTable.__table__.insert(), [
+            {"owner_email": mock_owner_email, "linked_count": 5},
+            {"owner_email": "gone@example.com", "linked_count": 2},
+        ])
+
+    report = await check_relationship_counts()
+    assert report["mismatches"] == [
+        {"owner_email": "gone@example.com", "stored": 2, "actual": 0},
+        {"owner_email": mock_owner_email, "stored": 5, "actual": 3},
+    ]
+    assert report["repaired"] is False
+
+    assert (await check_relationship_counts(repair=True))["repaired"] is True
+    assert await get_link_counts() == {mock_owner_email: 3}
+    assert (await check_relationship_counts())["mismatches"] == []
+
+@pytest.mark.asyncio
+async def test_remove_contact_relationship_twice_decrements_once(sqlite_db, mock_log_activity):
+    await _link_rows(sqlite_db, 2)
+    async with sqlite_db.begin() as conn:
+        await conn.execute(RelationshipCountTable.__table__.insert(), [{"owner_email": mock_owner_email, "linked_count": 2}])
+
+    await remove_contact_relationship(mock_owner_email, "id00")
+    with pytest.raises(HTTPException) as excinfo:
+        await remove_contact_relationship(mock_owner_email, "id00")
+
+    assert excinfo.value.status_code == 404
+    assert await get_link_count(mock_owner_email) == 1
+
+
+def test_relationship_models_normalize_owner_email():
+    relationship = ContactRelationship(owner_email="John.Doe@Example.COM", linked_user_id="id1")
+    bulk = ContactRelationshipUnlinkBulk(owner_email=" John.Doe@example.com", linked_user_ids=["id1"])
 
-    assert len(result) == 2
-    assert result[0]["user_id"] == "id1"
-    assert result[0]["relationship_type"] == "Friend"
-    assert result[1]["user_id"] == "id2"
-    assert result[1]["relationship_type"] == "Colleague"
+    # Stored the same way as contact emails, so counters and lookups by a contact's email line up
+    assert relationship.owner_email == bulk.owner_email == "john.doe@example.com"
@@ -0,0 +1,70 @@
+from utilities.relationship_graph import RelationshipGraph, OWNER, CONTACT
+
+
+def _graph():
+    graph = RelationshipGraph()
+    graph.load([
+        ("a@example.com", "c1"),
+        ("a@example.com", "c2"),
+        ("b@example.com", "c2"),
+        ("b@example.com", "c3"),
+        ("d@example.com", "c3"),
+        ("d@example.com", "c4"),
+    ])
+    return graph
+
+
+def test_add_and_remove_keep_both_directions():
+    graph = _graph()
+    assert graph.add("a@example.com", "c1") is False  # already linked
+    assert graph.stats() == {"owners": 3, "contacts": 4, "edges": 6}
+
+    assert graph.remove("a@example.com", "c1") is True
+    assert graph.remove("a@example.com", "c1") is False
+    assert graph.owners_of("c1") == set()
+    assert graph.stats() == {"owners": 3, "contacts": 3, "edges": 5}
+
+    graph.remove_contact("c3")
+    assert graph.contacts_of("b@example.com") == {"c2"}
+    assert graph.contacts_of("d@example.com") == {"c4"}
+
+
+def test_mutual():
+    graph = _graph()
+    assert graph.mutual("a@example.com", "b@example.com") == {"c2"}
+    assert graph.mutual("a@example.com", "d@example.com") == set()
+    assert graph.mutual("a@example.com", "nobody@example.com") == set()
+
+
+def test_within_hops():
+    graph = _graph()
+    distances = graph.within((OWNER, "a@example.com"), 3)
+    assert distances == {
+        (CONTACT, "c1"): 1,
+        (CONTACT, "c2"): 1,
+        (OWNER, "b@example.com"): 2,
+        (CONTACT, "c3"): 3,
+    }
+    assert len(graph.within((OWNER, "a@example.com"), 5, limit=2)) == 2
+
+    # With kind, only contacts count towards the limit and the walk stops at the first one past the owners
+    nearest = graph.within((OWNER, "a@example.com"), 5, limit=3, kind=CONTACT)
+    assert list(nearest.values()) == sorted(nearest.values())
+    assert [node for node in nearest if node[0] == CONTACT][-1] == (CONTACT, "c3")
+    assert (OWNER, "d@example.com") not in nearest
+
+
+def test_shortest_path():
+    graph = _graph()
+    path = graph.shortest_path((OWNER, "a@example.com"), (CONTACT, "c4"))
+    assert path == [
+        (OWNER, "a@example.com"),
+        (CONTACT, "c2"),
+        (OWNER, "b@example.com"),
+        (CONTACT, "c3"),
+        (OWNER, "d@example.com"),
+        (CONTACT, "c4"),
+    ]
+    assert graph.shortest_path((OWNER, "a@example.com"), (CONTACT, "c4"), max_hops=4) is None
+    assert graph.shortest_path((OWNER, "a@example.com"), (OWNER, "a@example.com")) == [(OWNER, "a@example.com")]
+    assert graph.shortest_path((OWNER, "a@example.com"), (CONTACT, "missing")) is None
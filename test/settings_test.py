@@ -0,0 +1,15 @@
+from config.settings import async_url_for
+
+
+def test_async_url_for_sqlite():
+    assert async_url_for("sqlite:///sqlite_contacts.db") == "sqlite+aiosqlite:///sqlite_contacts.db"
+
+
+def test_async_url_for_postgres():
+    assert async_url_for("postgresql://u:p@db/contacts") == "postgresql+asyncpg://u:p@db/contacts"
+    assert async_url_for("postgres://u:p@db/contacts") == "postgresql+asyncpg://u:p@db/contacts"
+    assert async_url_for("postgresql+psycopg2://u:p@db/contacts") == "postgresql+asyncpg://u:p@db/contacts"
+
+
+def test_async_url_for_leaves_async_urls_alone():
+    assert async_url_for("postgresql+asyncpg://u:p@db/contacts") == "postgresql+asyncpg://u:p@db/contacts"
@@ -0,0 +1,122 @@
+import asyncio
+
+_STOP = object()
+
+
+class BatchWriter:
+    """Background group-commit writer.
+
+    Items are queued by submit() and handed to an async sink in batches, flushed when
+    batch_size items are waiting or flush_interval seconds after the first one arrived.
+    The queue is bounded, so producers wait (backpressure) instead of growing memory.
+    Until start() is called, or with synchronous=True, submit() writes straight through.
+    """
+
+    def __init__(
+        self,
+        sink,
+        batch_size: int = 500,
+        flush_interval: float = 0.5,
+        max_queue_size: int = 10000,
+        max_retries: int = 3,
+        synchronous: bool = False
+    ):
+        self._sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.max_retries = max_retries
+        self.synchronous = synchronous
+        self._queue = None
+        self._task = None
+        self.written = 0
+        self.dropped = 0
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.synchronous or self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything still queued, then stop the background task"""
+        if not self.running:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def flush(self):
+        """Wait until every item submitted so far has been written"""
+        if self.running:
+            await self._queue.join()
+
+    async def submit(self, item):
+        if not self.running:
+            await self._write([item])
+            return
+        await self._queue.put(item)
+
+    async def submit_many(self, items):
+        if not self.running:
+            for start in range(0, len(items), self.batch_size):
+                await self._write(items[start:start + self.batch_size])
+            return
+        for item in items:
+            await self._queue.put(item)
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "pending": self._queue.qsize() if self._queue else 0,
+            "written": self.written,
+            "dropped": self.dropped
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is _STOP:
+                self._queue.task_done()
+                break
+
+            batch = [first]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _write(self, batch):
+        for attempt in range(self.max_retries):
+            try:
+                await self._sink(batch)
+                self.written += len(batch)
+                return
+            except Exception as e:
+                print(f"Batch write failed (attempt {attempt + 1}/{self.max_retries}): {e}")
+                if attempt + 1 < self.max_retries:
+                    await asyncio.sleep(0.1 * 2 ** attempt)
+        self.dropped += len(batch)
+        if not self.running:
+            # Synchronous callers should see the failure instead of silently losing data
+            raise RuntimeError(f"Failed to write {len(batch)} items after {self.max_retries} attempts")
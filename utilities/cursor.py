@@ -0,0 +1,19 @@
+import base64
+import json
+from fastapi import HTTPException
+
+
+def encode_cursor(payload: dict):
+    """Opaque, URL-safe page cursor for a keyset position"""
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    """Inverse of encode_cursor; anything that does not decode to an object is a 400"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return payload
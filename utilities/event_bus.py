@@ -0,0 +1,92 @@
+import asyncio
+from collections import deque
+from datetime import datetime
+from typing import Optional
+
+
+class Subscription:
+    """One consumer's view of the bus: the events replayed on connect, then a bounded queue of live events.
+
+    The replay backlog is drained before the queue and is not bounded by it, so resuming never drops events.
+    """
+
+    def __init__(self, bus, backlog, maxsize: int):
+        self._bus = bus
+        self._backlog = deque(backlog)
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def offer(self, event: dict):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A consumer that cannot keep up is cut off; it reconnects with Last-Event-ID and replays
+            self.overflowed = True
+
+    @property
+    def pending(self):
+        return bool(self._backlog) or not self.queue.empty()
+
+    async def get(self, timeout: Optional[float] = None):
+        if self._backlog:
+            return self._backlog.popleft()
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self._bus.unsubscribe(self)
+
+
+class EventBus:
+    """In-process publish/subscribe bus with monotonically increasing event IDs and a replay window.
+
+    IDs continue from first_id; starting each process from a clock-based epoch keeps IDs issued before a
+    restart below every ID issued after it, so stale Last-Event-IDs fall outside the replay window.
+    """
+
+    def __init__(self, history_size: int = 1000, subscriber_queue_size: int = 1000, first_id: int = 0):
+        self._history = deque(maxlen=history_size)
+        self._subscribers = set()
+        self._subscriber_queue_size = subscriber_queue_size
+        self._last_id = first_id
+
+    @property
+    def last_event_id(self):
+        return self._last_id
+
+    def publish(self, event_type: str, data: dict):
+        self._last_id += 1
+        event = {
+            "id": self._last_id,
+            "type": event_type,
+            "timestamp": datetime.utcnow().isoformat(),
+            "data": data
+        }
+        self._history.append(event)
+        for subscriber in list(self._subscribers):
+            subscriber.offer(event)
+        return event
+
+    def can_resume(self, last_event_id: Optional[int]):
+        """True when every event after last_event_id is still in the replay window"""
+        if last_event_id is None or last_event_id == self._last_id:
+            return True
+        if last_event_id > self._last_id:
+            # Issued by another process (or a previous run); nothing here says what was missed
+            return False
+        return bool(self._history) and self._history[0]["id"] <= last_event_id + 1
+
+    def subscribe(self, last_event_id: Optional[int] = None):
+        backlog = []
+        if last_event_id is not None:
+            backlog = [event for event in self._history if event["id"] > last_event_id]
+        subscription = Subscription(self, backlog, self._subscriber_queue_size)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
+
+    def subscriber_count(self):
+        return len(self._subscribers)
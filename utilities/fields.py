@@ -0,0 +1,16 @@
+from fastapi import HTTPException
+from typing import Optional
+
+
+def parse_fields(fields: Optional[str], allowed):
+    """Parse a comma-separated fields= parameter into an ordered list, rejecting unknown names"""
+    if not fields:
+        return None
+    requested = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in requested if name not in allowed]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(sorted(allowed))}"
+        )
+    return requested or None
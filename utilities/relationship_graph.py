@@ -0,0 +1,152 @@
+from collections import deque
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+OWNER = "owner"
+CONTACT = "contact"
+
+
+class RelationshipGraph:
+    """In-memory adjacency index over owner -> linked contact edges.
+
+    The graph is bipartite: owners (emails) link to contacts (user ids). Traversals treat
+    edges as undirected, so two owners are two hops apart when they link the same contact.
+    Nodes are (kind, key) tuples with kind OWNER or CONTACT.
+    """
+
+    def __init__(self):
+        self._contacts_of: Dict[str, Set[str]] = {}
+        self._owners_of: Dict[str, Set[str]] = {}
+        self.edges = 0
+
+    def add(self, owner: str, contact: str):
+        linked = self._contacts_of.setdefault(owner, set())
+        if contact in linked:
+            return False
+        linked.add(contact)
+        self._owners_of.setdefault(contact, set()).add(owner)
+        self.edges += 1
+        return True
+
+    def remove(self, owner: str, contact: str):
+        linked = self._contacts_of.get(owner)
+        if not linked or contact not in linked:
+            return False
+        linked.discard(contact)
+        if not linked:
+            del self._contacts_of[owner]
+        owners = self._owners_of[contact]
+        owners.discard(owner)
+        if not owners:
+            del self._owners_of[contact]
+        self.edges -= 1
+        return True
+
+    def remove_contact(self, contact: str):
+        """Drop a contact and every edge pointing at it"""
+        for owner in list(self._owners_of.get(contact, ())):
+            self.remove(owner, contact)
+
+    def clear(self):
+        self._contacts_of.clear()
+        self._owners_of.clear()
+        self.edges = 0
+
+    def load(self, edges: Iterable[Tuple[str, str]]):
+        for owner, contact in edges:
+            self.add(owner, contact)
+
+    def contacts_of(self, owner: str):
+        return self._contacts_of.get(owner, set())
+
+    def owners_of(self, contact: str):
+        return self._owners_of.get(contact, set())
+
+    def neighbours(self, node: Tuple[str, str]):
+        kind, key = node
+        if kind == OWNER:
+            return ((CONTACT, contact) for contact in self.contacts_of(key))
+        return ((OWNER, owner) for owner in self.owners_of(key))
+
+    def mutual(self, owner_a: str, owner_b: str):
+        """Contacts linked by both owners"""
+        first, second = self.contacts_of(owner_a), self.contacts_of(owner_b)
+        if len(first) > len(second):
+            first, second = second, first
+        return {contact for contact in first if contact in second}
+
+    def within(self, start: Tuple[str, str], hops: int, limit: Optional[int] = None, kind: Optional[str] = None):
+        """Breadth-first distances to nodes at most hops edges away (start excluded), in discovery order.
+
+        Stops as soon as limit nodes (only nodes of kind, when given) have been found, so a large
+        neighbourhood is never walked in full; discovery order is nearest first.
+        """
+        distances = {start: 0}
+        found = 0
+        frontier = [start]
+        for depth in range(1, hops + 1):
+            next_frontier = []
+            for node in frontier:
+                for neighbour in self.neighbours(node):
+                    if neighbour in distances:
+                        continue
+                    distances[neighbour] = depth
+                    next_frontier.append(neighbour)
+                    if kind is None or neighbour[0] == kind:
+                        found += 1
+                        if limit is not None and found >= limit:
+                            del distances[start]
+                            return distances
+            if not next_frontier:
+                break
+            frontier = next_frontier
+        del distances[start]
+        return distances
+
+    def shortest_path(self, source: Tuple[str, str], target: Tuple[str, str], max_hops: int = 6):
+        """Shortest list of nodes from source to target, or None; searches from both ends at once"""
+        if source == target:
+            return [source]
+
+        parents = {source: None}
+        children = {target: None}
+        forward, backward = deque([source]), deque([target])
+        for _ in range(max_hops):
+            # Expand the smaller frontier one full level
+            if len(forward) <= len(backward):
+                meet = self._expand(forward, parents, children)
+            else:
+                meet = self._expand(backward, children, parents)
+            if meet is not None:
+                return self._join(meet, parents, children)
+            if not forward or not backward:
+                return None
+        return None
+
+    def _expand(self, frontier: deque, seen: dict, other: dict):
+        for _ in range(len(frontier)):
+            node = frontier.popleft()
+            for neighbour in self.neighbours(node):
+                if neighbour in seen:
+                    continue
+                seen[neighbour] = node
+                if neighbour in other:
+                    return neighbour
+                frontier.append(neighbour)
+        return None
+
+    @staticmethod
+    def _join(meet, parents: dict, children: dict):
+        path = []
+        node = meet
+        while node is not None:
+            path.append(node)
+            node = parents[node]
+        path.reverse()
+        node = children[meet]
+        while node is not None:
+            path.append(node)
+            node = children[node]
+        return path
+
+    def stats(self):
+        return {"owners": len(self._contacts_of), "contacts": len(self._owners_of), "edges": self.edges}